@@ -0,0 +1,25 @@
+'''Helpers shared by the benchmark and mock scripts.
+
+percentile() of the latencies the benchmarks report, and status() and
+collection() to build iLO responses, see ilo-mock.py and ilo-bench.py.
+'''
+
+
+def percentile(values, p):
+	'''The p-th percentile of values, p is 0 to 100, 0 if values is empty'''
+	if not values:
+		return 0.0
+	values = sorted(values)
+	return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def status(health = 'OK', state = 'Enabled'):
+	'''Status of an iLO resource'''
+	return {'Health': health, 'HealthRollUp': health, 'State': state}
+
+
+def collection(uri, ids):
+	'''iLO collection at uri of the members ids'''
+	return {'Total': len(ids), 'Type': 'Collection.1.0.0', 'links': {
+		'self': {'href': uri},
+		'Member': [{'href': '{0}/{1}'.format(uri, i)} for i in ids]}}
@@ -3,24 +3,260 @@
 import select
 import socket
 import time
+import random
+import collections
 import logging
 import argparse
+import asyncio
+import threading
+import relay
 
 # Connect to server at startup, and connect to target only when there is
 # data from server socket.
 
+def _alive(sock) :
+	'''Return False if the peer of sock closed or reset it, data from the
+	peer is left in sock'''
+	try :
+		return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) != b''
+	except BlockingIOError :
+		return True
+	except socket.error :
+		return False
+
+class TargetPool:
+	'''Connected sockets to the target, so a session does not wait for
+	a TCP connect.
+
+	min_idle: connections kept ready
+	max_age: seconds a connection may wait in the pool
+	keepalive: TCP keepalive idle seconds of pooled connections, 0 is off
+
+	refill() connects in a thread of its own, so the relay loop never
+	waits for a connect; the pool is shared with it under a lock.
+	'''
+	def __init__(self, host, port, min_idle = 2, max_age = 300, keepalive = 60) :
+		self.host = host
+		self.port = port
+		self.min_idle = min_idle
+		self.max_age = max_age
+		self.keepalive = keepalive
+		# (socket, connect time), oldest first
+		self.idle = collections.deque()
+		self.lock = threading.Lock()
+		self.filling = False
+		self.closed = False
+
+	def __connect(self) :
+		try :
+			sock = socket.create_connection((self.host, self.port), timeout = 10)
+		except socket.error as e :
+			logging.error('Failed to pre-connect to target')
+			logging.error(e)
+			return None
+		sock.settimeout(None)
+		if self.keepalive > 0 :
+			sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keepalive)
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL,
+					max(1, self.keepalive // 4))
+		return sock
+
+	def __healthy(self, sock, since) :
+		if time.monotonic() - since > self.max_age :
+			return False
+		# data from the target (e.g. a banner) is kept for the session
+		return _alive(sock)
+
+	def get(self) :
+		'''Return a healthy connection or None if there is none'''
+		with self.lock :
+			while self.idle :
+				sock, since = self.idle.popleft()
+				if self.__healthy(sock, since) :
+					return sock
+				logging.info('drop stale pooled target connection')
+				sock.close()
+		return None
+
+	def fill(self) :
+		'''Drop stale connections and connect until min_idle are ready.
+
+		It blocks on the connects, see refill().
+		'''
+		with self.lock :
+			if self.filling or self.closed :
+				return
+			self.filling = True
+			for i in range(len(self.idle)) :
+				sock, since = self.idle.popleft()
+				if self.__healthy(sock, since) :
+					self.idle.append((sock, since))
+				else :
+					sock.close()
+		try :
+			while True :
+				with self.lock :
+					if self.closed or len(self.idle) >= self.min_idle :
+						break
+				# not under the lock, get() goes on meanwhile
+				sock = self.__connect()
+				if sock == None :
+					break
+				with self.lock :
+					if self.closed :
+						sock.close()
+						break
+					self.idle.append((sock, time.monotonic()))
+		finally :
+			with self.lock :
+				self.filling = False
+
+	def refill(self) :
+		'''fill() in a background thread'''
+		if not self.filling :
+			threading.Thread(target = self.fill, daemon = True).start()
+
+	def close(self) :
+		with self.lock :
+			self.closed = True
+			while self.idle :
+				self.idle.popleft()[0].close()
+
+
+class Backoff:
+	'''Capped exponential backoff with full jitter.
+
+	The n-th delay is random between 0 and min(cap, base * 2 ** n), so
+	many clients losing the same server do not come back in lockstep.
+	'''
+	def __init__(self, base = 1.0, cap = 60.0) :
+		self.base = base
+		self.cap = cap
+		self.attempt = 0
+
+	def next(self) :
+		d = min(self.cap, self.base * (2 ** min(self.attempt, 32)))
+		self.attempt += 1
+		return random.uniform(0, d)
+
+	def reset(self) :
+		self.attempt = 0
+
+
 class CC:
-	def __init__(self, server, server_port, target, target_port) :
+	# states of the server link
+	CONNECTING = 'connecting'
+	CONNECTED = 'connected'
+	BACKOFF = 'backoff'
+	STOPPED = 'stopped'
+	# a link up this long resets the backoff when it drops
+	STABLE_SECONDS = 30
+
+	def __init__(self, server, server_port, target, target_port, engine = 'copy',
+			high_water = relay.HIGH_WATER, low_water = relay.LOW_WATER,
+			pool = None, backoff = None, max_retries = 0, on_state = None,
+			metrics_address = None, session_options = None) :
 		self.server = server
 		self.server_port = server_port
 		self.target = target
 		self.target_port = target_port
+		self.engine = engine
+		# bytes buffered per direction, see relay.Session
+		self.high_water = high_water
+		self.low_water = low_water
+		# more keyword arguments of relay.Session, e.g. bufsize
+		self.session_options = session_options or {}
+		# a TargetPool or None to connect for each session
+		self.pool = pool
+		# reconnect the server link after a Backoff delay, give up after
+		# max_retries retries without a stable link, 0 is never
+		self.backoff = backoff or Backoff()
+		self.max_retries = max_retries
+		# on_state(cc) is called on each state change, see metrics()
+		self.on_state = on_state
+		self.state = CC.STOPPED
+		self.connects = 0
+		self.failures = 0
+		self.disconnects = 0
+		self.delay = 0.0
+		# serve metrics on "host:port" or "unix:/path", see relay.Metrics
+		self.metrics_address = metrics_address
+		self.loop_stats = relay.RelayStats()
+
+	def metrics(self) :
+		'''State and counters of the server link'''
+		return {
+			'state': self.state,
+			'connects': self.connects,
+			'failures': self.failures,
+			'disconnects': self.disconnects,
+			'retries': self.backoff.attempt,
+			'delay': self.delay,
+		}
+
+	def _collect(self) :
+		'''relay.Metrics collector of the server link'''
+		m = self.metrics()
+		return [
+			('relay_cc_link_state', 'gauge', 'state of the server link',
+				[({'state': state}, int(state == m['state']))
+					for state in (CC.CONNECTING, CC.CONNECTED, CC.BACKOFF, CC.STOPPED)]),
+			('relay_cc_connects_total', 'counter', 'server link connects', [(None, m['connects'])]),
+			('relay_cc_connect_failures_total', 'counter', 'failed server link connects',
+				[(None, m['failures'])]),
+			('relay_cc_disconnects_total', 'counter', 'dropped server links', [(None, m['disconnects'])]),
+			('relay_cc_retries', 'gauge', 'reconnects since the link was last stable',
+				[(None, m['retries'])]),
+			('relay_cc_backoff_seconds', 'gauge', 'last reconnect delay', [(None, m['delay'])]),
+		]
+
+	def _serve_metrics(self, sessions = True) :
+		if self.metrics_address == None :
+			return
+		metrics = relay.Metrics()
+		metrics.add(self._collect)
+		if sessions :
+			metrics.add(self.loop_stats.collect)
+		relay.MetricsServer(metrics, self.metrics_address).start()
+
+	def _set_state(self, state) :
+		logging.info('server link {0} -> {1}'.format(self.state, state))
+		self.state = state
+		if self.on_state != None :
+			self.on_state(self)
+
+	def _link_up(self) :
+		self.connects += 1
+		self.up_since = time.monotonic()
+		self._set_state(CC.CONNECTED)
+
+	def _retry_delay(self, connected) :
+		'''Count a failed connect or a dropped link, return the seconds
+		to wait before connecting again or None to give up'''
+		if connected :
+			self.disconnects += 1
+			if time.monotonic() - self.up_since >= CC.STABLE_SECONDS :
+				self.backoff.reset()
+		else :
+			self.failures += 1
+			if self.max_retries > 0 and self.backoff.attempt >= self.max_retries :
+				logging.error('give up connecting to server')
+				self._set_state(CC.STOPPED)
+				return None
+		self.delay = self.backoff.next()
+		self._set_state(CC.BACKOFF)
+		logging.info('reconnect in {0:.1f} seconds'.format(self.delay))
+		return self.delay
 
 	def __init_socket(self, host, port) :
 		sock = None
 
 		try :
 			sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			# before connect(), the handshake chooses the window scale
+			relay.set_buffers(sock, self.session_options.get('rcvbuf', 0),
+					self.session_options.get('sndbuf', 0))
 			sock.connect((host, port))
 			logging.info('connect to {0}:{1}'.format(host, port))
 		except socket.error as e :
@@ -34,49 +270,219 @@ class CC:
 
 
 	def run(self) :
-		self.cs1 = self.__init_socket(self.server, self.server_port)
+		self._serve_metrics()
+		try :
+			while True :
+				self._set_state(CC.CONNECTING)
+				self.cs1 = self.__init_socket(self.server, self.server_port)
+				connected = self.cs1 != None
+				if connected :
+					self._link_up()
+					self.__relay()
+				delay = self._retry_delay(connected)
+				if delay == None :
+					break
+				time.sleep(delay)
+		finally :
+			if self.pool != None :
+				self.pool.close()
+
+	def __relay(self) :
 		self.cs1_fd = self.cs1.fileno()
-		self.cs2 = None
-		self.cs2_fd = -1
+		self.session = None
 		self.epoll = select.epoll()
 		self.epoll.register(self.cs1_fd, select.EPOLLIN)
+		timeout = 60
+		if self.pool != None :
+			self.pool.refill()
+			timeout = min(timeout, self.pool.max_age / 2)
+		checked = time.monotonic()
 
-		while True :
+		while self.cs1 != None :
 			try :
-				res = self.epoll.poll(timeout=60)
+				res = self.epoll.poll(timeout=timeout)
+				self.loop_stats.wakeups += 1
+				if self.pool != None and time.monotonic() - checked >= timeout :
+					self.pool.refill()
+					checked = time.monotonic()
 				logging.debug('epoll timeout')
 				logging.debug(res)
 				# res is [(fd, events), ...]
-				for r in res :
-					fd = r[0]
-					event = r[1]
-					if fd == self.cs1_fd and event & select.EPOLLIN :
-						if self.cs2 == None:
-							logging.info('try to connect to target')
-							self.cs2 = self.__init_socket(self.target, self.target_port)
-							self.cs2_fd = self.cs2.fileno()
-							self.epoll.register(self.cs2_fd, select.EPOLLIN)
-						self.__read_write(self.cs1, self.cs2)
-					elif fd == self.cs2_fd and event & select.EPOLLIN :
-						self.__read_write(self.cs2, self.cs1)
-					elif event & select.EPOLLHUP or event & select.EPOLLERR :
-						break
+				for fd, event in res :
+					if self.session != None :
+						self.__read_write(fd, event)
+					elif fd == self.cs1_fd :
+						self.__connect_target(event)
 			except Exception as e :
 				logging.error(e)
+		self.epoll.close()
 
-	def __read_write(self, s1, s2):
-		max_bytes = 8192
+	def __connect_target(self, event) :
 		try :
-			data = s1.recv(max_bytes)
-			if len(data) == 0:
-				logging.info('close socket to target')
-				self.cs2.close()
-				self.cs2 = None
-				self.epoll.unregister(self.cs2_fd)
-				self.cs2_fd = -1
-			s2.send(data)
+			closed = self.cs1.recv(1, socket.MSG_PEEK) == b''
+		except BlockingIOError :
+			return
 		except socket.error as e :
 			logging.error(e)
+			closed = True
+		if closed :
+			self.__close_server()
+			return
+		cs2 = None
+		if self.pool != None :
+			cs2 = self.pool.get()
+		if cs2 == None :
+			logging.info('try to connect to target')
+			cs2 = self.__init_socket(self.target, self.target_port)
+		if cs2 == None :
+			self.__close_server()
+			return
+		self.epoll.unregister(self.cs1_fd)
+		# The server link outlives the target connection, so a closed
+		# target does not shut down the server link.
+		self.session = relay.Session(self.cs1, cs2, self.engine,
+				self.high_water, self.low_water, shutdown21 = False,
+				**self.session_options)
+		self.session.register(self.epoll)
+		self.loop_stats.opened(self.session)
+		self.__read_write(self.cs1_fd, event)
+		if self.pool != None :
+			# after the first data is on its way
+			self.pool.refill()
+
+	def __read_write(self, fd, event):
+		if self.session.handle(fd, event) :
+			return
+		session = self.session
+		self.session = None
+		self.loop_stats.closing(session)
+		# an error of the target, e.g. a reset, leaves the server link up
+		if session.c12.eof or (session.failed and not _alive(self.cs1)) :
+			session.close()
+			self.cs1 = None
+			logging.info('server link closed')
+		else :
+			logging.info('close socket to target')
+			session.close(keep = self.cs1)
+			self.epoll.register(self.cs1_fd, select.EPOLLIN)
+
+	def __close_server(self) :
+		logging.info('close server link')
+		self.epoll.unregister(self.cs1_fd)
+		self.cs1.close()
+		self.cs1 = None
+
+
+class _ServerLink(relay.RelayProtocol):
+	def __init__(self, cc) :
+		super().__init__(cc.high_water, cc.low_water)
+		self.cc = cc
+
+
+	def waiting(self) :
+		self.cc._connect_target(self)
+
+
+	def eof_received(self) :
+		if self.peer == None :
+			self.transport.close()
+			return False
+		return super().eof_received()
+
+
+	def peer_lost(self, peer) :
+		# the server link outlives the target connection
+		logging.info('close socket to target')
+		if self.eof :
+			self.transport.close()
+		else :
+			# a full target paused reading, see pause_writing(), and data
+			# for the next target connects it
+			self.early = []
+			self.transport.resume_reading()
+
+
+	def lost(self) :
+		logging.info('server link closed')
+		if not self.cc.done.done() :
+			self.cc.done.set_result(None)
+
+
+class AsyncCC(CC):
+	"""CC on asyncio transports, runs on uvloop if it is installed."""
+
+	def run(self) :
+		self._serve_metrics(sessions = False)
+		loop = relay.new_event_loop()
+		asyncio.set_event_loop(loop)
+		try :
+			loop.run_until_complete(self.serve())
+		finally :
+			loop.close()
+
+	async def serve(self) :
+		try :
+			while True :
+				self._set_state(CC.CONNECTING)
+				connected = await self._link()
+				delay = self._retry_delay(connected)
+				if delay == None :
+					break
+				await asyncio.sleep(delay)
+		finally :
+			if self.pool != None :
+				self.pool.close()
+
+	async def _link(self) :
+		'''Relay over one server link, return False if it fails to connect'''
+		loop = asyncio.get_running_loop()
+		self.done = loop.create_future()
+		self.connecting = False
+		try :
+			await loop.create_connection(lambda: _ServerLink(self),
+					self.server, self.server_port)
+		except OSError as e :
+			logging.error('Failed to init socket')
+			logging.error(e)
+			return False
+		logging.info('connect to {0}:{1}'.format(self.server, self.server_port))
+		self._link_up()
+		if self.pool != None :
+			self.pool.refill()
+		await self.done
+		return True
+
+	def _connect_target(self, link) :
+		if not self.connecting :
+			self.connecting = True
+			asyncio.ensure_future(self._target(link))
+
+	async def _target(self, link) :
+		loop = asyncio.get_running_loop()
+		factory = lambda: relay.RelayProtocol(self.high_water, self.low_water,
+				shutdown = False)
+		sock = None
+		if self.pool != None :
+			sock = self.pool.get()
+		try :
+			if sock != None :
+				transport, target = await loop.create_connection(factory, sock = sock)
+			else :
+				logging.info('try to connect to target')
+				transport, target = await loop.create_connection(factory,
+						self.target, self.target_port)
+				logging.info('connect to {0}:{1}'.format(self.target, self.target_port))
+		except OSError as e :
+			logging.error('Failed to init socket')
+			logging.error(e)
+			link.transport.close()
+			return
+		finally :
+			self.connecting = False
+		link.pair(target)
+		target.pair(link)
+		if self.pool != None :
+			self.pool.refill()
 
 if __name__ == '__main__':
 	ap = argparse.ArgumentParser(description = 'Connnect to two servers and exchange data ')
@@ -84,11 +490,47 @@ if __name__ == '__main__':
 	ap.add_argument('--server-port', nargs=1, required=True, type=int)
 	ap.add_argument('--target-host', nargs=1, required=True)
 	ap.add_argument('--target-port', nargs=1, required=True, type=int)
+	ap.add_argument('--engine', choices=['epoll', 'asyncio'], default='epoll',
+			help='Event loop, default is epoll. asyncio uses uvloop if installed')
+	ap.add_argument('--relay', choices=relay.ENGINES, default='copy',
+			help='How to move bytes between sockets with epoll, default is copy')
+	ap.add_argument('--high-water', type=int, default=relay.HIGH_WATER,
+			help='Stop reading a socket when this many bytes are buffered for its peer, '
+			'with asyncio the write buffer limit of its peer')
+	ap.add_argument('--low-water', type=int, default=relay.LOW_WATER,
+			help='Resume reading when the buffer drains to this many bytes')
+	relay.add_arguments(ap)
+	ap.add_argument('--pool-size', type=int, default=0,
+			help='Target connections to keep ready, default is 0 (connect on demand)')
+	ap.add_argument('--pool-max-age', type=int, default=300,
+			help='Seconds a ready target connection is kept, default is 300')
+	ap.add_argument('--pool-keepalive', type=int, default=60,
+			help='TCP keepalive idle seconds of ready connections, 0 is off')
+	ap.add_argument('--retry-base', type=float, default=1.0,
+			help='Seconds of the first reconnect backoff, default is 1')
+	ap.add_argument('--retry-max', type=float, default=60.0,
+			help='Cap of the reconnect backoff in seconds, default is 60')
+	ap.add_argument('--max-retries', type=int, default=0,
+			help='Give up after this many retries without a stable link, default is 0 (never)')
+	ap.add_argument('--metrics', metavar='ADDRESS',
+			help='Serve Prometheus metrics on host:port or unix:/path')
 	arguments = ap.parse_args()
+	options = relay.session_options(arguments)
+	if arguments.engine == 'asyncio' and (options or arguments.relay != 'copy') :
+		ap.error('--relay and buffer options need the epoll engine')
 	h1 = arguments.server_host[0]	
 	p1 = arguments.server_port[0]	
 	h2 = arguments.target_host[0]	
 	p2 = arguments.target_port[0]	
 
-	cc = CC(h1, p1, h2, p2)
+	pool = None
+	if arguments.pool_size > 0 :
+		pool = TargetPool(h2, p2, arguments.pool_size,
+				arguments.pool_max_age, arguments.pool_keepalive)
+	cls = AsyncCC if arguments.engine == 'asyncio' else CC
+	cc = cls(h1, p1, h2, p2, arguments.relay,
+			arguments.high_water, arguments.low_water, pool,
+			Backoff(arguments.retry_base, arguments.retry_max),
+			arguments.max_retries, metrics_address = arguments.metrics,
+			session_options = options)
 	cc.run()
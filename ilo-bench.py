@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+'''Micro-benchmark of the key path lookups of ilo.py.
+
+Every resource of the iLO resource maps is looked up in a response of its
+uri, once with the compiled KeyPath of iLO and once with the recursive
+lookup iLO used before. Then the resources of a get_many() call are
+looked up in their responses, with the KeyPaths and with the recursive
+lookup of each resource.
+
+The built-in responses are trimmed iLO 4 responses, pass --payloads with
+a JSON file of {uri: response} to use responses recorded from a real
+iLO, uris as in the resource maps, e.g. "/Chassis/{chassis}/Thermal".
+
+e.g.
+	./ilo-bench.py
+	./ilo-bench.py --payloads recorded.json --number 100000
+'''
+
+import sys
+import json
+import timeit
+import argparse
+from ilo import iLO
+from benchutil import status
+from benchutil import collection
+
+
+def legacy_get_resource_by_keys(obj, keys):
+	'''iLO._get_resource_by_keys() before KeyPath'''
+	def _find(o, k, v):
+		if isinstance(o, list):
+			for i in o:
+				_find(i, k, v)
+		elif isinstance(o, dict):
+			if len(k) == 1:
+				v.append(o[k[0]])
+			else:
+				_find(o[k[0]], k[1:], v)
+
+	try:
+		values = []
+		_find(obj, keys, values)
+		return values
+	except KeyError:
+		return None
+
+
+# get_many() calls, server-monitor.py reads status
+MANY = {
+	'status': [iLO.SYSTEM_HEALTH, iLO.POWER_STATE, iLO.POWER_AUTO_ON],
+	'inventory system': iLO._inventory_system,
+	'inventory chassis': iLO._inventory_chassis,
+	'inventory nic': iLO._inventory_nic,
+}
+
+
+PAYLOADS = {
+	'/Systems/{system}': {
+		'AssetTag': '', 'AvailableActions': [{'Action': 'Reset'}],
+		'BIOSPOSTCode': 0, 'Bios': {'Current': {'VersionString': 'P89 v2.76'}},
+		'Boot': {'BootSourceOverrideEnabled': 'Disabled',
+			'BootSourceOverrideSupported': ['None', 'Cd', 'Hdd', 'Usb', 'Pxe']},
+		'HostName': 'node01', 'Id': '1', 'IndicatorLED': 'Off',
+		'Manufacturer': 'HPE', 'Model': 'ProLiant DL380 Gen9',
+		'Memory': {'Status': {'HealthRollUp': 'OK'}, 'TotalSystemMemoryGB': 256},
+		'Name': 'Computer System',
+		'Oem': {'Hp': {'PowerAutoOn': 'RemainOff', 'PowerOnDelay': 'Minimum',
+			'PowerRegulatorMode': 'Dynamic', 'TrustedModules': [{'Status': 'NotPresent'}],
+			'VirtualProfile': 'Inactive'}},
+		'PowerState': 'On',
+		'Processors': {'Count': 2, 'ProcessorFamily': 'Intel(R) Xeon(R) CPU E5-2680 v4 @ 2.40GHz',
+			'Status': {'HealthRollUp': 'OK'}},
+		'SKU': '719064-B21', 'SerialNumber': 'CZJ00000XX',
+		'Status': status(), 'SystemType': 'Physical',
+		'UUID': '30373137-3436-5A43-4A30-303030305858',
+	},
+	'/Systems/{system}/Memory': collection('/rest/v1/Systems/1/Memory', range(24)),
+	'/Systems/{system}/Memory/{dimm}': {
+		'DIMMStatus': 'GoodInUse', 'DIMMTechnology': 'RDIMM', 'DIMMType': 'DDR4',
+		'DataWidth': 64, 'ErrorCorrection': 'SingleBitECC', 'HPMemoryType': 'HPSmartMemory',
+		'Id': 'proc1dimm1', 'Manufacturer': 'HP', 'MaximumFrequencyMHz': 2400,
+		'MinimumVoltageVoltsX10': 12, 'Name': 'proc1dimm1', 'PartNumber': '809082-091',
+		'Rank': 2, 'SizeMB': 32768, 'SocketLocator': 'PROC 1 DIMM 1',
+	},
+	'/Systems/{system}/SmartStorage': {'Id': 'SmartStorage', 'Status': status()},
+	'/Systems/{system}/SmartStorage/ArrayControllers':
+		collection('/rest/v1/Systems/1/SmartStorage/ArrayControllers', range(1)),
+	'/Systems/{system}/SmartStorage/ArrayControllers/{controller}': {
+		'AdapterType': 'SmartArray', 'FirmwareVersion': {'Current': {'VersionString': '6.60'}},
+		'Id': '0', 'Location': 'Slot 0', 'Model': 'HP Smart Array P440ar Controller',
+		'SerialNumber': 'PDNLH0BRH8Y0XX', 'Status': status(),
+	},
+	'/Systems/{system}/SmartStorage/ArrayControllers/{controller}/DiskDrives':
+		collection('/rest/v1/Systems/1/SmartStorage/ArrayControllers/0/DiskDrives', range(8)),
+	'/Systems/{system}/SmartStorage/ArrayControllers/{controller}/DiskDrives/{diskdrive}': {
+		'BlockSizeBytes': 512, 'CapacityMiB': 1144609, 'CurrentTemperatureCelsius': 30,
+		'FirmwareVersion': {'Current': {'VersionString': 'HPD4'}}, 'Id': '0',
+		'InterfaceSpeedMbps': 12000, 'InterfaceType': 'SAS', 'Location': '1I:1:1',
+		'MediaType': 'HDD', 'Model': 'EG001200JWJNQ', 'RotationalSpeedRpm': 10000,
+		'SerialNumber': 'WFK0XXXX', 'Status': status(),
+	},
+	'/Systems/{system}/SmartStorage/ArrayControllers/{controller}/LogicalDrives':
+		collection('/rest/v1/Systems/1/SmartStorage/ArrayControllers/0/LogicalDrives', range(2)),
+	'/Systems/{system}/SmartStorage/ArrayControllers/{controller}/LogicalDrives/{logicaldrive}': {
+		'CapacityMiB': 2289184, 'Id': '1', 'LogicalDriveNumber': 1,
+		'Raid': '1', 'Status': status(),
+	},
+	'/Systems/{system}/NetworkAdapters': collection('/rest/v1/Systems/1/NetworkAdapters', range(2)),
+	'/Systems/{system}/NetworkAdapters/{nic}': {
+		'Firmware': {'Current': {'VersionString': '20.6.41'}}, 'Id': '1',
+		'Name': 'HP Ethernet 1Gb 4-port 331i Adapter', 'PartNumber': '629135-B21',
+		'PhysicalPorts': [{
+			'FullDuplex': True, 'IPv4Addresses': [{'Address': '10.0.0.{0}'.format(i)}],
+			'IPv6Addresses': [{'Address': 'fe80::{0}'.format(i)}],
+			'MacAddress': '14:02:ec:00:00:0{0}'.format(i), 'Name': '',
+			'SpeedMbps': 1000, 'Status': status()} for i in range(4)],
+		'SerialNumber': 'N/A', 'Status': status(),
+	},
+	'/Chassis/{chassis}/Thermal': {
+		'Fans': [{'CurrentReading': 20 + i, 'FanName': 'Fan {0}'.format(i + 1),
+			'Oem': {'Hp': {'Location': 'System'}}, 'Status': status(),
+			'Units': 'Percent'} for i in range(6)],
+		'Id': 'Thermal', 'Status': status(),
+		'Temperatures': [{'CurrentReading': 30 + i % 20, 'Name': '{0:02d}-Sensor'.format(i + 1),
+			'Number': i + 1, 'PhysicalContext': 'SystemBoard', 'ReadingCelsius': 30 + i % 20,
+			'Status': status(), 'Units': 'Celsius',
+			'UpperThresholdCritical': 90, 'UpperThresholdFatal': 100} for i in range(40)],
+	},
+	'/Chassis/{chassis}/Power': {
+		'Id': 'PowerMetrics', 'PowerCapacityWatts': 1000, 'PowerConsumedWatts': 212,
+		'PowerSupplies': [{'FirmwareVersion': '1.00', 'LastPowerOutputWatts': 106,
+			'LineInputVoltage': 229, 'Model': '720478-B21', 'Name': 'HpServerPowerSupply',
+			'PowerCapacityWatts': 500, 'PowerSupplyType': 'AC',
+			'Redundancy': {'Status': status()},
+			'SerialNumber': '5DMVV0AXXXX', 'Status': status()} for i in range(2)],
+	},
+	'/Managers/{manager}/EthernetInterfaces': collection('/rest/v1/Managers/1/EthernetInterfaces', range(2)),
+	'/Managers/{manager}/EthernetInterfaces/{nic}': {
+		'FactoryMacAddress': '14:02:ec:00:01:00', 'FullDuplex': True, 'Id': '1',
+		'IPv4Addresses': [{'Address': '10.0.1.1', 'AddressOrigin': 'DHCP'}],
+		'MacAddress': '14:02:ec:00:01:00', 'Name': 'Manager Dedicated Network Interface',
+		'SpeedMbps': 1000, 'Status': status(),
+	},
+}
+
+
+def bench(payloads, number, repeat = 5):
+	'''Return [(resource, legacy ns, compiled ns)] of all resources'''
+	results = []
+	for resource, (what, uri, keys) in iLO._resource_map.items():
+		obj = payloads.get(uri)
+		if obj is None:
+			print(f'{resource}: no payload of {uri}', file=sys.stderr)
+			continue
+		path = iLO._key_paths[resource]
+		if path(obj) != legacy_get_resource_by_keys(obj, keys):
+			print(f'{resource}: results differ', file=sys.stderr)
+		# the best of repeat runs, the others are slowed down by noise
+		legacy = min(timeit.repeat(lambda: legacy_get_resource_by_keys(obj, keys),
+				number = number, repeat = repeat))
+		compiled = min(timeit.repeat(lambda: path(obj), number = number, repeat = repeat))
+		results.append((resource, legacy / number * 1e9, compiled / number * 1e9))
+	return results
+
+
+def bench_many(payloads, number, repeat = 5):
+	'''Return [(name of a MANY call, legacy ns, compiled ns)]'''
+	results = []
+	for name, resources in MANY.items():
+		# the resources of each uri, as get_many() groups them
+		groups = {}
+		for resource in resources:
+			what, uri, keys = iLO._resource_map[resource]
+			groups.setdefault(uri, []).append(resource)
+		if any(uri not in payloads for uri in groups):
+			print(f'{name}: no payload', file=sys.stderr)
+			continue
+		calls = [(payloads[uri], [iLO._resource_map[r][2] for r in group],
+				[iLO._key_paths[r] for r in group]) for uri, group in groups.items()]
+
+		def legacy():
+			for obj, keys, paths in calls:
+				[legacy_get_resource_by_keys(obj, k) for k in keys]
+
+		def compiled():
+			for obj, keys, paths in calls:
+				[path(obj) for path in paths]
+
+		legacy_ns = min(timeit.repeat(legacy, number = number, repeat = repeat))
+		compiled_ns = min(timeit.repeat(compiled, number = number, repeat = repeat))
+		results.append((name, legacy_ns / number * 1e9, compiled_ns / number * 1e9))
+	return results
+
+
+if __name__ == '__main__':
+	ap = argparse.ArgumentParser(description = 'Benchmark iLO key path lookups')
+	ap.add_argument('--payloads', help='JSON file of {uri: response} to use')
+	ap.add_argument('--number', type=int, default=20000,
+			help='lookups per resource and run, default is 20000')
+	ap.add_argument('--repeat', type=int, default=5,
+			help='runs per resource, the best one counts, default is 5')
+	args = ap.parse_args()
+	payloads = dict(PAYLOADS)
+	if args.payloads:
+		with open(args.payloads) as f:
+			payloads.update(json.load(f))
+
+	results = bench(payloads, args.number, args.repeat)
+	fmt = '{:<32}{:>12}{:>12}{:>9}'
+	print(fmt.format('Resource', 'Legacy(ns)', 'KeyPath(ns)', 'Speedup'))
+	for resource, legacy, compiled in results:
+		print(fmt.format(resource, '{:.0f}'.format(legacy), '{:.0f}'.format(compiled),
+				'{:.2f}x'.format(legacy / compiled)))
+	legacy = sum([r[1] for r in results])
+	compiled = sum([r[2] for r in results])
+	print(fmt.format('all', '{:.0f}'.format(legacy), '{:.0f}'.format(compiled),
+			'{:.2f}x'.format(legacy / compiled)))
+
+	print()
+	print(fmt.format('get_many', 'Legacy(ns)', 'KeyPath(ns)', 'Speedup'))
+	for name, legacy, compiled in bench_many(payloads, args.number, args.repeat):
+		print(fmt.format(name, '{:.0f}'.format(legacy), '{:.0f}'.format(compiled),
+				'{:.2f}x'.format(legacy / compiled)))
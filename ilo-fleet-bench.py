@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+'''Fleet-scale load test of ilo.py against ilo-mock.py.
+
+Every iLO of the mock is polled --rounds times, the first round logs in,
+the next ones reuse the sessions. A poll reads the status (health, power
+state and auto on, what server-monitor.py reads) or the whole inventory,
+with the response cache emptied before each round. For each round the
+time of the fleet poll, hosts and requests per second (as counted by the
+mock) and the latency of a host poll are printed.
+
+--client async polls with AsyncILO on one aiohttp session, --client
+threads with iLO on a pool of threads like server-monitor.py, which needs
+the redfish package. With --spawn the mock is started with the given
+arguments and stopped at the end, otherwise --mock is the url of a
+running one.
+
+The exit status is 1 if a poll failed or sessions of the polls are left
+on the mock at the end, so a run against a mock with --error-rate tests
+that ilo.py rides out the errors of an iLO:
+	./ilo-fleet-bench.py --spawn '--hosts 50 --error-rate 0.02'
+
+e.g.
+	./ilo-fleet-bench.py --spawn '--hosts 1000 --latency 0.05 --jitter 0.02'
+	./ilo-mock.py --hosts 200 --error-rate 0.01 &
+	./ilo-fleet-bench.py --what inventory --concurrency 50 --rounds 5
+'''
+
+import os
+import ssl
+import sys
+import json
+import time
+import shlex
+import asyncio
+import argparse
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from ilo import iLO
+from ilo import AsyncILO
+from benchutil import percentile
+
+STATUS = [iLO.SYSTEM_HEALTH, iLO.POWER_STATE, iLO.POWER_AUTO_ON]
+
+
+def mock_get(url, path, timeout = 10):
+	'''GET a /mock path of the mock at url'''
+	context = ssl._create_unverified_context()
+	with urllib.request.urlopen(url + path, timeout=timeout, context=context) as r:
+		return json.loads(r.read())
+
+
+def spawn(mock_args, url):
+	'''Start ilo-mock.py with mock_args, return it when url answers'''
+	script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ilo-mock.py')
+	p = subprocess.Popen([sys.executable, script] + shlex.split(mock_args),
+			stdout=subprocess.DEVNULL)
+	for i in range(300):
+		if p.poll() is not None:
+			raise RuntimeError('ilo-mock.py exited with {}'.format(p.returncode))
+		try:
+			mock_get(url, '/mock/hosts', 1)
+			return p
+		except OSError:
+			time.sleep(0.1)
+	p.terminate()
+	raise RuntimeError('ilo-mock.py does not answer at ' + url)
+
+
+async def run_async(urls, args, round_done):
+	async with AsyncILO.client_session(limit=args.concurrency * args.per_host,
+			limit_per_host=args.per_host) as http:
+		ilos = [AsyncILO(url, args.user, args.password, http, args.timeout, args.per_host)
+				for url in urls]
+		slots = asyncio.Semaphore(args.concurrency)
+
+		async def poll(i, login):
+			async with slots:
+				start = time.monotonic()
+				if login:
+					await i.login()
+				if args.what == 'inventory':
+					await i.inventory()
+				else:
+					await i.get_many(STATUS)
+				return time.monotonic() - start
+
+		async def logout(i):
+			async with slots:
+				await i.logout()
+
+		for n in range(args.rounds):
+			for i in ilos:
+				i.cache.invalidate()
+			start = time.monotonic()
+			results = await asyncio.gather(*[poll(i, n == 0 or i._session_uri is None)
+					for i in ilos], return_exceptions=True)
+			round_done(n, time.monotonic() - start, results)
+		await asyncio.gather(*[logout(i) for i in ilos], return_exceptions=True)
+
+
+def run_threads(urls, args, round_done):
+	ilos = [iLO(url, args.user, args.password, args.timeout) for url in urls]
+
+	def poll(i, login):
+		start = time.monotonic()
+		if login:
+			i.login()
+		if args.what == 'inventory':
+			i.inventory(args.per_host)
+		else:
+			i.get_many(STATUS)
+		return time.monotonic() - start
+
+	def result(f):
+		try:
+			return f.result()
+		except Exception as e:
+			return e
+
+	with ThreadPoolExecutor(max_workers=args.concurrency) as pe:
+		for n in range(args.rounds):
+			for i in ilos:
+				i.cache.invalidate()
+			start = time.monotonic()
+			futures = [pe.submit(poll, i, n == 0 or i.rf_client is None) for i in ilos]
+			results = [result(f) for f in futures]
+			round_done(n, time.monotonic() - start, results)
+		for f in [pe.submit(i.logout) for i in ilos if i.rf_client is not None]:
+			result(f)
+
+
+if __name__ == '__main__':
+	ap = argparse.ArgumentParser(description = 'Load test ilo.py against ilo-mock.py')
+	ap.add_argument('--mock', default='http://127.0.0.1:8443',
+			help='url of an iLO of the mock, default is http://127.0.0.1:8443')
+	ap.add_argument('--spawn', metavar='ARGS',
+			help='start ilo-mock.py with ARGS, its first iLO must be at --mock')
+	ap.add_argument('--client', choices=['async', 'threads'], default='async',
+			help='AsyncILO or iLO on threads, default is async')
+	ap.add_argument('--what', choices=['status', 'inventory'], default='status',
+			help='what a poll reads, default is status')
+	ap.add_argument('--rounds', type=int, default=3, help='polls of the fleet, default is 3')
+	ap.add_argument('--concurrency', type=int, default=256,
+			help='hosts polled at a time, default is 256')
+	ap.add_argument('--per-host', type=int, default=4,
+			help='requests in flight to one iLO, default is 4')
+	ap.add_argument('--timeout', type=float, default=10,
+			help='seconds of a request, default is 10')
+	ap.add_argument('--limit', type=int, help='poll only the first LIMIT iLOs')
+	ap.add_argument('--user', default='admin', help='iLO user, default is admin')
+	ap.add_argument('--password', default='admin', help='iLO password, default is admin')
+	args = ap.parse_args()
+
+	mock = spawn(args.spawn, args.mock) if args.spawn is not None else None
+	try:
+		urls = mock_get(args.mock, '/mock/hosts')[:args.limit]
+		print('{} iLOs, {} client, {} polls'.format(len(urls), args.client, args.what))
+		fmt = '{:<7}{:>9}{:>9}{:>10}{:>10}{:>8}{:>10}{:>10}'
+		print(fmt.format('Round', 'Seconds', 'Hosts/s', 'Requests', 'Req/s', 'Failed',
+				'p50(ms)', 'p95(ms)'))
+		counters = [mock_get(args.mock, '/mock/stats')]
+		failures = []
+
+		def round_done(n, seconds, results):
+			counters.append(mock_get(args.mock, '/mock/stats'))
+			requests = counters[-1]['requests'] - counters[-2]['requests']
+			latencies = [r for r in results if not isinstance(r, BaseException)]
+			errors = {}
+			for r in results:
+				if isinstance(r, BaseException):
+					errors[type(r).__name__] = errors.get(type(r).__name__, 0) + 1
+			failures.append(len(results) - len(latencies))
+			print(fmt.format(n + 1, '{:.2f}'.format(seconds), '{:.0f}'.format(len(results) / seconds),
+					requests, '{:.0f}'.format(requests / seconds), len(results) - len(latencies),
+					'{:.1f}'.format(percentile(latencies, 50) * 1000),
+					'{:.1f}'.format(percentile(latencies, 95) * 1000)), flush=True)
+			if errors:
+				print('       ' + ', '.join(['{} {}'.format(k, v) for k, v in sorted(errors.items())]))
+
+		if args.client == 'async':
+			asyncio.run(run_async(urls, args, round_done))
+		else:
+			run_threads(urls, args, round_done)
+		stats = mock_get(args.mock, '/mock/stats')
+		print('mock: ' + ', '.join(['{} {}'.format(k, stats[k] - counters[0][k])
+				for k in ('logins', 'logouts', 'errors', 'hangs', 'unauthorized', 'session_limit',
+				'sessions')]))
+		if sum(failures) or stats['sessions'] > counters[0]['sessions']:
+			exit(1)
+	finally:
+		if mock is not None:
+			mock.terminate()
+			mock.wait()
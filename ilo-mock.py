@@ -0,0 +1,312 @@
+#!/usr/bin/python3
+'''Mock HPE iLO REST server, to run ilo.py and server-monitor.py without
+hardware.
+
+It serves the /rest/v1 Systems, Chassis and Managers trees the resource
+maps of ilo.py read, with Redfish sessions: POST /rest/v1/Sessions answers
+an X-Auth-Token and a Location to DELETE, other requests without a valid
+token get 401. --hosts iLOs are simulated by one process, on consecutive
+ports (--spread port) or on consecutive addresses of 127.0.0.0/8 on the
+same port (--spread address, as server-monitor.py wants plain ips).
+
+Each response is delayed by --latency seconds give or take --jitter, a
+--error-rate part of the requests get 500 and a --hang-rate part are
+answered with 504 only after --hang seconds. An iLO has --max-sessions
+sessions at most, more logins get 403, and sessions idle for more than
+--session-timeout seconds are gone.
+
+Every iLO also answers, without delay or session:
+	/mock/hosts	the base urls of all the iLOs
+	/mock/stats	counters of all the iLOs
+
+Without --cert the iLOs speak plain http, server-monitor.py needs https:
+	openssl req -x509 -newkey rsa:2048 -nodes -subj /CN=ilo-mock \\
+		-keyout key.pem -out cert.pem
+
+e.g.
+	./ilo-mock.py --hosts 1000 --latency 0.1 --jitter 0.05
+	./ilo-mock.py --hosts 200 --spread address --address 127.0.1.1 --port 443 \\
+		--cert cert.pem --key key.pem --error-rate 0.01
+'''
+
+import ssl
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import ipaddress
+from benchutil import status
+from benchutil import collection
+try:
+	from aiohttp import web
+except ImportError:
+	web = None
+
+
+PREFIX = '/rest/v1'
+
+
+def build_tree(n, dimms = 24, controllers = 1, drives = 8, nics = 2):
+	'''Return {uri: response} of the n-th iLO'''
+	t = {}
+	root = PREFIX
+	t[root] = {'Name': 'HP RESTful Root Service', 'RedfishVersion': '1.0.0',
+		'links': {'Sessions': {'href': root + '/SessionService/Sessions'},
+			'Systems': {'href': root + '/Systems'}, 'Chassis': {'href': root + '/Chassis'},
+			'Managers': {'href': root + '/Managers'}},
+		'Links': {'Sessions': {'@odata.id': root + '/SessionService/Sessions'}}}
+	systems = root + '/Systems'
+	t[systems] = collection(systems, ['1'])
+	system = systems + '/1'
+	t[system] = {'Id': '1', 'Name': 'Computer System', 'HostName': 'node{0:04d}'.format(n),
+		'Manufacturer': 'HPE', 'Model': 'ProLiant DL380 Gen9', 'SKU': '719064-B21',
+		'SerialNumber': 'CZJ{0:07d}'.format(n), 'Status': status(), 'PowerState': 'On',
+		'Processors': {'Count': 2, 'ProcessorFamily': 'Intel(R) Xeon(R) CPU E5-2680 v4 @ 2.40GHz',
+			'Status': {'HealthRollUp': 'OK'}},
+		'Memory': {'Status': {'HealthRollUp': 'OK'}, 'TotalSystemMemoryGB': dimms * 32},
+		'Oem': {'Hp': {'PowerAutoOn': 'RemainOff'}}}
+	memory = system + '/Memory'
+	ids = ['proc{0}dimm{1}'.format(i // 12 + 1, i % 12 + 1) for i in range(dimms)]
+	t[memory] = collection(memory, ids)
+	for i in ids:
+		t[memory + '/' + i] = {'Id': i, 'Name': i, 'SizeMB': 32768, 'Rank': 2,
+			'DIMMStatus': 'GoodInUse', 'DIMMType': 'DDR4', 'DIMMTechnology': 'RDIMM'}
+	storage = system + '/SmartStorage'
+	t[storage] = {'Id': 'SmartStorage', 'Status': status()}
+	acs = storage + '/ArrayControllers'
+	t[acs] = collection(acs, [str(c) for c in range(controllers)])
+	for c in range(controllers):
+		ac = '{0}/{1}'.format(acs, c)
+		t[ac] = {'Id': str(c), 'Model': 'HP Smart Array P440ar Controller', 'Status': status()}
+		t[ac + '/DiskDrives'] = collection(ac + '/DiskDrives', [str(d) for d in range(drives)])
+		for d in range(drives):
+			t['{0}/DiskDrives/{1}'.format(ac, d)] = {'Id': str(d), 'Status': status(),
+				'CapacityMiB': 1144609, 'SerialNumber': 'WFK{0:05d}{1}{2}'.format(n, c, d),
+				'Model': 'EG001200JWJNQ', 'MediaType': 'HDD', 'InterfaceType': 'SAS'}
+		t[ac + '/LogicalDrives'] = collection(ac + '/LogicalDrives', ['1'])
+		t[ac + '/LogicalDrives/1'] = {'Id': '1', 'Raid': '1', 'Status': status()}
+	adapters = system + '/NetworkAdapters'
+	t[adapters] = collection(adapters, [str(i + 1) for i in range(nics)])
+	for i in range(nics):
+		t['{0}/{1}'.format(adapters, i + 1)] = {'Id': str(i + 1),
+			'Name': 'HP Ethernet 1Gb 4-port 331i Adapter', 'SerialNumber': 'N/A',
+			'Status': status(), 'PhysicalPorts': [{'FullDuplex': True, 'SpeedMbps': 1000,
+				'MacAddress': '14:02:ec:{0:02x}:{1:02x}:{2:02x}'.format(n >> 8 & 255, n & 255, i * 4 + p),
+				'IPv4Addresses': [], 'IPv6Addresses': [], 'Status': status()} for p in range(4)]}
+	chassis = root + '/Chassis'
+	t[chassis] = collection(chassis, ['1'])
+	t[chassis + '/1'] = {'Id': '1', 'Name': 'Computer System Chassis', 'Status': status()}
+	t[chassis + '/1/Thermal'] = {'Id': 'Thermal', 'Status': status(),
+		'Fans': [{'FanName': 'Fan {0}'.format(i + 1), 'CurrentReading': 20 + i, 'Units': 'Percent',
+			'Status': status()} for i in range(6)],
+		'Temperatures': [{'Name': '{0:02d}-Sensor'.format(i + 1), 'ReadingCelsius': 30 + i % 20,
+			'Status': status()} for i in range(40)]}
+	t[chassis + '/1/Power'] = {'Id': 'PowerMetrics', 'PowerConsumedWatts': 212,
+		'PowerSupplies': [{'Status': status(), 'Redundancy': {'Status': status()}}
+			for i in range(2)]}
+	managers = root + '/Managers'
+	t[managers] = collection(managers, ['1'])
+	t[managers + '/1'] = {'Id': '1', 'Name': 'Manager', 'Status': status()}
+	interfaces = managers + '/1/EthernetInterfaces'
+	t[interfaces] = collection(interfaces, ['1'])
+	t[interfaces + '/1'] = {'Id': '1', 'Name': 'Manager Dedicated Network Interface',
+		'MacAddress': '14:02:ec:{0:02x}:{1:02x}:ff'.format(n >> 8 & 255, n & 255)}
+	return t
+
+
+class MockILO:
+	'''Sessions and responses of one simulated iLO'''
+
+	def __init__(self, n, url, tree, max_sessions, session_timeout):
+		self.n = n
+		self.url = url
+		# uri -> encoded response
+		self.tree = {uri: json.dumps(obj).encode() for uri, obj in tree.items()}
+		self.max_sessions = max_sessions
+		self.session_timeout = session_timeout
+		# token -> time of the last request
+		self.sessions = {}
+
+	def session(self, token):
+		'''Return True and touch the session if token is valid'''
+		now = time.monotonic()
+		for t, last in list(self.sessions.items()):
+			if now - last > self.session_timeout:
+				del self.sessions[t]
+		if token not in self.sessions:
+			return False
+		self.sessions[token] = now
+		return True
+
+
+class Fleet:
+	'''The simulated iLOs and their shared aiohttp application'''
+
+	def __init__(self, args):
+		self.args = args
+		self.ilos = {}
+		self.stats = dict.fromkeys(['requests', 'logins', 'logouts', 'ok', 'errors', 'hangs',
+				'unauthorized', 'session_limit', 'not_found'], 0)
+		self.started = time.time()
+
+	def listen_addresses(self):
+		'''Return [(host, port)] of the iLOs'''
+		a = self.args
+		if a.spread == 'port':
+			return [(a.address, a.port + i) for i in range(a.hosts)]
+		first = ipaddress.ip_address(a.address)
+		return [(str(first + i), a.port) for i in range(a.hosts)]
+
+	async def handle(self, request):
+		sockname = request.transport.get_extra_info('sockname')
+		ilo = self.ilos[sockname[:2]]
+		path = request.path.rstrip('/') or '/'
+		if path == '/mock/hosts':
+			return web.json_response([i.url for i in self.ilos.values()])
+		if path == '/mock/stats':
+			stats = dict(self.stats)
+			stats['sessions'] = sum([len(i.sessions) for i in self.ilos.values()])
+			stats['uptime'] = time.time() - self.started
+			return web.json_response(stats)
+
+		a = self.args
+		self.stats['requests'] += 1
+		delay = max(0, random.gauss(a.latency, a.jitter)) if a.jitter else a.latency
+		if delay:
+			await asyncio.sleep(delay)
+		r = random.random()
+		if r < a.hang_rate:
+			self.stats['hangs'] += 1
+			await asyncio.sleep(a.hang)
+			return web.Response(status=504)
+		if r < a.hang_rate + a.error_rate:
+			self.stats['errors'] += 1
+			return web.json_response(_message('InternalError'), status=500)
+
+		if request.method == 'POST' and path.endswith('/Sessions'):
+			return await self.login(ilo, request)
+		token = request.headers.get('X-Auth-Token')
+		if path != PREFIX and not ilo.session(token):
+			self.stats['unauthorized'] += 1
+			return web.json_response(_message('NoValidSession'), status=401)
+		if request.method == 'DELETE' and path.startswith(PREFIX + '/SessionService/Sessions/'):
+			ilo.sessions.pop(path.rsplit('/', 1)[1], None)
+			self.stats['logouts'] += 1
+			return web.json_response(_message('Success'))
+		body = ilo.tree.get(path)
+		if request.method != 'GET' or body is None:
+			self.stats['not_found'] += 1
+			return web.json_response(_message('ResourceMissingAtURI'), status=404)
+		self.stats['ok'] += 1
+		return web.Response(body=body, content_type='application/json')
+
+	async def login(self, ilo, request):
+		try:
+			body = await request.json()
+		except ValueError:
+			body = {}
+		a = self.args
+		if a.username is not None and (body.get('UserName') != a.username or
+				body.get('Password') != a.password):
+			self.stats['unauthorized'] += 1
+			return web.json_response(_message('InvalidLoginCredentials'), status=401)
+		ilo.session(None)
+		if len(ilo.sessions) >= ilo.max_sessions:
+			self.stats['session_limit'] += 1
+			return web.json_response(_message('CreateLimitReachedForResource'), status=403)
+		token = uuid.uuid4().hex
+		ilo.sessions[token] = time.monotonic()
+		self.stats['logins'] += 1
+		location = ilo.url + PREFIX + '/SessionService/Sessions/' + token
+		return web.json_response(_message('Created'), status=201,
+				headers={'X-Auth-Token': token, 'Location': location})
+
+	async def serve(self):
+		a = self.args
+		context = None
+		if a.cert:
+			context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+			context.load_cert_chain(a.cert, a.key)
+		scheme = 'https' if context is not None else 'http'
+		addresses = self.listen_addresses()
+		for n, (host, port) in enumerate(addresses):
+			url = '{0}://{1}'.format(scheme, host) if port == {'http': 80, 'https': 443}[scheme] \
+					else '{0}://{1}:{2}'.format(scheme, host, port)
+			self.ilos[(host, port)] = MockILO(n, url, build_tree(n, a.dimms, a.controllers,
+					a.drives, a.nics), a.max_sessions, a.session_timeout)
+		app = web.Application()
+		app.router.add_route('*', '/{path:.*}', self.handle)
+		runner = web.AppRunner(app, access_log=None)
+		await runner.setup()
+		try:
+			for host, port in addresses:
+				await web.TCPSite(runner, host, port, ssl_context=context,
+						backlog=a.backlog).start()
+			print('{0} iLOs from {1} to {2}'.format(len(addresses),
+					self.ilos[addresses[0]].url, self.ilos[addresses[-1]].url), flush=True)
+			while True:
+				await asyncio.sleep(a.stats_interval or 3600)
+				if a.stats_interval:
+					print(json.dumps(self.stats), flush=True)
+		finally:
+			await runner.cleanup()
+
+
+def _message(message_id):
+	return {'Messages': [{'MessageID': 'Base.0.10.' + message_id}], 'Type': 'ExtendedError.1.0.0',
+		'error': {'@Message.ExtendedInfo': [{'MessageId': 'Base.0.10.' + message_id}],
+			'code': 'iLO.0.10.ExtendedInfo'}}
+
+
+if __name__ == '__main__':
+	ap = argparse.ArgumentParser(description = 'Mock HPE iLO REST server of many iLOs')
+	ap.add_argument('--hosts', type=int, default=1, help='iLOs to simulate, default is 1')
+	ap.add_argument('--address', default='127.0.0.1',
+			help='address of the first iLO, default is 127.0.0.1')
+	ap.add_argument('--port', type=int, default=8443, help='port of the first iLO, default is 8443')
+	ap.add_argument('--spread', choices=['port', 'address'], default='port',
+			help='put the iLOs on consecutive ports or addresses, default is port')
+	ap.add_argument('--cert', help='certificate file to speak https')
+	ap.add_argument('--key', help='key file of --cert')
+	ap.add_argument('--latency', type=float, default=0.05,
+			help='seconds of a response, default is 0.05')
+	ap.add_argument('--jitter', type=float, default=0.0,
+			help='standard deviation of --latency, default is 0')
+	ap.add_argument('--error-rate', type=float, default=0.0,
+			help='part of the requests which get 500, default is 0')
+	ap.add_argument('--hang-rate', type=float, default=0.0,
+			help='part of the requests which hang --hang seconds, default is 0')
+	ap.add_argument('--hang', type=float, default=60, help='seconds of a hang, default is 60')
+	ap.add_argument('--max-sessions', type=int, default=10,
+			help='sessions of an iLO at most, default is 10')
+	ap.add_argument('--session-timeout', type=float, default=1800,
+			help='seconds a session may be idle, default is 1800')
+	ap.add_argument('--username', help='user to accept, default is any')
+	ap.add_argument('--password', help='password of --username')
+	ap.add_argument('--dimms', type=int, default=24, help='DIMMs of an iLO, default is 24')
+	ap.add_argument('--controllers', type=int, default=1,
+			help='array controllers of an iLO, default is 1')
+	ap.add_argument('--drives', type=int, default=8,
+			help='disk drives of an array controller, default is 8')
+	ap.add_argument('--nics', type=int, default=2, help='NICs of an iLO, default is 2')
+	ap.add_argument('--backlog', type=int, default=128,
+			help='listen backlog of an iLO, default is 128')
+	ap.add_argument('--stats-interval', type=float, default=0,
+			help='seconds between counters printed on stdout, default is never')
+	args = ap.parse_args()
+	if web is None:
+		ap.error('aiohttp is needed')
+	if args.cert and not args.key:
+		ap.error('--cert needs --key')
+	if args.spread == 'address' and not ipaddress.ip_address(args.address).is_loopback \
+			and args.hosts > 1:
+		print('{0} and the next {1} addresses must be local'.format(args.address, args.hosts - 1),
+				file=sys.stderr)
+
+	try:
+		asyncio.run(Fleet(args).serve())
+	except KeyboardInterrupt:
+		pass
@@ -19,11 +19,370 @@ The basic usage pattern is:
 >>>        print(nic_mac)
 >>> print("CPU Count: {}".format(cpu_count))
 >>> i.logout()
+
+Responses are kept in a ResponseCache. How long a response is fresh
+depends on the resource read from it: inventory like SerialNumber is
+static, health and power state are fresh for iLO.FRESH_STATUS seconds,
+thermal and power readings for iLO.FRESH_SENSOR seconds. The cache is
+bounded by entries and bytes and evicts least recently used responses.
+>>> i.cache.stats()
+{'hits': 12, 'misses': 5, 'expired': 1, 'evictions': 0, 'entries': 5, 'bytes': 20480}
+
+With a SessionStore, login() reuses the session of an earlier run and
+logout() keeps it for the next one, a session is only created again when
+the iLO answers 401.
+>>> i = iLO(https_ip, user, password, session_store = SessionStore('sessions.db'))
+
+AsyncILO is the same on asyncio with aiohttp, many of them can share one
+aiohttp.ClientSession and poll thousands of iLOs from one thread.
+
+AdaptiveLimit keeps the requests in flight to many iLOs at what the
+network carries, from their latency and errors.
 '''
 
 import signal
+import os
 import re
-import redfish
+import json
+import time
+import sqlite3
+import asyncio
+import functools
+import contextlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import redfish
+except ImportError:
+    redfish = None
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class ResponseError(RuntimeError):
+    '''An iLO answered a request with an error status'''
+
+    def __init__(self, method, path, status):
+        super().__init__('{} {} answered {}'.format(method, path, status))
+        self.status = status
+
+
+class ResponseCache:
+    '''LRU cache of responses by uri.
+
+    A lookup passes the max age of a fresh response, None means a response
+    never gets stale. When there are more than max_entries responses or
+    their sizes add up to more than max_bytes, the least recently used
+    ones are evicted. Counters are returned by stats().
+    '''
+
+    def __init__(self, max_entries = 1024, max_bytes = 16 << 20, clock = time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        # uri -> (response, size, time stored), least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, uri, max_age = None):
+        '''Return the response of uri, or None if it is missing or stale'''
+        with self._lock:
+            entry = self._entries.get(uri)
+            if entry is None:
+                self.misses += 1
+                return None
+            if max_age is not None and self.clock() - entry[2] > max_age:
+                self.expired += 1
+                self.misses += 1
+                self._remove(uri)
+                return None
+            self._entries.move_to_end(uri)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, uri, response, size):
+        '''Store response, size is its length in bytes'''
+        with self._lock:
+            if uri in self._entries:
+                self._remove(uri)
+            if size > self.max_bytes:
+                return
+            self._entries[uri] = (response, size, self.clock())
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, uri = None):
+        '''Drop the response of uri, or all responses'''
+        with self._lock:
+            if uri is None:
+                self._entries.clear()
+                self._bytes = 0
+            elif uri in self._entries:
+                self._remove(uri)
+
+    def _remove(self, uri):
+        self._bytes -= self._entries.pop(uri)[1]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'expired': self.expired, 'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': self._bytes}
+
+
+class SessionStore:
+    '''Redfish session tokens in a SQLite file, by iLO host and user.
+
+    Each call opens its own connection, so threads and processes can share
+    the file; the journal is WAL and writers wait up to timeout seconds for
+    each other. The file is created readable by its owner only.
+    '''
+
+    def __init__(self, path, timeout = 10):
+        self.path = path
+        self.timeout = timeout
+        if not os.path.exists(path):
+            os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        with contextlib.closing(self._connect()) as db, db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS sessions (host TEXT, user TEXT, '
+                    'token TEXT, location TEXT, updated REAL, PRIMARY KEY (host, user))')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout = self.timeout)
+
+    def get(self, host, user):
+        '''Return (token, location) of the session, or None'''
+        db = self._connect()
+        try:
+            row = db.execute('SELECT token, location FROM sessions WHERE host = ? AND user = ?',
+                    (host, user)).fetchone()
+        finally:
+            db.close()
+        return tuple(row) if row is not None else None
+
+    def put(self, host, user, token, location):
+        db = self._connect()
+        try:
+            with db:
+                db.execute('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?)',
+                        (host, user, token, location, time.time()))
+        finally:
+            db.close()
+
+    def delete(self, host, user, token = None):
+        '''Forget the session, only if it is still token if given'''
+        db = self._connect()
+        try:
+            with db:
+                if token is None:
+                    db.execute('DELETE FROM sessions WHERE host = ? AND user = ?', (host, user))
+                else:
+                    db.execute('DELETE FROM sessions WHERE host = ? AND user = ? AND token = ?',
+                            (host, user, token))
+        finally:
+            db.close()
+
+
+class AdaptiveLimit:
+    '''AIMD limit of the requests in flight to a fleet of iLOs.
+
+    A request is congested when it times out or is answered 5xx, see
+    congested(), or when the recent latency, a moving average of good
+    requests, is more than tolerance times the base latency, the lowest
+    latency seen which is forgotten slowly so that a slower network
+    becomes the new base. Other failures, like a refused connection, a 4xx
+    answer or a failed login, are a problem of one iLO and change nothing.
+    The limit starts at initial, grows by one per request (slow start)
+    until the first congestion and by one per limit requests after it. On
+    congestion it is multiplied by backoff and the recent latency is
+    measured again; requests started before the last decrease are left
+    out, they were sent at the limit before it.
+
+    >>> limit = AdaptiveLimit(16, maximum = 512)
+    >>> start = limit.acquire()
+    >>> ... one request ...
+    >>> limit.release(start, ok)
+
+    history is [(time, limit)] of every change, log is called with
+    (limit before, limit after, latency) of every change.
+    '''
+
+    # good requests to measure the recent latency from
+    SAMPLES = 10
+
+    def __init__(self, initial = 16, minimum = 1, maximum = 256, backoff = 0.7,
+            tolerance = 1.5, log = None, clock = time.monotonic):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.log = log
+        self.clock = clock
+        self.base = None
+        self.recent = None
+        self.slow_start = True
+        self.inflight = 0
+        self.history = [(clock(), int(initial))]
+        self._decreased = None
+        # good requests in the recent latency
+        self._samples = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        '''Wait for a free slot, return the start time for release()'''
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                self._cond.wait()
+            self.inflight += 1
+        return self.clock()
+
+    @staticmethod
+    def congested(error):
+        '''Return True if a request failed with error because of congestion.
+
+        It did if it timed out or was answered 5xx, the causes of error are
+        looked at too: redfish raises RetriesExhaustedError from the error
+        of its first try.
+        '''
+        while error is not None:
+            if isinstance(error, (TimeoutError, asyncio.TimeoutError)) or \
+                    'timeout' in type(error).__name__.lower():
+                return True
+            # ResponseError, aiohttp.ClientResponseError, or the answer of
+            # redfish.rest.v1.ServerDownOrUnreachableError
+            status = getattr(error, 'status', None)
+            if status is None:
+                status = getattr(getattr(error, 'response', None), 'status', None)
+            if isinstance(status, int):
+                return status >= 500
+            error = error.__cause__
+        return False
+
+    def release(self, start, ok = True):
+        '''Free the slot of a request started at start.
+
+        ok: True if it succeeded, False if it failed because of congestion,
+            None if it failed otherwise, it neither grows nor shrinks the
+            limit then
+        '''
+        latency = self.clock() - start
+        with self._cond:
+            self.inflight -= 1
+            before = int(self.limit)
+            # requests started before the last decrease were sent at the
+            # limit before it, they tell nothing about the current one
+            current = self._decreased is None or start > self._decreased
+            if ok:
+                # forget 0.01% per request, to follow a network which got slower
+                self.base = latency if self.base is None else min(latency, self.base * 1.0001)
+                if current:
+                    self.recent = latency if self.recent is None else \
+                            self.recent + (latency - self.recent) * 0.1
+                    self._samples += 1
+            if ok is None or not current:
+                pass
+            elif not ok or (self._samples >= self.SAMPLES and
+                    self.recent > self.base * self.tolerance):
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self.slow_start = False
+                self._decreased = self.clock()
+                self.recent = None
+                self._samples = 0
+            elif self._samples < self.SAMPLES:
+                pass
+            elif self.slow_start:
+                self.limit = min(self.maximum, self.limit + 1)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            after = int(self.limit)
+            if after != before:
+                self.history.append((self.clock(), after))
+                if self.log is not None:
+                    self.log(before, after, latency)
+            # wake only the waiters which get a slot
+            free = after - self.inflight
+            if free > 0:
+                self._cond.notify(free)
+
+
+class KeyPath:
+    '''Keys compiled to find values in a response.
+
+    KeyPath(keys)(obj) returns the same as iLO._get_resource_by_keys(obj,
+    keys): lists on the path are walked into, a missing key gives None.
+    It walks level by level without recursion or slicing keys.
+    KeyPath.of(keys) returns a shared KeyPath of a tuple of keys.
+    '''
+
+    __slots__ = ('keys',)
+
+    def __init__(self, keys):
+        self.keys = tuple(keys)
+
+    @staticmethod
+    @functools.lru_cache(maxsize = 1024)
+    def of(keys):
+        return KeyPath(keys)
+
+    def __call__(self, obj):
+        keys = self.keys
+        try:
+            # dicts only, the usual case
+            for n, k in enumerate(keys):
+                if not isinstance(obj, dict):
+                    break
+                obj = obj[k]
+            else:
+                return [obj]
+            level = [obj]
+            for k in keys[n:]:
+                found = []
+                for o in level:
+                    if isinstance(o, dict):
+                        found.append(o[k])
+                    elif isinstance(o, list):
+                        # a list of dicts, the usual case
+                        for i in o:
+                            if isinstance(i, dict):
+                                found.append(i[k])
+                            elif isinstance(i, list):
+                                found.extend([d[k] for d in _dicts(i)])
+                level = found
+        except KeyError:
+            return None
+        return level
+
+
+def _dicts(values):
+    '''The dicts in values and in lists in values, in order'''
+    found = []
+    stack = [iter(values)]
+    while stack:
+        for o in stack[-1]:
+            if isinstance(o, dict):
+                found.append(o)
+            elif isinstance(o, list):
+                stack.append(iter(o))
+                break
+        else:
+            stack.pop()
+    return found
 
 
 class iLO:
@@ -31,6 +390,16 @@ class iLO:
 
     _prefix = '/rest/v1'
 
+    # freshness classes, seconds a response is fresh for a resource
+    FRESH_STATIC = None
+    FRESH_STATUS = 60
+    FRESH_SENSOR = 5
+
+    # a GET, login or logout answered 5xx is retried this many times,
+    # after RETRY_DELAY seconds doubled on each retry
+    RETRIES = 2
+    RETRY_DELAY = 0.1
+
     # Resource names for systems
     SN = 'sn'
     SKU = 'sku'
@@ -168,79 +537,221 @@ class iLO:
         M_NIC_MAC: ('/Managers/{manager}/EthernetInterfaces/{nic}', ['MacAddress']),
     }
 
+    # resources of inventory()
+    _inventory_system = [SN, SKU, MODEL, NAME, SYSTEM_HEALTH, CPU_FAMILY, CPU_COUNT,
+            CPU_HEALTH, MEM_HEALTH, MEM_GB, STORAGE_HEALTH, POWER_STATE, POWER_AUTO_ON]
+    _inventory_chassis = [C_FAN_NAME, C_FAN_N1, C_FAN_UNIT, C_FAN_HEALTH, C_TEMP_CELSIUS,
+            C_POWER_SUPPLY_HEALTH, C_POWER_REDUNDANCY_HEALTH]
+    _inventory_dimm = [DIMM_MB, DIMM_RANK, DIMM_HEALTH, DIMM_TYPE]
+    _inventory_array_controller = [ARRAY_CONTROLLER_HEALTH]
+    _inventory_disk_drive = [DISK_DRIVE_HEALTH, DISK_DRIVE_MB, DISK_DRIVE_SN, DISK_DRIVE_MODEL,
+            DISK_DRIVE_MEDIA_TYPE, DISK_DRIVE_INTERFACE_TYPE]
+    _inventory_logical_drive = [LOGICAL_DRIVE_HEALTH]
+    _inventory_nic = [NIC_NAME, NIC_SN, NIC_HEALTH, NIC_MAC, NIC_IPV4, NIC_IPV6,
+            NIC_PORT_HEALTH, NIC_PORT_SPEED, NIC_PORT_FULLDUPLEX]
+    _inventory_manager_nic = [M_NIC_MAC]
+
+    # resource name -> (extra name of the top resource, uri, keys)
+    _resource_map = {}
+    for _what, _map in (('system', _system_map), ('chassis', _chassis_map), ('manager', _manager_map)):
+        for _name, (_uri, _keys) in _map.items():
+            _resource_map[_name] = (_what, _uri, _keys)
+    # resource name -> KeyPath of its keys
+    _key_paths = {_name: KeyPath(_keys) for _name, (_what, _uri, _keys) in _resource_map.items()}
+    _id_path = KeyPath(['Id'])
+    del _what, _map, _name, _uri, _keys
+
 
-    def __init__(self, ilo_host, ilo_user, ilo_password, timeout = 10):
+    # keys of health and power state, readings are under these uris
+    _status_keys = ('Status', 'DIMMStatus', 'PowerState', 'PowerAutoOn')
+    _sensor_uris = ('/Thermal', '/Power')
+
+    @staticmethod
+    def _freshness(uri, keys):
+        '''Freshness class of the resource at uri and keys'''
+        if uri.endswith(iLO._sensor_uris):
+            return iLO.FRESH_SENSOR
+        if any(k in iLO._status_keys for k in keys):
+            return iLO.FRESH_STATUS
+        return iLO.FRESH_STATIC
+
+    def __init__(self, ilo_host, ilo_user, ilo_password, timeout = 10, cache = None,
+            session_store = None):
         '''Create an iLO object.
 
         Args:
         ilo_host: "https://<iLO_IP>"
         ilo_user: iLO user name
         ilo_password: iLO login password
+        cache: a ResponseCache, default is a new one with default bounds
+        session_store: a SessionStore to keep the session between runs
         '''
-        self.cache = {} # cache for uri and response
+        self.session_store = session_store
+        self._login_lock = threading.Lock()
+        self.cache = cache if cache is not None else ResponseCache()
         self.timeout = timeout
         self.rf_client = None
         self.ilo_host = ilo_host
         self.ilo_user = ilo_user
         self.ilo_password = ilo_password
+        # uri -> Future of a request in progress, see _fetch()
+        self._inflight = {}
+        self._lock = threading.Lock()
 
-    def _get_uri(self, path, use_cache = True):
-        if (path not in self.cache.keys()) or (not use_cache):
-            obj = self.rf_client.get(path, None).obj
-            self.cache[path] = obj
-        return self.cache[path]
-
-    def _get_resource_by_keys(self, obj, keys):
-        def _find(o, k, v):
-            if isinstance(o, list):
-                for i in o:
-                    _find(i, k, v)
-            elif isinstance(o, dict):
-                if len(k) == 1:
-                    v.append(o[k[0]])
-                else:
-                    _find(o[k[0]], k[1:], v)
+    def _get_uri(self, path, use_cache = True, max_age = None):
+        obj = self.cache.get(path, max_age) if use_cache else None
+        if obj is None:
+            obj = self._fetch(path)
+        return obj
 
+    def _fetch(self, path):
+        '''GET path, threads asking for the same path share one request'''
+        with self._lock:
+            f = self._inflight.get(path)
+            if f is not None:
+                wait = True
+            else:
+                wait = False
+                f = self._inflight[path] = Future()
+        if wait:
+            return f.result()
         try:
-            values = []
-            _find(obj, keys, values)
-            return values
-        except KeyError:
-            return None
+            key = self.rf_client.get_session_key()
+            r = self.rf_client.get(path, None)
+            if r.status == 401:
+                self._renew_session(key)
+                r = self.rf_client.get(path, None)
+            for n in range(iLO.RETRIES):
+                if r.status < 500:
+                    break
+                time.sleep(iLO.RETRY_DELAY * 2 ** n)
+                r = self.rf_client.get(path, None)
+            if r.status >= 300:
+                raise ResponseError('GET', path, r.status)
+            # redfish decodes the body on each use of obj, read is its bytes
+            obj = r.obj
+            self.cache.put(path, obj, len(r.read))
+            f.set_result(obj)
+        except Exception as e:
+            f.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[path]
+        return obj
+
+    def _get_resource_by_keys(self, obj, keys):
+        return KeyPath.of(tuple(keys))(obj)
 
-    def _get(self, what, uri, keys, extra , use_cache):
+    def _format(self, what, uri, keys, extra):
+        '''Return the full uri of a resource and its freshness'''
         if extra is None:
             extra = {what: '1'}
         elif what not in extra.keys():
             extra[what] = '1'
+        max_age = iLO._freshness(uri, keys)
         uri = iLO._prefix + uri
         uri = uri.format(**extra)
         if '{' in uri:
             raise ValueError('extra args needed')
-        r = self._get_uri(uri, use_cache)
-        return self._get_resource_by_keys(r, keys)
+        return uri, max_age
+
+    def _get(self, what, uri, path, extra , use_cache):
+        uri, max_age = self._format(what, uri, path.keys, extra)
+        r = self._get_uri(uri, use_cache, max_age)
+        return path(r)
+
+    def _group(self, resources, extra):
+        '''Group resources of get_many() by uri.
+
+        Return a dict of uri -> [max age, resource names, KeyPaths].
+        '''
+        requests = {}
+        for resource in resources:
+            try:
+                what, uri, keys = iLO._resource_map[resource]
+            except KeyError:
+                raise ValueError('Unknown resource name')
+            e = dict(extra) if extra is not None else None
+            uri, max_age = self._format(what, uri, keys, e)
+            r = requests.setdefault(uri, [max_age, [], []])
+            if r[0] is not None and (max_age is None or max_age > r[0]):
+                max_age = r[0]
+            r[0] = max_age
+            r[1].append(resource)
+            r[2].append(iLO._key_paths[resource])
+        return requests
 
 
     def login(self):
         '''Login to iLO.
 
         Call this method right after iLO() and before any iLO.get_xxx().
+        A session in the session store is used without checking it, it is
+        replaced when a request gets 401.
         '''
-        self.rf_client = redfish.redfish_client( \
+        if redfish is None:
+            raise RuntimeError('iLO needs the redfish package')
+        stored = None
+        if self.session_store is not None:
+            stored = self.session_store.get(self.ilo_host, self.ilo_user)
+        self.rf_client = iLO._retry(lambda: redfish.redfish_client( \
             base_url = self.ilo_host, \
             username = self.ilo_user, \
             password = self.ilo_password, \
             default_prefix = '/rest/v1', \
-			timeout = self.timeout)
-        self.rf_client.login(auth = 'session')
+            sessionkey = stored[0] if stored is not None else None, \
+			timeout = self.timeout), redfish.rest.v1.ServerDownOrUnreachableError)
+        if stored is not None:
+            self.rf_client.set_session_location(stored[1])
+        else:
+            self._new_session()
+
+    @staticmethod
+    def _retry(call, errors):
+        '''Return call(), tried again while it raises errors, see RETRIES.
+
+        redfish raises them for an answer which is not 2xx, without its
+        status, so other answers than 5xx are tried again too.
+        '''
+        for n in range(iLO.RETRIES):
+            try:
+                return call()
+            except errors:
+                time.sleep(iLO.RETRY_DELAY * 2 ** n)
+        return call()
+
+    def _new_session(self):
+        iLO._retry(lambda: self.rf_client.login(auth = 'session'),
+                redfish.rest.v1.SessionCreationError)
+        if self.session_store is not None:
+            self.session_store.put(self.ilo_host, self.ilo_user,
+                    self.rf_client.get_session_key(), self.rf_client.get_session_location())
+
+    def _renew_session(self, stale):
+        '''Replace the session key stale after a 401'''
+        with self._login_lock:
+            if self.rf_client.get_session_key() != stale:
+                # renewed by another thread
+                return
+            if self.session_store is not None:
+                stored = self.session_store.get(self.ilo_host, self.ilo_user)
+                if stored is not None and stored[0] != stale:
+                    # renewed by another process
+                    self.rf_client.set_session_key(stored[0])
+                    self.rf_client.set_session_location(stored[1])
+                    return
+            self._new_session()
 
     def logout(self):
         '''Logout from iLO.
 
-        Call this method to finish this session
+        Call this method to finish this session. With a session store the
+        session is kept for the next login().
         '''
-        if self.rf_client is not None:
-            self.rf_client.logout()
+        if self.rf_client is not None and self.session_store is None:
+            # the session is kept when the DELETE is not answered 2xx
+            iLO._retry(self.rf_client.logout, redfish.rest.v1.BadRequestError)
 
     def get_system(self, resource, extra = None, use_cache = True):
         '''Get system resources, e.g., CPU status, memory status etc.
@@ -251,8 +762,9 @@ class iLO:
         use_cache: Whether to use response cache. Resources like
             SerialNumber will not change frequently, it is faster to
             get SerialNumber from cache. Resources like fan RPM,
-            temperatures change very frequently, data about these
-            types of resources in cache is almost invalid.
+            temperatures change very frequently, so a cached response
+            is only used for FRESH_SENSOR seconds, health and power
+            state for FRESH_STATUS seconds. False always fetches.
             Default to True.
 
         Reource names prefixed by C_ can only be used with get_chassis(),
@@ -268,7 +780,7 @@ class iLO:
             uri, keys = iLO._system_map[resource]
         except KeyError:
             raise ValueError('Unknown resource name')
-        return self._get('system', uri, keys, extra, use_cache)
+        return self._get('system', uri, iLO._key_paths[resource], extra, use_cache)
 
     def get_chassis(self, resource, extra = None, use_cache = True):
         '''Get chassis resource. See get_system().'''
@@ -277,7 +789,7 @@ class iLO:
             uri, keys = iLO._chassis_map[resource]
         except KeyError:
             raise ValueError('Unknown resource name')
-        return self._get('chassis', uri, keys, extra, use_cache)
+        return self._get('chassis', uri, iLO._key_paths[resource], extra, use_cache)
 
     def get_manager(self, resource, extra = None, use_cache = True):
         '''Get resource about Manager(iLO). See get_system().'''
@@ -286,7 +798,7 @@ class iLO:
             uri, keys = iLO._manager_map[resource]
         except KeyError:
             raise ValueError('Unknown resource name')
-        return self._get('manager', uri, keys, extra, use_cache)
+        return self._get('manager', uri, iLO._key_paths[resource], extra, use_cache)
 
     def raw_get(self, uri, keys, use_cache = True):
         '''Get resource with URI and property names.
@@ -301,9 +813,101 @@ class iLO:
         See HPE iLO RESTful doc for valid URI and property names.
         '''
 
-        r = self._get_uri(uri, use_cache)
+        r = self._get_uri(uri, use_cache, iLO._freshness(uri, keys))
         return self._get_resource_by_keys(r, keys)
 
+    def get_many(self, resources, extra = None, use_cache = True):
+        '''Get several resources of get_system(), get_chassis() and
+        get_manager() with one request per distinct uri.
+
+        Args:
+        resources: resource names, e.g. [iLO.SYSTEM_HEALTH, iLO.POWER_STATE]
+        extra, use_cache: see get_system(), extra applies to all resources
+
+        Return a dict of resource name to the value list get_system()
+        returns.
+        e.g.:
+        >>> r = i.get_many([iLO.SYSTEM_HEALTH, iLO.POWER_STATE, iLO.C_TEMP_CELSIUS])
+        >>> r[iLO.POWER_STATE]
+        ['On']
+        '''
+
+        result = {}
+        for uri, (max_age, names, paths) in self._group(resources, extra).items():
+            obj = self._get_uri(uri, use_cache, max_age)
+            result.update(zip(names, [path(obj) for path in paths]))
+        return result
+
+    def inventory(self, workers = 8):
+        '''Crawl the inventory of the server with a pool of workers threads.
+
+        Collections (DIMMs, array controllers and their drives, NICs, iLO
+        NICs) are followed concurrently, each member is fetched once and
+        all its resources are read from that response. Responses in the
+        cache are not fetched again.
+
+        Return a dict:
+        {'system': {<resource name>: values},
+         'chassis': {<resource name>: values},
+         'dimms': [{'id': id, 'uri': href, <resource name>: values}, ...],
+         'array_controllers': [{'id':..., 'uri':..., ...,
+            'disk_drives': [...], 'logical_drives': [...]}, ...],
+         'nics': [...],
+         'manager_nics': [...]}
+        where values are as returned by get_system().
+        '''
+
+        def _collection(resource, extra = None):
+            return self.get_many([resource], extra)[resource] or []
+
+        def _member(href, name, extra, resources):
+            e = dict(extra)
+            e[name] = self.get_id(href)
+            item = {'id': e[name], 'uri': href}
+            item.update(self.get_many(resources, e))
+            return item
+
+        with ThreadPoolExecutor(max_workers = workers) as pool:
+            # the main thread waits for results, workers never do
+            def _members(collection, name, extra, resources):
+                return [pool.submit(_member, href, name, extra, resources)
+                        for href in collection.result()]
+
+            system = pool.submit(self.get_many, iLO._inventory_system)
+            chassis = pool.submit(self.get_many, iLO._inventory_chassis)
+            collections = [pool.submit(_collection, r)
+                    for r in (iLO.DIMMS, iLO.ARRAY_CONTROLLERS, iLO.NICS, iLO.M_NICS)]
+            dimms, controllers, nics, manager_nics = [_members(c, name, {}, resources)
+                    for c, name, resources in zip(collections,
+                        ('dimm', 'controller', 'nic', 'nic'),
+                        (iLO._inventory_dimm, iLO._inventory_array_controller,
+                            iLO._inventory_nic, iLO._inventory_manager_nic))]
+
+            controllers = [f.result() for f in controllers]
+            drives = []
+            for c in controllers:
+                e = {'controller': c['id']}
+                drives.append((pool.submit(_collection, iLO.DISK_DRIVES, e),
+                        pool.submit(_collection, iLO.LOGICAL_DRIVES, e)))
+            for c, (disk_drives, logical_drives) in zip(controllers, drives):
+                e = {'controller': c['id']}
+                c['disk_drives'] = _members(disk_drives, 'diskdrive', e,
+                        iLO._inventory_disk_drive)
+                c['logical_drives'] = _members(logical_drives, 'logicaldrive', e,
+                        iLO._inventory_logical_drive)
+
+            for c in controllers:
+                c['disk_drives'] = [f.result() for f in c['disk_drives']]
+                c['logical_drives'] = [f.result() for f in c['logical_drives']]
+            return {
+                'system': system.result(),
+                'chassis': chassis.result(),
+                'dimms': [f.result() for f in dimms],
+                'array_controllers': controllers,
+                'nics': [f.result() for f in nics],
+                'manager_nics': [f.result() for f in manager_nics],
+            }
+
     def get_id(self, uri):
         '''Get resource id.
 
@@ -313,7 +917,246 @@ class iLO:
         '''
 
         r = self._get_uri(uri)
-        return self._get_resource_by_keys(r, ['Id'])[0]
+        return iLO._id_path(r)[0]
+
+
+class AsyncILO(iLO):
+    '''iLO on asyncio, needs aiohttp.
+
+    The resources are those of iLO. get_system(), get_chassis(),
+    get_manager() return awaitables, raw_get(), get_id(), get_many(),
+    inventory(), login() and logout() are coroutines.
+
+    Pass one aiohttp.ClientSession, see client_session(), to all AsyncILO
+    objects of a process: they share its keep-alive connection pool, so a
+    poll reuses the TLS connections of the previous one. At most limit
+    requests to the iLO are in flight.
+
+    >>> async with AsyncILO.client_session() as http:
+    >>>     i = AsyncILO(https_ip, user, password, http)
+    >>>     await i.login()
+    >>>     health = await i.get_system(iLO.SYSTEM_HEALTH)
+    >>>     await i.logout()
+    '''
+
+    @staticmethod
+    def client_session(limit = 1000, limit_per_host = 4, keepalive = 60):
+        '''Create an aiohttp.ClientSession to share between AsyncILO objects.
+
+        Args:
+        limit: connections of all hosts
+        limit_per_host: connections to one iLO
+        keepalive: seconds an idle connection is kept
+        '''
+        # iLO certificates are self-signed
+        connector = aiohttp.TCPConnector(limit = limit, limit_per_host = limit_per_host,
+                ssl = False, keepalive_timeout = keepalive)
+        return aiohttp.ClientSession(connector = connector)
+
+    def __init__(self, ilo_host, ilo_user, ilo_password, http = None, timeout = 10,
+            limit = 4, cache = None, session_store = None):
+        '''Create an AsyncILO object.
+
+        Args:
+        http: an aiohttp.ClientSession, default is one of its own which
+            logout() closes
+        limit: requests in flight to this iLO
+        See iLO() for the others.
+        '''
+        if aiohttp is None:
+            raise RuntimeError('AsyncILO needs aiohttp')
+        super().__init__(ilo_host, ilo_user, ilo_password, timeout, cache, session_store)
+        self.http = http
+        self._own_http = http is None
+        self._limit = asyncio.Semaphore(limit)
+        self._login_lock = asyncio.Lock()
+        self._headers = {}
+        self._session_uri = None
+
+    def _timeout(self):
+        return aiohttp.ClientTimeout(total = self.timeout)
+
+    async def _get_uri(self, path, use_cache = True, max_age = None):
+        obj = self.cache.get(path, max_age) if use_cache else None
+        if obj is None:
+            obj = await self._fetch(path)
+        return obj
+
+    async def _fetch(self, path):
+        '''GET path, tasks asking for the same path share one request'''
+        f = self._inflight.get(path)
+        if f is not None:
+            return await asyncio.shield(f)
+        f = self._inflight[path] = asyncio.get_running_loop().create_future()
+        try:
+            token = self._headers.get('X-Auth-Token')
+            status, body = await self._request(path)
+            if status == 401:
+                await self._renew_session(token)
+                status, body = await self._request(path)
+            for n in range(iLO.RETRIES):
+                if status < 500:
+                    break
+                await asyncio.sleep(iLO.RETRY_DELAY * 2 ** n)
+                status, body = await self._request(path)
+            if status >= 300:
+                raise ResponseError('GET', path, status)
+            obj = json.loads(body)
+            self.cache.put(path, obj, len(body))
+            f.set_result(obj)
+        except asyncio.CancelledError:
+            f.cancel()
+            raise
+        except Exception as e:
+            f.set_exception(e)
+            # retrieved here, waiters get it from f
+            f.exception()
+            raise
+        finally:
+            del self._inflight[path]
+        return obj
+
+    async def _request(self, path):
+        async with self._limit:
+            async with self.http.get(self.ilo_host + path, headers = self._headers,
+                    timeout = self._timeout()) as r:
+                return r.status, await r.read()
+
+    async def _get(self, what, uri, path, extra, use_cache):
+        uri, max_age = self._format(what, uri, path.keys, extra)
+        r = await self._get_uri(uri, use_cache, max_age)
+        return path(r)
+
+    async def login(self):
+        '''Login to iLO, see iLO.login()'''
+        if self.http is None:
+            self.http = AsyncILO.client_session()
+        stored = None
+        if self.session_store is not None:
+            stored = self.session_store.get(self.ilo_host, self.ilo_user)
+        if stored is not None:
+            self._headers = {'X-Auth-Token': stored[0]}
+            self._session_uri = stored[1]
+        else:
+            await self._new_session()
+
+    async def _new_session(self):
+        body = {'UserName': self.ilo_user, 'Password': self.ilo_password}
+        for n in range(iLO.RETRIES + 1):
+            async with self._limit:
+                async with self.http.post(self.ilo_host + iLO._prefix + '/Sessions',
+                        json = body, timeout = self._timeout()) as r:
+                    retry = r.status >= 500 and n < iLO.RETRIES
+                    if not retry:
+                        r.raise_for_status()
+                        self._headers = {'X-Auth-Token': r.headers['X-Auth-Token']}
+                        self._session_uri = r.headers.get('Location')
+            if not retry:
+                break
+            await asyncio.sleep(iLO.RETRY_DELAY * 2 ** n)
+        if self.session_store is not None:
+            self.session_store.put(self.ilo_host, self.ilo_user,
+                    self._headers['X-Auth-Token'], self._session_uri)
+
+    async def _renew_session(self, stale):
+        '''See iLO._renew_session()'''
+        async with self._login_lock:
+            if self._headers.get('X-Auth-Token') != stale:
+                return
+            if self.session_store is not None:
+                stored = self.session_store.get(self.ilo_host, self.ilo_user)
+                if stored is not None and stored[0] != stale:
+                    self._headers = {'X-Auth-Token': stored[0]}
+                    self._session_uri = stored[1]
+                    return
+            await self._new_session()
+
+    async def logout(self):
+        '''Logout from iLO, see iLO.logout()'''
+        try:
+            if self._session_uri is not None and self.session_store is None:
+                uri = self._session_uri
+                if uri.startswith('/'):
+                    uri = self.ilo_host + uri
+                status = await self._delete(uri)
+                for n in range(iLO.RETRIES):
+                    if status < 500:
+                        break
+                    await asyncio.sleep(iLO.RETRY_DELAY * 2 ** n)
+                    status = await self._delete(uri)
+        finally:
+            self._session_uri = None
+            self._headers = {}
+            if self._own_http and self.http is not None:
+                await self.http.close()
+                self.http = None
+
+    async def _delete(self, uri):
+        async with self._limit:
+            async with self.http.delete(uri, headers = self._headers,
+                    timeout = self._timeout()) as r:
+                return r.status
+
+    async def raw_get(self, uri, keys, use_cache = True):
+        '''See iLO.raw_get()'''
+        r = await self._get_uri(uri, use_cache, iLO._freshness(uri, keys))
+        return self._get_resource_by_keys(r, keys)
+
+    async def get_id(self, uri):
+        '''See iLO.get_id()'''
+        r = await self._get_uri(uri)
+        return iLO._id_path(r)[0]
+
+    async def get_many(self, resources, extra = None, use_cache = True):
+        '''See iLO.get_many(), the distinct uris are fetched concurrently'''
+        requests = self._group(resources, extra)
+        objs = await asyncio.gather(*[self._get_uri(uri, use_cache, max_age)
+                for uri, (max_age, names, paths) in requests.items()])
+        result = {}
+        for obj, (max_age, names, paths) in zip(objs, requests.values()):
+            result.update(zip(names, [path(obj) for path in paths]))
+        return result
+
+    async def inventory(self):
+        '''See iLO.inventory(), concurrency is bounded by limit'''
+
+        async def _collection(resource, extra = None):
+            return (await self.get_many([resource], extra))[resource] or []
+
+        async def _member(href, name, extra, resources):
+            e = dict(extra)
+            e[name] = await self.get_id(href)
+            item = {'id': e[name], 'uri': href}
+            item.update(await self.get_many(resources, e))
+            return item
+
+        async def _members(resource, name, extra, resources):
+            return list(await asyncio.gather(*[_member(href, name, extra, resources)
+                    for href in await _collection(resource, extra)]))
+
+        async def _controller(c):
+            e = {'controller': c['id']}
+            c['disk_drives'], c['logical_drives'] = await asyncio.gather(
+                    _members(iLO.DISK_DRIVES, 'diskdrive', e, iLO._inventory_disk_drive),
+                    _members(iLO.LOGICAL_DRIVES, 'logicaldrive', e, iLO._inventory_logical_drive))
+            return c
+
+        system, chassis, dimms, controllers, nics, manager_nics = await asyncio.gather(
+                self.get_many(iLO._inventory_system),
+                self.get_many(iLO._inventory_chassis),
+                _members(iLO.DIMMS, 'dimm', {}, iLO._inventory_dimm),
+                _members(iLO.ARRAY_CONTROLLERS, 'controller', {}, iLO._inventory_array_controller),
+                _members(iLO.NICS, 'nic', {}, iLO._inventory_nic),
+                _members(iLO.M_NICS, 'nic', {}, iLO._inventory_manager_nic))
+        await asyncio.gather(*[_controller(c) for c in controllers])
+        return {
+            'system': system,
+            'chassis': chassis,
+            'dimms': dimms,
+            'array_controllers': controllers,
+            'nics': nics,
+            'manager_nics': manager_nics,
+        }
 
 
 if __name__ == '__main__':
@@ -323,73 +1166,37 @@ if __name__ == '__main__':
 
     ilo = iLO('https://ip', 'user', 'pass')
     ilo.login()
+    inv = ilo.inventory()
+    ilo.logout()
 
-    sn = ilo.get_system(iLO.SN)
-    model = ilo.get_system(iLO.MODEL)
-    status = ilo.get_system(iLO.SYSTEM_HEALTH)
-    cpu_family = ilo.get_system(iLO.CPU_FAMILY)
-    cpu_count = ilo.get_system(iLO.CPU_COUNT)
-    cpu_health = ilo.get_system(iLO.CPU_HEALTH)
-    mem_gb = ilo.get_system(iLO.MEM_GB)
-    dimms = ilo.get_system(iLO.DIMMS)
-    mb = []
-    for dimm in dimms:
-        dimm_id = ilo.get_id(dimm)
-        e = {'dimm': dimm_id}
-        mb.append(ilo.get_system(iLO.DIMM_MB, extra = e)[0])
-
-    acs = ilo.get_system(iLO.ARRAY_CONTROLLERS)
-    ac_health = []
+    system = inv['system']
+    chassis = inv['chassis']
+    mb = [d[iLO.DIMM_MB][0] for d in inv['dimms']]
+    ac_health = [c[iLO.ARRAY_CONTROLLER_HEALTH][0] for c in inv['array_controllers']]
     dd_cap = []
     dd_health = []
-    for ac in acs:
-        ac_id = ilo.get_id(ac)
-        ac_health.append(ilo.get_system(iLO.ARRAY_CONTROLLER_HEALTH, extra = {'controller': ac_id})[0])
-        hds = ilo.get_system(iLO.DISK_DRIVES, extra = {'controller': ac_id})
-        for hd in hds:
-            hd_id = ilo.get_id(hd)
-            e = {'controller': ac_id, 'diskdrive': hd_id}
-            dd_cap.append(ilo.get_system(iLO.DISK_DRIVE_MB,extra = e)[0])
-            dd_health.append(ilo.get_system(iLO.DISK_DRIVE_HEALTH,extra = e)[0])
-    nics = ilo.get_system(iLO.NICS)
+    for ac in inv['array_controllers']:
+        for hd in ac['disk_drives']:
+            dd_cap.append(hd[iLO.DISK_DRIVE_MB][0])
+            dd_health.append(hd[iLO.DISK_DRIVE_HEALTH][0])
     macs = []
     nic_health = []
     port_health = []
-    for nic in nics:
-        nic_id = ilo.get_id(nic)
-        e = {'nic': nic_id}
-        nh = ilo.get_system(iLO.NIC_HEALTH, extra = e)
-        nic_health += nh
-        ms = ilo.get_system(iLO.NIC_MAC, extra = e)
-        macs += ms
-        ph = ilo.get_system(iLO.NIC_PORT_HEALTH, extra = e)
-        port_health += ph
-
-    fan_name = ilo.get_chassis(iLO.C_FAN_NAME)
-    fan_n1 = ilo.get_chassis(iLO.C_FAN_N1)
-    fan_unit = ilo.get_chassis(iLO.C_FAN_UNIT)
-    fan_health = ilo.get_chassis(iLO.C_FAN_HEALTH)
-    temp_celsius = ilo.get_chassis(iLO.C_TEMP_CELSIUS)
-
-    power_health = ilo.get_chassis(iLO.C_POWER_SUPPLY_HEALTH)
-    power_rh = ilo.get_chassis(iLO.C_POWER_REDUNDANCY_HEALTH)
-
+    for nic in inv['nics']:
+        nic_health += nic[iLO.NIC_HEALTH]
+        macs += nic[iLO.NIC_MAC]
+        port_health += nic[iLO.NIC_PORT_HEALTH]
     mnmacs = []
-    m_nics = ilo.get_manager(iLO.M_NICS)
-    for n in m_nics:
-        n_id = ilo.get_id(n)
-        mnmac = ilo.get_manager(iLO.M_NIC_MAC, extra = {'nic': n_id})
-        mnmacs += mnmac
-
-    ilo.logout()
+    for n in inv['manager_nics']:
+        mnmacs += n[iLO.M_NIC_MAC]
 
-    print('Model: ' + model[0])
-    print('SN: ' + sn[0])
-    print('Status: ' + status[0])
-    print('CPU Family: ' + cpu_family[0])
-    print('CPU Count: {}'.format(cpu_count[0]))
-    print('CPU Status: ' + cpu_health[0])
-    print('Total Mem: {}GB'.format(mem_gb[0]))
+    print('Model: ' + system[iLO.MODEL][0])
+    print('SN: ' + system[iLO.SN][0])
+    print('Status: ' + system[iLO.SYSTEM_HEALTH][0])
+    print('CPU Family: ' + system[iLO.CPU_FAMILY][0])
+    print('CPU Count: {}'.format(system[iLO.CPU_COUNT][0]))
+    print('CPU Status: ' + system[iLO.CPU_HEALTH][0])
+    print('Total Mem: {}GB'.format(system[iLO.MEM_GB][0]))
     print('DIMMS:')
     print(mb)
     print('Array Controller Status:')
@@ -403,17 +1210,16 @@ if __name__ == '__main__':
     print('Ports:')
     print(port_health)
     print('Fans:')
-    print(fan_name)
-    print(fan_n1)
-    print(fan_unit)
-    print(fan_health)
+    print(chassis[iLO.C_FAN_NAME])
+    print(chassis[iLO.C_FAN_N1])
+    print(chassis[iLO.C_FAN_UNIT])
+    print(chassis[iLO.C_FAN_HEALTH])
     print('Temperatures:')
-    print(temp_celsius)
+    print(chassis[iLO.C_TEMP_CELSIUS])
     print('Power:')
-    print(power_health)
-    print(power_rh)
+    print(chassis[iLO.C_POWER_SUPPLY_HEALTH])
+    print(chassis[iLO.C_POWER_REDUNDANCY_HEALTH])
     print('iLO:')
     print(mnmacs)
 
     exit(0)
-
@@ -0,0 +1,289 @@
+#!/usr/bin/python3
+'''Benchmarks of jsonpath.py.
+
+stream: time and peak memory of jsonpath.py -p PATH on a large synthetic
+inventory dump, loaded with json.load and with --stream, and with
+--stream --first, which stops reading at the first value. Each run is a
+process of its own, its peak RSS is read from the rusage of the child.
+The dump is {"hosts": [{"name": ..., "serial": ..., "dimms": [...],
+"drives": [...], "sensors": [...]}, ...]} of --size MB, written to --file
+unless it is there already.
+
+ndjson: records per second of jsonpath.py run once per record of an
+NDJSON file of --records hosts (on the first --sample records), and of
+one jsonpath.py --ndjson with each of --jobs.
+
+eval: evaluations per second of JSONPath.find on loaded documents of wide
+'*' fan-outs, with a JSONPath made once and made for every evaluation,
+against legacy_find, the recursive find of jsonpath.py before paths were
+compiled.
+
+multi: records per second extracting --fields paths of each loaded host
+record, with a JSONPath.find per path and with one MultiPath.find.
+
+e.g.
+	./jsonpath-bench.py stream
+	./jsonpath-bench.py stream --size 2000 --path /hosts/-1/serial --path /hosts/?
+	./jsonpath-bench.py ndjson --records 200000 --jobs 1 4 8
+	./jsonpath-bench.py eval --width 1000
+	./jsonpath-bench.py multi --records 2000 --fields 10 40
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import timeit
+import argparse
+import subprocess
+from jsonpath import JSONPath
+from jsonpath import MultiPath
+
+JSONPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jsonpath.py')
+
+
+def make_host(n):
+	return {'name': 'node{0:06d}'.format(n), 'serial': 'CZJ{0:07d}'.format(n),
+		'model': 'ProLiant DL380 Gen9', 'health': random.choice(['OK', 'OK', 'OK', 'Warning']),
+		'dimms': [{'slot': 'PROC {0} DIMM {1}'.format(i // 12 + 1, i % 12 + 1), 'size_mb': 32768,
+			'status': 'GoodInUse'} for i in range(24)],
+		'drives': [{'location': '1I:1:{0}'.format(i), 'serial': 'WFK{0:05d}{1}'.format(n, i),
+			'capacity_mib': 1144609, 'health': 'OK'} for i in range(8)],
+		'sensors': [{'name': '{0:02d}-Sensor'.format(i), 'celsius': random.randint(20, 70)}
+			for i in range(40)]}
+
+
+def make_dump(path, size_mb):
+	'''Write a dump of about size_mb MB to path'''
+	limit = size_mb << 20
+	written = 0
+	n = 0
+	with open(path, 'w') as f:
+		f.write('{"generated": "jsonpath-bench", "hosts": [')
+		while written < limit:
+			text = json.dumps(make_host(n))
+			f.write(text if n == 0 else ',\n' + text)
+			written += len(text) + 2
+			n += 1
+		f.write(']}\n')
+	return n
+
+
+def run(args, stdin = None):
+	'''Run jsonpath.py with args, return (seconds, peak RSS in MB, output)'''
+	start = time.monotonic()
+	p = subprocess.Popen([sys.executable, JSONPATH] + args, stdout=subprocess.PIPE,
+			stderr=subprocess.STDOUT, stdin=subprocess.PIPE if stdin is not None else None)
+	if stdin is not None:
+		p.stdin.write(stdin)
+		p.stdin.close()
+	output = p.stdout.read()
+	pid, status, rusage = os.wait4(p.pid, 0)
+	seconds = time.monotonic() - start
+	if status != 0:
+		raise RuntimeError('jsonpath.py {} failed: {}'.format(' '.join(args), output.decode()))
+	return seconds, rusage.ru_maxrss / 1024, output
+
+
+def bench_stream(args):
+	if not os.path.exists(args.file):
+		print('Writing {} MB to {}'.format(args.size, args.file), file=sys.stderr)
+		make_dump(args.file, args.size)
+	size = os.path.getsize(args.file) / (1 << 20)
+	fmt = '{:<28}{:<8}{:>10}{:>12}{:>12}'
+	print('{} ({:.0f} MB)'.format(args.file, size))
+	print(fmt.format('Path', 'Mode', 'Seconds', 'MB/s', 'Peak(MB)'))
+	for path in args.path:
+		outputs = []
+		for mode, extra in (('load', []), ('stream', ['--stream']), ('first', ['--stream', '--first'])):
+			seconds, peak, output = run(['-f', args.file, '-p', path] + extra)
+			outputs.append(output)
+			print(fmt.format(path, mode, '{:.2f}'.format(seconds), '{:.1f}'.format(size / seconds),
+					'{:.0f}'.format(peak)))
+		if outputs[0] != outputs[1]:
+			print('{}: outputs differ'.format(path), file=sys.stderr)
+
+
+def bench_ndjson(args):
+	if not os.path.exists(args.file):
+		print('Writing {} records to {}'.format(args.records, args.file), file=sys.stderr)
+		with open(args.file, 'w') as f:
+			for n in range(args.records):
+				f.write(json.dumps(make_host(n)))
+				f.write('\n')
+	with open(args.file, 'rb') as f:
+		lines = f.readlines()
+	fmt = '{:<24}{:>10}{:>12}'
+	print('{} ({} records), path {}'.format(args.file, len(lines), args.path))
+	print(fmt.format('Mode', 'Seconds', 'Records/s'))
+	sample = lines[:args.sample]
+	start = time.monotonic()
+	for line in sample:
+		run(['-p', args.path], line)
+	seconds = time.monotonic() - start
+	print(fmt.format('process per record', '{:.2f}'.format(seconds),
+			'{:.0f}'.format(len(sample) / seconds)))
+	for jobs in args.jobs:
+		seconds, peak, output = run(['--ndjson', '-f', args.file, '-p', args.path, '-j', str(jobs)])
+		print(fmt.format('--ndjson -j {}'.format(jobs), '{:.2f}'.format(seconds),
+				'{:.0f}'.format(len(lines) / seconds)))
+
+
+def legacy_find(elements, json_object):
+	'''JSONPath.find before compile_path, for comparison'''
+	def _find(o, k, v):
+		if isinstance(o, list):
+			if len(k) == 1:
+				if k[0] == '*':
+					v.extend(o)
+				elif k[0] == '?':
+					v.append(len(o))
+				else:
+					v.append(o[int(k[0])])
+			else:
+				if k[0] == '*':
+					for _o in o:
+						_find(_o, k[1:], v)
+				elif k[0] == '?':
+					raise SyntaxError("'?' can only appear at the last")
+				else:
+					_find(o[int(k[0])], k[1:], v)
+		elif isinstance(o, dict):
+			if len(k) == 1:
+				if k[0] == '*':
+					for key, val in o.items():
+						v.append(val)
+				elif k[0] == '?':
+					v.extend(o.keys())
+				else:
+					v.append(o[k[0]])
+			else:
+				if k[0] == '*':
+					for key, val in o.items():
+						_find(val, k[1:], v)
+				elif k[0] == '?':
+					raise SyntaxError("'?' can only appear at the last")
+				else:
+					_find(o[k[0]], k[1:], v)
+
+	values = []
+	_find(json_object, elements, values)
+	return values
+
+
+def bench_eval(args):
+	doc = {'hosts': [make_host(n) for n in range(args.width)]}
+	doc['rack'] = {'node{0:06d}'.format(n): {'slot': n, 'pdu': {'a': n, 'b': n + 1}}
+			for n in range(args.width)}
+	fmt = '{:<28}{:>8}{:>14}{:>14}{:>14}{:>9}'
+	print('{} hosts, evaluations per second, best of {}'.format(args.width, args.repeat))
+	print(fmt.format('Path', 'Values', 'legacy', 'compiled', 'new JSONPath', 'Speedup'))
+	for path in args.path:
+		jp = JSONPath(path)
+		values = jp.find(doc)
+		elements = list(jp.elements)
+		if legacy_find(elements, doc) != values:
+			print('{}: results differ'.format(path), file=sys.stderr)
+		rates = []
+		for f in (lambda: legacy_find(elements, doc), lambda: jp.find(doc),
+				lambda: JSONPath(path).find(doc)):
+			number = max(1, args.number // max(1, len(values)))
+			best = min(timeit.repeat(f, number=number, repeat=args.repeat))
+			rates.append(number / best)
+		print(fmt.format(path, len(values), '{:.0f}'.format(rates[0]), '{:.0f}'.format(rates[1]),
+				'{:.0f}'.format(rates[2]), '{:.2f}x'.format(rates[1] / rates[0])))
+
+
+def host_fields():
+	'''Paths of the fields of a host of make_host()'''
+	fields = ['/name', '/serial', '/model', '/health', '/dimms/?', '/drives/?']
+	for i in range(8):
+		fields += ['/drives/{}/serial'.format(i), '/drives/{}/capacity_mib'.format(i)]
+	for i in range(40):
+		fields += ['/sensors/{}/celsius'.format(i)]
+	for i in range(24):
+		fields += ['/dimms/{}/size_mb'.format(i)]
+	return fields
+
+
+def bench_multi(args):
+	records = [make_host(n) for n in range(args.records)]
+	fields = host_fields()
+	fmt = '{:<8}{:>16}{:>16}{:>9}'
+	print('{} records, records per second, best of {}'.format(args.records, args.repeat))
+	print(fmt.format('Fields', 'JSONPath each', 'MultiPath', 'Speedup'))
+	for n in args.fields:
+		paths = fields[:n]
+		jps = [JSONPath(p) for p in paths]
+		mp = MultiPath(paths)
+
+		def each():
+			for r in records:
+				{jp.path: jp.find(r) for jp in jps}
+
+		def multi():
+			for r in records:
+				mp.find(r)
+
+		if {jp.path: jp.find(records[0]) for jp in jps} != mp.find(records[0]):
+			print('{} fields: results differ'.format(n), file=sys.stderr)
+		rates = [len(records) / min(timeit.repeat(f, number=1, repeat=args.repeat))
+				for f in (each, multi)]
+		print(fmt.format(len(paths), '{:.0f}'.format(rates[0]), '{:.0f}'.format(rates[1]),
+				'{:.2f}x'.format(rates[1] / rates[0])))
+
+
+if __name__ == '__main__':
+	ap = argparse.ArgumentParser(description = 'Benchmarks of jsonpath.py')
+	sub = ap.add_subparsers(dest='command', required=True)
+	sp = sub.add_parser('stream', help='json.load against --stream on a large file')
+	sp.add_argument('--file', default='/tmp/jsonpath-bench.json',
+			help='the dump, default is /tmp/jsonpath-bench.json')
+	sp.add_argument('--size', type=int, default=200,
+			help='MB of the dump if it is written, default is 200')
+	sp.add_argument('--path', action='append',
+			help='path to find, can be repeated, default is /hosts/0/serial, '
+			'/hosts/-1/dimms/?, /hosts/*/health')
+	sp = sub.add_parser('ndjson', help='a process per record against --ndjson')
+	sp.add_argument('--file', default='/tmp/jsonpath-bench.ndjson',
+			help='the records, default is /tmp/jsonpath-bench.ndjson')
+	sp.add_argument('--records', type=int, default=50000,
+			help='records if the file is written, default is 50000')
+	sp.add_argument('--sample', type=int, default=50,
+			help='records to run a process for, default is 50')
+	sp.add_argument('--path', default='/drives/*/serial',
+			help='path to find, default is /drives/*/serial')
+	sp.add_argument('--jobs', type=int, nargs='+', default=[1, os.cpu_count()],
+			help='--jobs values to run with, default is 1 and the CPU count')
+	sp = sub.add_parser('eval', help='compiled against legacy find on loaded documents')
+	sp.add_argument('--width', type=int, default=1000,
+			help='hosts in the document, default is 1000')
+	sp.add_argument('--path', action='append',
+			help='path to find, can be repeated, default is /hosts/*/serial, '
+			'/hosts/*/dimms/*/size_mb, /rack/*/pdu/*, /*/*/?, /hosts/7/drives/3/serial')
+	sp.add_argument('--number', type=int, default=200000,
+			help='about the values found in a timing, default is 200000')
+	sp.add_argument('--repeat', type=int, default=5,
+			help='timings of a path, the best is taken, default is 5')
+	sp = sub.add_parser('multi', help='a JSONPath per field against one MultiPath')
+	sp.add_argument('--records', type=int, default=2000,
+			help='host records, default is 2000')
+	sp.add_argument('--fields', type=int, nargs='+', default=[5, 20, 80],
+			help='numbers of fields to extract, default is 5 20 80')
+	sp.add_argument('--repeat', type=int, default=5,
+			help='timings of a number of fields, the best is taken, default is 5')
+	args = ap.parse_args()
+	if args.command == 'multi':
+		bench_multi(args)
+	elif args.command == 'eval':
+		if not args.path:
+			args.path = ['/hosts/*/serial', '/hosts/*/dimms/*/size_mb', '/rack/*/pdu/*', '/*/*/?',
+					'/hosts/7/drives/3/serial']
+		bench_eval(args)
+	elif args.command == 'ndjson':
+		bench_ndjson(args)
+	elif args.command == 'stream':
+		if not args.path:
+			args.path = ['/hosts/0/serial', '/hosts/-1/dimms/?', '/hosts/*/health']
+		bench_stream(args)
@@ -1,8 +1,17 @@
 #!/usr/bin/python3
 
-from shlex import shlex
+from collections import deque
+from collections import namedtuple
+from itertools import islice
+from functools import lru_cache
 import sys
+import os
 import io
+import re
+import glob
+import gzip
+import json
+import multiprocessing
 
 
 class JSONPath:
@@ -24,100 +33,750 @@ class JSONPath:
 		jp = JSONPath("/a/b/c")
 		sio = io.StringIO('{"{'foo': ['bar', 'zoo']}")
 		data = jp.find(json.load(sio))
+	find_stream() finds the same in a file object without loading the
+	whole document, for documents too big for memory.
+		data = jp.find_stream(open('inventory.json'))
+	iter_find() yields the values one at a time, so the first few can be
+	taken without finding the rest.
+		first = next(jp.iter_find(data), None)
+	A path is compiled by compile_path() at the first find, the compiled
+	paths are cached, so a JSONPath made again for the same path is cheap.
 	'''
 	def __init__(self, path, sep='/'):
 		'''
 		path: a string
 		sep: the elements seperator character, the default is slash
 		'''
-		self.sio= io.StringIO(path)
+		self.path = path
 		self.sep = sep
 		self.elements = []
-		self.ready = False
+		self.program = None
 
 
-	def __getchar(self):
-		self.curr = self.sio.read(1)
-		return self.curr
+	def __parse(self):
+		'''Compile the path at the first use, see compile_path()'''
+		if self.program is None:
+			self.program = compile_path(self.path, self.sep)
+			self.elements = list(self.program.elements)
 
 
-	def __split(self):
-		ele = ''
-		self.elements = []
-		while self.__getchar() != '':
-			c = self.curr
-			if c == self.sep:
-				if ele != '':
-					self.elements.append(ele)
-					ele = ''
-			elif c == '\\':
-				ele += self.__getchar()
+	def find(self, json_object):
+		''' json_object: the loaded json document'''
+		values = []
+		self.__parse()
+		children, collect = self.program.children, self.program.collect
+		last = len(children)
+		if self.program.chain:
+			# no '*' before the last element, one object per level
+			o = json_object
+			for step in children:
+				found = step(o)
+				if not found:
+					return values
+				o = found[0]
+			collect(o, values)
+			return values
+		# depth first, stack[d] iterates over the objects of elements[d],
+		# the objects of the last element are collected at once
+		stack = [iter((json_object,))]
+		while stack:
+			d = len(stack) - 1
+			step = children[d]
+			if d == last - 1:
+				for o in stack.pop():
+					for c in step(o):
+						collect(c, values)
+				continue
+			for o in stack[-1]:
+				stack.append(iter(step(o)))
+				break
 			else:
-				ele += c
-		if ele != '':
-			self.elements.append(ele)
-		if len(self.elements) == 0:
-			raise ValueError('Empty path')
-		self.ready = True
+				stack.pop()
+		return values
 
 
-	def __parse(self):
+	def iter_find(self, json_object):
+		'''Yield the values of find() one by one, in the same order.
+
+		Nothing is found before it is asked for, so stopping early saves
+		the rest of the walk. An error is raised when the walk reaches it,
+		after the values before it are yielded.
 		'''
-		This method returns a generator
+		self.__parse()
+		children, select = self.program.children, self.program.select
+		last = len(children)
+		# depth first like find()
+		stack = [iter((json_object,))]
+		while stack:
+			d = len(stack) - 1
+			if d == last:
+				for o in stack.pop():
+					yield from select(o)
+				continue
+			for o in stack[-1]:
+				stack.append(iter(children[d](o)))
+				break
+			else:
+				stack.pop()
+
+
+	def find_stream(self, fp, chunk_size=1 << 20, limit=None):
+		'''Same as find(json.load(fp)) without loading the document.
+
+		fp: a text file object, read chunk_size characters at a time
+		limit: stop reading when this many values are found
+		Only the values found are decoded, everything else is skipped
+		over, so memory depends on the size of the values found and not
+		on the size of the document. Numbers and literals skipped over are
+		not checked, nor is the rest of the input after limit values.
 		'''
-		if not self.ready:
-			self.__split()
+		self.__parse()
+		if limit is None:
+			values = []
+		elif limit > 0:
+			values = _Limited(limit)
+		else:
+			return []
+		s = _Scanner(fp, chunk_size)
+		try:
+			self.__walk(s, 0, values)
+		except _Enough:
+			return list(values)
+		s.end()
+		return list(values)
 
 
-	def find(self, json_object):
-		''' json_object: the loaded json document'''
-		def _find(o, k, v):
-			if isinstance(o, list):
-				if len(k) == 1:
-					if k[0] == '*':
-						v.extend(o)
-					elif k[0] == '?':
-						v.append(len(o))
-					else:
-						v.append(o[int(k[0])])
-				else: # there are still more than one path elements
-					if k[0] == '*':
-						for _o in o:
-							_find(_o, k[1:], v)
-					elif k[0] == '?':
-						raise SyntaxError("'?' can only appear at the last")
-					else:
-						_find(o[int(k[0])], k[1:], v)
-			elif isinstance(o, dict):
-				if len(k) == 1:
-					if k[0] == '*':
-						for key, val in o.items():
-							v.append(val)
-					elif k[0] == '?':
-						v.extend(o.keys())
-					else:
-						v.append(o[k[0]])
+	def __walk(self, s, i, values):
+		'''Match self.elements[i:] against the value s is at'''
+		k = self.elements[i]
+		last = i == len(self.elements) - 1
+		c = s.peek()
+		if c == '{':
+			if k == '?' and not last:
+				raise SyntaxError("'?' can only appear at the last")
+			found = False
+			for key in s.members():
+				if k == '?':
+					values.append(key)
+					s.skip()
+				elif k == '*' or k == key:
+					found = True
+					self.__take(s, i, last, values)
 				else:
-					if k[0] == '*':
-						for key, val in o.items():
-							_find(val, k[1:], v)
-					elif k[0] == '?':
-						raise SyntaxError("'?' can only appear at the last")
+					s.skip()
+			if k not in ('*', '?') and not found:
+				raise KeyError(k)
+		elif c == '[':
+			if k == '?' and not last:
+				raise SyntaxError("'?' can only appear at the last")
+			if k == '*':
+				for n in s.items():
+					self.__take(s, i, last, values)
+			elif k == '?':
+				count = 0
+				for n in s.items():
+					count += 1
+					s.skip()
+				values.append(count)
+			else:
+				index = int(k)
+				if index < 0:
+					# the text of the last -index items, walked at the end
+					tail = deque(maxlen=-index)
+					for n in s.items():
+						tail.append(s.text())
+					if len(tail) < -index:
+						raise IndexError('list index out of range')
+					self.__take(_Scanner(io.StringIO(tail[0])), i, last, values)
+					return
+				found = False
+				for n in s.items():
+					if n == index:
+						found = True
+						self.__take(s, i, last, values)
 					else:
-						_find(o[k[0]], k[1:], v)
+						s.skip()
+				if not found:
+					raise IndexError('list index out of range')
+		else:
+			s.skip()
 
-		values = []
+
+	def __take(self, s, i, last, values):
+		if last:
+			values.append(s.value())
+		else:
+			self.__walk(s, i + 1, values)
+
+
+class _Enough(Exception):
+	'''Raised by _Limited when it is full'''
+
+
+class _Limited(list):
+	'''A list of values which raises _Enough when limit values are in it'''
+
+	def __init__(self, limit):
+		super().__init__()
+		self.limit = limit
+
+
+	def append(self, value):
+		super().append(value)
+		if len(self) >= self.limit:
+			raise _Enough()
+
+
+class _Scanner:
+	'''Pull scanner of a JSON text read in chunks from a file object.
+
+	It keeps a buffer of the text not scanned yet, and the text of the
+	value being read by text() or value(). Values which are all in the
+	buffer are skipped by decoding them, larger ones item by item.
+	'''
+	_ws = re.compile(r'[ \t\n\r]*')
+	# the characters of a string up to its closing quote or the end of the
+	# buffer, it never fails and so never backtracks over a long string
+	_chars = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*')
+	_scalar = re.compile(r'[^,:\]}\s]+')
+	_decoder = json.JSONDecoder()
+	# a value cut by the end of the buffer fails to decode at most this
+	# many characters before it, e.g. in "fals" or "\u00e", but for an
+	# unterminated string
+	_cut = 8
+
+	def __init__(self, fp, chunk_size=1 << 20):
+		self.fp = fp
+		self.chunk_size = chunk_size
+		self.buf = ''
+		self.pos = 0
+		self.eof = False
+		# start of the text kept for text(), or None
+		self.mark = None
+
+
+	def fill(self):
+		'''Read a chunk, return False at the end of the input'''
+		if self.eof:
+			return False
+		keep = self.pos if self.mark is None else self.mark
+		# double the buffer of a long value or token, not to copy and scan
+		# it again for each chunk
+		chunk = self.fp.read(max(self.chunk_size, len(self.buf) - keep))
+		self.buf = self.buf[keep:] + chunk
+		self.pos -= keep
+		if self.mark is not None:
+			self.mark = 0
+		if chunk == '':
+			self.eof = True
+			return False
+		return True
+
+
+	def error(self, msg):
+		raise json.JSONDecodeError(msg, self.buf, self.pos)
+
+
+	def peek(self):
+		'''Skip whitespaces, return the next character or '' at the end'''
+		while True:
+			self.pos = self._ws.match(self.buf, self.pos).end()
+			if self.pos < len(self.buf):
+				return self.buf[self.pos]
+			if not self.fill():
+				return ''
+
+
+	def expect(self, c):
+		if self.peek() != c:
+			self.error('Expecting {!r}'.format(c))
+		self.pos += 1
+
+
+	def match(self, pattern):
+		'''Match pattern at the current position, with the whole token in
+		the buffer'''
+		while True:
+			m = pattern.match(self.buf, self.pos)
+			if m is not None and (m.end() < len(self.buf) or self.eof):
+				self.pos = m.end()
+				return m.group()
+			if not self.fill():
+				if m is None:
+					self.error('Expecting value')
+
+
+	def string(self):
+		'''Return the string at the current position, with its quotes; the
+		text of a long one is scanned once, not again after each chunk'''
+		end = self.pos + 1
+		while True:
+			end = self._chars.match(self.buf, end).end()
+			if end < len(self.buf) and self.buf[end] == '"':
+				text = self.buf[self.pos:end + 1]
+				self.pos = end + 1
+				return text
+			if end < len(self.buf) - 1:
+				# a backslash before a newline
+				self.pos = end
+				self.error('Invalid \\escape')
+			# fill() moves the text in the buffer
+			scanned = end - self.pos
+			if not self.fill():
+				self.error('Unterminated string')
+			end = self.pos + scanned
+
+
+	def members(self):
+		'''Iterate over the keys of the object at the current position, the
+		caller reads or skips the value of each key'''
+		self.expect('{')
+		if self.peek() == '}':
+			self.pos += 1
+			return
+		while True:
+			if self.peek() != '"':
+				self.error('Expecting property name enclosed in double quotes')
+			key = self.string()
+			self.expect(':')
+			yield json.loads(key) if '\\' in key else key[1:-1]
+			c = self.peek()
+			if c == '}':
+				self.pos += 1
+				return
+			if c != ',':
+				self.error("Expecting ',' delimiter")
+			self.pos += 1
+
+
+	def items(self):
+		'''Iterate over the indexes of the array at the current position,
+		the caller reads or skips each item'''
+		self.expect('[')
+		if self.peek() == ']':
+			self.pos += 1
+			return
+		n = 0
+		while True:
+			yield n
+			n += 1
+			c = self.peek()
+			if c == ']':
+				self.pos += 1
+				return
+			if c != ',':
+				self.error("Expecting ',' delimiter")
+			self.pos += 1
+
+
+	def skip(self):
+		'''Skip the value at the current position'''
+		c = self.peek()
+		if c == '"':
+			self.string()
+		elif c == '{' or c == '[':
+			# decoding a value in the buffer is faster than scanning it
+			try:
+				self.pos = self._decoder.raw_decode(self.buf, self.pos)[1]
+				return
+			except ValueError:
+				# not all in the buffer, or invalid
+				pass
+			if c == '{':
+				for key in self.members():
+					self.skip()
+			else:
+				for n in self.items():
+					self.skip()
+		elif c == '':
+			self.error('Expecting value')
+		else:
+			self.match(self._scalar)
+
+
+	def text(self):
+		'''Skip the value at the current position and return its text'''
+		self.peek()
+		self.mark = self.pos
+		try:
+			self.skip()
+			return self.buf[self.mark:self.pos]
+		finally:
+			self.mark = None
+
+
+	def value(self):
+		'''Decode the value at the current position'''
+		self.peek()
+		self.mark = self.pos
+		try:
+			while True:
+				try:
+					obj, end = self._decoder.raw_decode(self.buf, self.pos)
+					# a number cut by the end of the buffer goes on in the next chunk
+					if self.eof or (end < len(self.buf) and
+							self.buf[end] not in '.eE+-0123456789'):
+						self.pos = end
+						return obj
+				except json.JSONDecodeError as e:
+					# fail at once on an invalid value, not at the end of the input
+					if self.eof or (e.pos < len(self.buf) - self._cut and
+							not e.msg.startswith('Unterminated string')):
+						raise
+				self.fill()
+		finally:
+			self.mark = None
+
+
+	def end(self):
+		if self.peek() != '':
+			self.error('Extra data')
+
+
+Program = namedtuple('Program', ['elements', 'children', 'collect', 'select', 'chain'])
+Program.__doc__ = '''A compiled path.
+
+elements: the path elements
+children: for each element but the last, a function of an object which
+	returns the objects the element selects in it
+collect: a function of an object and a list which appends the values the
+	last element selects in the object to the list
+select: a function of an object which returns the values the last
+	element selects in it, for iter_find()
+chain: True if no element but the last selects more than one object
+'''
+
+
+def _index(element):
+	'''Return element as a list index, or None if it is a key only'''
+	try:
+		return int(element)
+	except ValueError:
+		return None
+
+
+def _children(element):
+	'''Return Program.children of a path element'''
+	index = _index(element)
+	if element == '*':
+		def children(o):
+			if isinstance(o, list):
+				return o
+			if isinstance(o, dict):
+				return o.values()
+			return ()
+	elif element == '?':
+		def children(o):
+			if isinstance(o, (list, dict)):
+				raise SyntaxError("'?' can only appear at the last")
+			return ()
+	elif index is None:
+		def children(o):
+			if isinstance(o, dict):
+				return (o[element],)
+			if isinstance(o, list):
+				# raises the ValueError
+				return (o[int(element)],)
+			return ()
+	else:
+		def children(o):
+			if isinstance(o, list):
+				return (o[index],)
+			if isinstance(o, dict):
+				return (o[element],)
+			return ()
+	return children
+
+
+def _collect(element):
+	'''Return Program.collect of the last path element'''
+	index = _index(element)
+	if element == '*':
+		def collect(o, values):
+			if isinstance(o, list):
+				values.extend(o)
+			elif isinstance(o, dict):
+				values.extend(o.values())
+	elif element == '?':
+		def collect(o, values):
+			if isinstance(o, list):
+				values.append(len(o))
+			elif isinstance(o, dict):
+				values.extend(o.keys())
+	elif index is None:
+		def collect(o, values):
+			if isinstance(o, dict):
+				values.append(o[element])
+			elif isinstance(o, list):
+				values.append(o[int(element)])
+	else:
+		def collect(o, values):
+			if isinstance(o, list):
+				values.append(o[index])
+			elif isinstance(o, dict):
+				values.append(o[element])
+	return collect
+
+
+def _select(element):
+	'''Return Program.select of the last path element'''
+	if element != '?':
+		return _children(element)
+
+	def select(o):
+		if isinstance(o, list):
+			return (len(o),)
+		if isinstance(o, dict):
+			return o.keys()
+		return ()
+	return select
+
+
+@lru_cache(maxsize=256)
+def compile_path(path, sep='/'):
+	'''Compile a path of JSONPath into a Program.
+
+	Programs are immutable and cached by path and sep, so JSONPath objects
+	of the same path share one.
+	'''
+	elements = []
+	ele = ''
+	chars = iter(path)
+	for c in chars:
+		if c == sep:
+			if ele != '':
+				elements.append(ele)
+				ele = ''
+		elif c == '\\':
+			ele += next(chars, '')
+		else:
+			ele += c
+	if ele != '':
+		elements.append(ele)
+	if len(elements) == 0:
+		raise ValueError('Empty path')
+	return Program(tuple(elements), tuple([_children(e) for e in elements[:-1]]),
+			_collect(elements[-1]), _select(elements[-1]), '*' not in elements[:-1])
+
+
+class MultiPath:
+	'''Find the values of several paths in one walk of a json object.
+
+	The paths are merged into a prefix trie of their elements, so shared
+	prefixes like /hosts/* of /hosts/*/name and /hosts/*/serial are walked
+	once. find() returns a dict of the values of each path, the same as
+	JSONPath(path, sep).find() of the path; the first error of any path
+	is raised.
+	e.g.
+		mp = MultiPath(['/hosts/*/name', '/hosts/*/serial'])
+		data = mp.find(json.load(open('inventory.json')))
+		names = data['/hosts/*/name']
+	'''
+	def __init__(self, paths, sep='/'):
+		'''
+		paths: a list of strings
+		sep: the elements seperator character, the default is slash
+		'''
+		self.paths = list(dict.fromkeys(paths))
+		self.sep = sep
+		self.trie = None
+
+
+	def __parse(self):
+		'''Build the trie at the first use.
+
+		A level of the trie is (leaves, inner) of the elements after an
+		element: leaves are (collect, slot) of the elements a path ends at,
+		its values are the list slot of find(), inner are (children, level)
+		of the elements paths go on from.
+		'''
+		if self.trie is not None:
+			return
+		# element: [slot or None, {next element: ...}]
+		root = {}
+		self.size = 0
+		self.slots = []
+		for path in self.paths:
+			elements = compile_path(path, self.sep).elements
+			level = root
+			for element in elements[:-1]:
+				level = level.setdefault(element, [None, {}])[1]
+			node = level.setdefault(elements[-1], [None, {}])
+			# paths of the same elements like /a/b and a/b share a slot,
+			# the first one gets the list
+			copy = node[0] is not None
+			if not copy:
+				node[0] = self.size
+				self.size += 1
+			self.slots.append((path, node[0], copy))
+
+		def freeze(level):
+			leaves = tuple([(_collect(e), n[0]) for e, n in level.items() if n[0] is not None])
+			inner = tuple([(_children(e), freeze(n[1])) for e, n in level.items() if n[1]])
+			return leaves, inner
+
+		self.trie = freeze(root)
+
+
+	def find(self, json_object):
+		''' json_object: the loaded json document'''
 		self.__parse()
-		_find(json_object, self.elements, values)
-		return values
+		values = [[] for i in range(self.size)]
+		self.__walk(self.trie, json_object, values)
+		return {path: list(values[slot]) if copy else values[slot]
+				for path, slot, copy in self.slots}
+
+
+	@staticmethod
+	def __walk(level, o, values):
+		leaves, inner = level
+		for collect, slot in leaves:
+			collect(o, values[slot])
+		for children, next_level in inner:
+			for c in children(o):
+				MultiPath.__walk(next_level, c, values)
 
 
 def printerr(msg):
 	print('Error: ', msg, file=sys.stderr)
 
 
+def open_input(name):
+	'''Open a file by name, '-' is stdin, .gz files are decompressed'''
+	if name == '-':
+		return sys.stdin
+	if name.endswith('.gz'):
+		return gzip.open(name, 'rt')
+	return open(name)
+
+
+def batch_tasks(names, ndjson, batch=1000):
+	'''Split the inputs of batch mode into tasks of batch_evaluate().
+
+	A task is (name, number of the first line, lines) of up to batch lines
+	of an NDJSON input, or (name, None, None) of a whole document.
+	'''
+	for name in names:
+		if not ndjson:
+			yield name, None, None
+			continue
+		f = open_input(name)
+		try:
+			first = 1
+			lines = []
+			for line in f:
+				lines.append(line)
+				if len(lines) == batch:
+					yield name, first, lines
+					first += len(lines)
+					lines = []
+			if lines:
+				yield name, first, lines
+		finally:
+			if f is not sys.stdin:
+				f.close()
+
+
+_batch_path = None
+_batch_stream = False
+_batch_limit = None
+
+
+def batch_init(paths, sep, stream, limit=None):
+	'''Compile the paths of batch_evaluate(), once per process'''
+	global _batch_path, _batch_stream, _batch_limit
+	if len(paths) == 1:
+		_batch_path = JSONPath(paths[0], sep)
+	else:
+		_batch_path = MultiPath(paths, sep)
+	_batch_stream = stream
+	_batch_limit = limit
+
+
+def _batch_find(json_object):
+	'''Find the values of _batch_path, at most _batch_limit of them'''
+	if _batch_limit is None:
+		return _batch_path.find(json_object)
+	return list(islice(_batch_path.iter_find(json_object), _batch_limit))
+
+
+def _record(name, line, find):
+	'''Return (output line, True if find() failed)'''
+	r = {'file': name}
+	if line is not None:
+		r['line'] = line
+	try:
+		r['values'] = find()
+	except Exception as e:
+		r['error'] = '{}: {}'.format(type(e).__name__, e)
+	return json.dumps(r), 'error' in r
+
+
+def batch_evaluate(task):
+	'''Return (NDJSON output lines, failed records) of a task of
+	batch_tasks()'''
+	name, first, lines = task
+	if lines is None:
+		def find():
+			f = open_input(name)
+			try:
+				if _batch_stream:
+					return _batch_path.find_stream(f, limit=_batch_limit)
+				return _batch_find(json.load(f))
+			finally:
+				if f is not sys.stdin:
+					f.close()
+		line, error = _record(name, None, find)
+		return [line], int(error)
+	output = []
+	failed = 0
+	for n, line in enumerate(lines, first):
+		if line.strip():
+			line, error = _record(name, n, lambda: _batch_find(json.loads(line)))
+			output.append(line)
+			failed += error
+	return output, failed
+
+
+def batch(names, paths, sep, ndjson, stream, jobs, limit=None, out=sys.stdout):
+	'''Evaluate paths against every input, write NDJSON to out.
+
+	Each output line is {"file": name, "line": n, "values": [...]}, line
+	is only there for NDJSON inputs and "error" replaces "values" for a
+	record which failed. With several paths, values is a dict of the
+	values of each path. Stream and limit, the most values of a record,
+	only work with one path. With jobs > 1 the tasks are evaluated by a pool
+	of processes, at most 4 tasks per process are in flight so a large
+	input is not read ahead. Return the number of failed records.
+	'''
+	failed = 0
+
+	def write(result):
+		nonlocal failed
+		lines, n = result
+		for line in lines:
+			out.write(line)
+			out.write('\n')
+		failed += n
+
+	tasks = batch_tasks(names, ndjson)
+	if jobs <= 1:
+		batch_init(paths, sep, stream, limit)
+		for task in tasks:
+			write(batch_evaluate(task))
+		return failed
+	with multiprocessing.Pool(jobs, batch_init, (paths, sep, stream, limit)) as pool:
+		pending = deque()
+		for task in tasks:
+			pending.append(pool.apply_async(batch_evaluate, (task,)))
+			if len(pending) >= jobs * 4:
+				write(pending.popleft().get())
+		while pending:
+			write(pending.popleft().get())
+	return failed
+
+
 if __name__ == '__main__':
-	import json
 	import argparse
 
 	ap = argparse.ArgumentParser(description='Get data from a JSON file.')
@@ -125,20 +784,80 @@ if __name__ == '__main__':
 			help='Path elements seperator, default is slash')
 	ap.add_argument('-f', default='',
 			help='Path to a JSON file, default is stdin')
-	ap.add_argument('-p', required=True, help='a file-path-like string')
+	ap.add_argument('-p', action='append', default=[],
+			help='a file-path-like string, can be repeated; the values of '
+			'several paths are a dict keyed by path, found in one walk')
+	ap.add_argument('--path-file',
+			help='Read more paths from this file, one per line')
+	ap.add_argument('--stream', action='store_true',
+			help='Read the input in chunks and decode only the values found, '
+			'for documents too big to load')
+	group = ap.add_mutually_exclusive_group()
+	group.add_argument('--first', action='store_true',
+			help='Find only the first value, same as --limit 1')
+	group.add_argument('--limit', type=int, metavar='N',
+			help='Find at most N values and stop walking the input')
+	ap.add_argument('--ndjson', action='store_true',
+			help='The input has one JSON document per line, write the values '
+			'of each as a line of JSON')
+	ap.add_argument('-g', '--glob', action='append', default=[],
+			help='Find in every file matching this pattern, ** matches '
+			'directories, can be repeated; the values of each file are '
+			'written as a line of JSON, a pattern matching no file is an error')
+	ap.add_argument('-j', '--jobs', type=int, default=1,
+			help='Processes to evaluate NDJSON lines or files with, '
+			'default is 1, 0 is one per CPU')
 	args = ap.parse_args()
 	seperator = args.s[0]
-	path_str = args.p
+	paths = args.p
 	jf = args.f
+	if args.path_file:
+		with open(args.path_file) as f:
+			paths.extend([line.rstrip('\n') for line in f if line.strip()])
+	if not paths:
+		ap.error('a path is required, give -p or --path-file')
+	limit = 1 if args.first else args.limit
+	if limit is not None and limit < 1:
+		ap.error('--limit must be at least 1')
+	if args.stream and len(paths) > 1:
+		ap.error('--stream takes only one path')
+	if limit is not None and len(paths) > 1:
+		ap.error('--first and --limit take only one path')
+
+	if args.ndjson or args.glob:
+		names = []
+		for pattern in args.glob:
+			matched = sorted(glob.glob(pattern, recursive=True))
+			if not matched:
+				printerr('No files match {}'.format(pattern))
+				exit(1)
+			names.extend(matched)
+		if not args.glob:
+			names = [jf or '-']
+		elif jf:
+			names.insert(0, jf)
+		jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+		try:
+			failed = batch(names, paths, seperator, args.ndjson, args.stream, jobs, limit)
+		except (OSError, UnicodeDecodeError) as e:
+			printerr(e)
+			exit(1)
+		exit(1 if failed else 0)
 	if len(jf) == 0:
 		json_file = sys.stdin
 	else:
 		json_file = open(jf)
 
 	try:
-		jobject = json.load(json_file)
-		jp = JSONPath(path_str, seperator)
-		v = jp.find(jobject)
+		if len(paths) > 1:
+			v = MultiPath(paths, seperator).find(json.load(json_file))
+		elif args.stream:
+			v = JSONPath(paths[0], seperator).find_stream(json_file, limit=limit)
+		elif limit is not None:
+			jp = JSONPath(paths[0], seperator)
+			v = list(islice(jp.iter_find(json.load(json_file)), limit))
+		else:
+			v = JSONPath(paths[0], seperator).find(json.load(json_file))
 		print(v)
 	except json.JSONDecodeError as e:
 		printerr('Failed to decode the input')
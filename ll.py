@@ -1,18 +1,72 @@
 #!/usr/bin/python3
 
+import os
+import sys
+import zlib
 import select
+import signal
 import socket
 import time
 import logging
 import argparse
+import asyncio
+import relay
+from multiprocessing.sharedctypes import RawArray
 
 class LL:
 	"""The core for socket, multi-threading and Async I/O."""
-	def __init__(self, host1, port1, host2, port2) :
+
+	# counters of a process, see run_workers()
+	STATS = ('accepted', 'handoffs', 'paired', 'closed')
+	STATS_HELP = ('accepted clients', 'clients passed to another worker',
+			'paired clients', 'closed pairs')
+	ACCEPTED, HANDOFFS, PAIRED, CLOSED = range(len(STATS))
+	# longest pairing key line, with the newline
+	KEY_MAX = 256
+
+	def __init__(self, host1, port1, host2, port2, engine = 'copy',
+			high_water = relay.HIGH_WATER, low_water = relay.LOW_WATER,
+			pair_key = False, metrics_address = None, session_options = None) :
 		self.host1 = host1
 		self.port1 = port1
 		self.host2 = host2
 		self.port2 = port2
+		self.engine = engine
+		# bytes buffered per direction of a session, see relay.Session
+		self.high_water = high_water
+		self.low_water = low_water
+		# more keyword arguments of relay.Session, e.g. bufsize
+		self.session_options = session_options or {}
+		# If pair_key is True, a client sends a line with a key first and
+		# is paired with the client of the other side sending the same
+		# key, else clients are paired in accept order.
+		self.pair_key = pair_key
+		self.reuseport = False
+		self.worker = 0
+		self.peers = None
+		self.inbox = None
+		self.stats = [0] * len(LL.STATS)
+		# serve metrics on "host:port" or "unix:/path", see relay.Metrics
+		self.metrics_address = metrics_address
+		self.loop_stats = relay.RelayStats()
+
+
+	def shard(self, worker, peers, inbox, stats) :
+		"""Run as one of len(peers) worker processes, see run_workers().
+
+		worker: index of this worker
+		peers: unix datagram sockets to pass a client to worker i
+		inbox: the socket this worker receives passed clients on
+		stats: where to count, a slice of the shared counters
+		"""
+		self.pair_key = True
+		self.reuseport = True
+		self.worker = worker
+		self.peers = peers
+		self.inbox = inbox
+		self.stats = stats
+		# the parent serves the counters of all workers
+		self.metrics_address = None
 
 
 	def __init_socket(self, host, port) :
@@ -20,9 +74,14 @@ class LL:
 
 		try :
 			sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			if self.reuseport :
+				sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+			# accepted sockets inherit the buffer sizes
+			relay.set_buffers(sock, self.session_options.get('rcvbuf', 0),
+					self.session_options.get('sndbuf', 0))
 			sock.bind((host, port))
 			logging.info('Bind to {0}:{1}'.format(host, port))
-			sock.listen(5)
+			sock.listen(socket.SOMAXCONN)
 		except socket.error as e :
 			logging.error('Failed to init socket')
 			logging.error(e)
@@ -38,67 +97,317 @@ class LL:
 		self.ss2 = self.__init_socket(self.host2, self.port2)
 		self.ss1_fd = self.ss1.fileno()
 		self.ss2_fd = self.ss2.fileno()
-		self.cs1 = None
-		self.cs2 = None
-		self.cs1_fd = -1
-		self.cs2_fd = -1
+		# accepted clients waiting for a peer on side 1 and 2,
+		# key -> socket. The key is the fd unless pairing by key. A dict
+		# keeps the accept order and allows O(1) removal of a client
+		# which leaves before being paired.
+		self.pending = ({}, {})
+		# fd of a waiting client -> (side, key)
+		self.waiting = {}
+		# fd of a client yet to send its key -> (side, socket)
+		self.handshakes = {}
+		# fd of both sockets in a pair -> relay.Session
+		self.sessions = {}
 		self.epoll = select.epoll()
 		self.epoll.register(self.ss1.fileno(), select.EPOLLIN)
 		self.epoll.register(self.ss2.fileno(), select.EPOLLIN)
+		self.inbox_fd = -1
+		if self.inbox != None :
+			self.inbox_fd = self.inbox.fileno()
+			self.epoll.register(self.inbox_fd, select.EPOLLIN)
+		if self.metrics_address != None :
+			metrics = relay.Metrics()
+			metrics.add(self.loop_stats.collect)
+			metrics.add(stats_collector(self.stats, 1))
+			relay.MetricsServer(metrics, self.metrics_address).start()
 
 		while True :
 			try :
 				res = self.epoll.poll(timeout=10)
+				self.loop_stats.wakeups += 1
 				logging.debug('epoll timeout')
 				logging.debug(res)
 				# res is [(fd, events), ...]
-				for r in res :
-					fd = r[0]
-					event = r[1]
+				for fd, event in res :
 					if fd == self.ss1_fd and event & select.EPOLLIN :
-						try :
-							conn = self.ss1.accept()
-						except socket.error as e :
-							logging.error('socket 1 accept error')
-
-						logging.info('client 1 connected')
-						self.cs1 = conn[0]
-						self.cs1_fd = conn[0].fileno()
-						self.epoll.register(self.cs1_fd, select.EPOLLIN)
+						self.__accept(self.ss1, 0)
 					elif fd == self.ss2_fd and event & select.EPOLLIN :
-						try :
-							conn = self.ss2.accept()
-						except socket.error as e :
-							logging.error('socket 2 accept error')
-
-						logging.info('client 2 connected')
-						self.cs2 = conn[0]
-						self.cs2_fd = self.cs2.fileno()
-						self.epoll.register(self.cs2_fd, select.EPOLLIN)
-					elif fd == self.cs1_fd and event & select.EPOLLIN :
-						self.__read_write(self.cs1, self.cs2)
-					elif fd == self.cs2_fd and event & select.EPOLLIN :
-						self.__read_write(self.cs2, self.cs1)
-					elif event & select.EPOLLHUP or event & select.EPOLLERR :
-						break
+						self.__accept(self.ss2, 1)
+					elif fd in self.sessions :
+						self.__read_write(self.sessions[fd], fd, event)
+					elif fd in self.handshakes :
+						self.__handshake(fd)
+					elif fd == self.inbox_fd :
+						self.__receive()
+					else :
+						self.__drop_pending(fd)
 			except Exception as e :
 				logging.error(e)
 
-	def __read_write(self, s1, s2):
-		if s1 == None or s2 == None:
+	def __accept(self, ss, side) :
+		try :
+			conn = ss.accept()
+		except socket.error as e :
+			logging.error('socket {0} accept error'.format(side + 1))
+			logging.error(e)
+			return
+
+		cs = conn[0]
+		logging.info('client {0} connected from {1}'.format(side + 1, conn[1]))
+		self.stats[LL.ACCEPTED] += 1
+		if self.pair_key :
+			# edge-triggered, a partial key line does not wake us again
+			cs.setblocking(False)
+			self.handshakes[cs.fileno()] = (side, cs)
+			self.epoll.register(cs.fileno(), select.EPOLLIN | select.EPOLLET)
+		else :
+			self.__wait(side, cs.fileno(), cs)
+
+	def __handshake(self, fd) :
+		side, cs = self.handshakes[fd]
+		try :
+			line = cs.recv(LL.KEY_MAX, socket.MSG_PEEK)
+		except BlockingIOError :
+			return
+		except socket.error as e :
+			logging.error(e)
+			line = b''
+		n = line.find(b'\n')
+		if n < 0 and 0 < len(line) < LL.KEY_MAX :
+			return
+		del self.handshakes[fd]
+		self.epoll.unregister(fd)
+		key = line[:n].strip()
+		if n < 0 or len(key) == 0 :
+			logging.error('client {0} sent no pairing key'.format(fd))
+			cs.close()
+			return
+		# take the key line only, the data after it is for the peer
+		cs.recv(n + 1)
+		owner = self.worker
+		if self.peers != None :
+			owner = zlib.crc32(key) % len(self.peers)
+		if owner == self.worker :
+			self.__wait(side, key, cs)
 			return
-		max_bytes = 8192
 		try :
-			data = s1.recv(max_bytes)
-			if len(data) == 0:
-				logging.info('close client 1 socket')
-				self.cs1.close()
-				self.cs1 = None
-				self.epoll.unregister(self.cs1_fd)
-				self.cs1_fd = -1
-			s2.send(data)
+			socket.send_fds(self.peers[owner], [bytes([side]) + key], [fd])
+			self.stats[LL.HANDOFFS] += 1
 		except socket.error as e :
+			logging.error('Failed to pass client to worker {0}'.format(owner))
 			logging.error(e)
+		cs.close()
+
+	def __receive(self) :
+		try :
+			msg, fds, flags, addr = socket.recv_fds(self.inbox, LL.KEY_MAX + 1, 1)
+		except BlockingIOError :
+			return
+		for fd in fds :
+			self.__wait(msg[0], msg[1:], socket.socket(fileno = fd))
+
+	def __wait(self, side, key, cs) :
+		pending = self.pending[side]
+		if key in pending :
+			logging.warning('drop client with duplicate pairing key {0}'.format(key))
+			self.__drop_pending(pending[key].fileno())
+		# Only watch for hang up until the client has a peer, its data
+		# stays in the kernel buffer.
+		pending[key] = cs
+		self.waiting[cs.fileno()] = (side, key)
+		self.epoll.register(cs.fileno(), select.EPOLLRDHUP)
+		p1, p2 = self.pending
+		if self.pair_key :
+			if key in p1 and key in p2 :
+				self.__pair(p1.pop(key), p2.pop(key))
+		else :
+			while p1 and p2 :
+				self.__pair(p1.pop(next(iter(p1))), p2.pop(next(iter(p2))))
+
+	def __pair(self, cs1, cs2) :
+		fd1 = cs1.fileno()
+		fd2 = cs2.fileno()
+		for fd in (fd1, fd2) :
+			self.epoll.unregister(fd)
+			del self.waiting[fd]
+		session = relay.Session(cs1, cs2, self.engine,
+				self.high_water, self.low_water, **self.session_options)
+		session.register(self.epoll)
+		self.sessions[fd1] = session
+		self.sessions[fd2] = session
+		self.stats[LL.PAIRED] += 1
+		self.loop_stats.opened(session)
+		logging.info('pair {0} <-> {1}, {2} sessions'.format(
+				fd1, fd2, len(self.sessions) // 2))
+
+	def __drop_pending(self, fd) :
+		w = self.waiting.pop(fd, None)
+		if w != None :
+			side, key = w
+			logging.info('unpaired client {0} left'.format(fd))
+			self.epoll.unregister(fd)
+			self.pending[side].pop(key).close()
+
+	def __close_session(self, session) :
+		del self.sessions[session.fd1]
+		del self.sessions[session.fd2]
+		session.close()
+		self.stats[LL.CLOSED] += 1
+		self.loop_stats.closing(session)
+		logging.info('close pair {0} <-> {1}, {2} sessions'.format(
+				session.fd1, session.fd2, len(self.sessions) // 2))
+
+	def __read_write(self, session, fd, event):
+		if not session.handle(fd, event) :
+			self.__close_session(session)
+
+
+def stats_collector(stats, n) :
+	"""Return a relay.Metrics collector of the LL.STATS of n workers"""
+	k = len(LL.STATS)
+	def _collect() :
+		return [('relay_ll_{0}_total'.format(name), 'counter', text,
+				[({'worker': str(i)}, stats[i * k + j]) for i in range(n)])
+				for j, (name, text) in enumerate(zip(LL.STATS, LL.STATS_HELP))]
+	return _collect
+
+
+def run_workers(n, make_ll, interval = 60, metrics_address = None,
+		max_failures = 5, min_uptime = 10) :
+	"""Run n LL processes which share the ports with SO_REUSEPORT.
+
+	The kernel spreads the accepts over the workers, so clients are paired
+	by key and passed to the worker owning the key, see LL.shard().
+	make_ll: returns a new LL for a worker
+	interval: seconds between printing the counters of all workers
+	metrics_address: where to serve the counters of all workers
+	A worker which exits is restarted. One which exits within min_uptime
+	seconds max_failures times in a row (e.g. it can not bind) stops all
+	of them and exits with 1.
+	"""
+	k = len(LL.STATS)
+	shared = RawArray('q', n * k)
+	stats = memoryview(shared).cast('B').cast('q')
+	inboxes = []
+	peers = []
+	for i in range(n) :
+		inbox, peer = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+		inbox.setblocking(False)
+		inboxes.append(inbox)
+		peers.append(peer)
+
+	# SIGTERM exits through the finally below, so the workers go too
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	workers = {}
+	# start time and quick exits in a row of each worker
+	started = [0] * n
+	failures = [0] * n
+	def _spawn(i) :
+		started[i] = time.monotonic()
+		pid = os.fork()
+		if pid == 0 :
+			try :
+				ll = make_ll()
+				ll.shard(i, peers, inboxes[i], stats[i * k:(i + 1) * k])
+				ll.run()
+			finally :
+				os._exit(1)
+		workers[pid] = i
+
+	for i in range(n) :
+		_spawn(i)
+	if metrics_address != None :
+		metrics = relay.Metrics()
+		metrics.add(stats_collector(stats, n))
+		relay.MetricsServer(metrics, metrics_address).start()
+	try :
+		last = time.monotonic()
+		while True :
+			time.sleep(1)
+			while workers :
+				pid, status = os.waitpid(-1, os.WNOHANG)
+				if pid == 0 :
+					break
+				if pid not in workers :
+					continue
+				i = workers.pop(pid)
+				if time.monotonic() - started[i] < min_uptime :
+					failures[i] += 1
+				else :
+					failures[i] = 0
+				if failures[i] >= max_failures :
+					logging.error('worker {0} exited {1} times in a row within {2} seconds, '
+							'stop'.format(i, failures[i], min_uptime))
+					sys.exit(1)
+				logging.error('worker {0} exited, restart it'.format(i))
+				stats[i * k:(i + 1) * k] = memoryview(bytes(8 * k)).cast('q')
+				_spawn(i)
+			if time.monotonic() - last >= interval :
+				last = time.monotonic()
+				total = [sum(stats[j::k]) for j in range(k)]
+				print('{0} workers: {1}, active {2}'.format(n,
+						', '.join(['{0} {1}'.format(name, v) for name, v in zip(LL.STATS, total)]),
+						total[LL.PAIRED] - total[LL.CLOSED]), flush=True)
+	finally :
+		for pid in workers :
+			os.kill(pid, signal.SIGTERM)
+
+class _LLClient(relay.RelayProtocol):
+	def __init__(self, ll, side) :
+		super().__init__(ll.high_water, ll.low_water)
+		self.ll = ll
+		self.side = side
+
+
+	def connection_made(self, transport) :
+		super().connection_made(transport)
+		# leave the data in the kernel until there is a peer
+		transport.pause_reading()
+		self.ll._arrive(self)
+
+
+	def lost(self) :
+		self.ll._leave(self)
+
+
+class AsyncLL(LL):
+	"""LL on asyncio transports, runs on uvloop if it is installed."""
+
+	def run(self) :
+		loop = relay.new_event_loop()
+		asyncio.set_event_loop(loop)
+		try :
+			loop.run_until_complete(self.serve())
+		finally :
+			loop.close()
+
+	async def serve(self) :
+		# clients waiting for a peer on side 1 and 2, in accept order
+		self.pending = ({}, {})
+		loop = asyncio.get_running_loop()
+		servers = []
+		for side, host, port in ((0, self.host1, self.port1), (1, self.host2, self.port2)) :
+			srv = await loop.create_server(lambda side = side: _LLClient(self, side),
+					host, port, backlog = socket.SOMAXCONN)
+			logging.info('Bind to {0}:{1}'.format(host, port))
+			servers.append(srv)
+		await asyncio.gather(*[srv.serve_forever() for srv in servers])
+
+	def _arrive(self, client) :
+		logging.info('client {0} connected from {1}'.format(client.side + 1,
+				client.transport.get_extra_info('peername')))
+		self.pending[client.side][client] = None
+		p1, p2 = self.pending
+		while p1 and p2 :
+			c1 = next(iter(p1))
+			c2 = next(iter(p2))
+			del p1[c1]
+			del p2[c2]
+			c1.pair(c2)
+			c2.pair(c1)
+
+	def _leave(self, client) :
+		self.pending[client.side].pop(client, None)
 
 if __name__ == '__main__':
 	ap = argparse.ArgumentParser(description = 'Listen on two sockets and exchange data ')
@@ -106,11 +415,42 @@ if __name__ == '__main__':
 	ap.add_argument('--port1', nargs=1, required=True, type=int)
 	ap.add_argument('--host2', nargs=1, required=True)
 	ap.add_argument('--port2', nargs=1, required=True, type=int)
+	ap.add_argument('--engine', choices=['epoll', 'asyncio'], default='epoll',
+			help='Event loop, default is epoll. asyncio uses uvloop if installed')
+	ap.add_argument('--relay', choices=relay.ENGINES, default='copy',
+			help='How to move bytes between sockets with epoll, default is copy')
+	ap.add_argument('--high-water', type=int, default=relay.HIGH_WATER,
+			help='Stop reading a client when this many bytes are buffered for its peer, '
+			'with asyncio the write buffer limit of its peer')
+	ap.add_argument('--low-water', type=int, default=relay.LOW_WATER,
+			help='Resume reading when the buffer drains to this many bytes')
+	relay.add_arguments(ap)
+	ap.add_argument('--pair-key', action='store_true',
+			help='Pair clients by a key line they send first instead of accept order')
+	ap.add_argument('--workers', type=int, default=1,
+			help='Number of processes sharing the ports, implies --pair-key')
+	ap.add_argument('--stats-interval', type=int, default=60,
+			help='Seconds between printing the counters of all workers')
+	ap.add_argument('--metrics', metavar='ADDRESS',
+			help='Serve Prometheus metrics on host:port or unix:/path')
 	arguments = ap.parse_args()
+	if arguments.engine == 'asyncio' and (arguments.pair_key or arguments.workers > 1
+			or arguments.metrics) :
+		ap.error('--pair-key, --workers and --metrics need the epoll engine')
+	options = relay.session_options(arguments)
+	if arguments.engine == 'asyncio' and (options or arguments.relay != 'copy') :
+		ap.error('--relay and buffer options need the epoll engine')
 	h1 = arguments.host1[0]	
 	p1 = arguments.port1[0]	
 	h2 = arguments.host2[0]	
 	p2 = arguments.port2[0]	
 
-	ll = LL(h1, p1, h2, p2)
-	ll.run()
+	cls = AsyncLL if arguments.engine == 'asyncio' else LL
+	make_ll = lambda: cls(h1, p1, h2, p2, arguments.relay,
+			arguments.high_water, arguments.low_water, arguments.pair_key,
+			arguments.metrics, options)
+	if arguments.workers > 1 :
+		run_workers(arguments.workers, make_ll, arguments.stats_interval,
+				arguments.metrics)
+	else :
+		make_ll().run()
@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+'''Simulated-BMC benchmark of the concurrency of server-monitor.py.
+
+Every simulated BMC answers one poll. The management network carries
+--capacity polls at --latency seconds, polls beyond that queue up and are
+slower by the load. Beyond --buffer times the capacity the queue
+overflows and polls are lost with a chance growing with the load, a lost
+poll fails after --timeout seconds. From --saturate-at seconds on, for
+--saturate-for seconds, the capacity drops by --saturation, like a
+congested management VLAN. A --dead part of the BMCs is down and refuses
+its poll at once, which is no congestion.
+
+The same hosts are polled with each fixed --fixed number of polls in
+flight and with an AdaptiveLimit, the concurrency chosen by the
+AdaptiveLimit over time is printed after the results.
+
+e.g.
+	./monitor-bench.py
+	./monitor-bench.py --hosts 5000 --capacity 128 --fixed 32 512 --adaptive 1024
+'''
+
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ilo import AdaptiveLimit
+from benchutil import percentile
+
+
+class SimNetwork:
+	'''A management network of simulated BMCs, see the module doc'''
+
+	def __init__(self, capacity, latency, timeout, saturate_at, saturate_for, saturation,
+			buffer = 2, dead = 0):
+		self.capacity = capacity
+		self.buffer = buffer
+		self.latency = latency
+		self.timeout = timeout
+		self.saturate_at = saturate_at
+		self.saturate_for = saturate_for
+		self.saturation = saturation
+		self.dead = dead
+		self.inflight = 0
+		self.begin = time.monotonic()
+		self._lock = threading.Lock()
+
+	def current_capacity(self):
+		t = time.monotonic() - self.begin
+		if self.saturate_at <= t < self.saturate_at + self.saturate_for:
+			return self.capacity / self.saturation
+		return self.capacity
+
+	def poll(self):
+		'''Return the latency of a poll, raise TimeoutError if it is lost
+		and ConnectionRefusedError if its BMC is dead'''
+		if random.random() < self.dead:
+			time.sleep(self.latency / 10)
+			raise ConnectionRefusedError('dead')
+		with self._lock:
+			self.inflight += 1
+			load = self.inflight / self.current_capacity()
+		try:
+			if load > self.buffer and random.random() < min(0.9, (load - self.buffer) / self.buffer):
+				time.sleep(self.timeout)
+				raise TimeoutError('lost')
+			latency = self.latency * max(1, load) * random.uniform(0.9, 1.1)
+			time.sleep(latency)
+			return latency
+		finally:
+			with self._lock:
+				self.inflight -= 1
+
+
+def run(network, hosts, workers = 32, limit = None):
+	'''Poll hosts BMCs, return (seconds, [latency of good polls], failed)'''
+	latencies = []
+	failed = []
+
+	def poll_one():
+		start = limit.acquire() if limit is not None else None
+		ok = None
+		try:
+			latencies.append(network.poll())
+			ok = True
+		except OSError as e:
+			failed.append(1)
+			if AdaptiveLimit.congested(e):
+				ok = False
+		finally:
+			if limit is not None:
+				limit.release(start, ok)
+
+	begin = time.monotonic()
+	network.begin = begin
+	with ThreadPoolExecutor(max_workers=limit.maximum if limit is not None else workers) as pe:
+		for i in range(hosts):
+			pe.submit(poll_one)
+	return time.monotonic() - begin, latencies, len(failed)
+
+
+if __name__ == '__main__':
+	ap = argparse.ArgumentParser(description = 'Benchmark server-monitor concurrency on simulated BMCs')
+	ap.add_argument('--hosts', type=int, default=3000, help='BMCs to poll, default is 3000')
+	ap.add_argument('--capacity', type=int, default=64,
+			help='polls the network carries at full speed, default is 64')
+	ap.add_argument('--latency', type=float, default=0.02,
+			help='seconds of a poll on an idle network, default is 0.02')
+	ap.add_argument('--timeout', type=float, default=0.5,
+			help='seconds until a lost poll fails, default is 0.5')
+	ap.add_argument('--buffer', type=float, default=2,
+			help='times the capacity in flight before polls are lost, default is 2')
+	ap.add_argument('--saturate-at', type=float, default=0.5,
+			help='seconds after the start the network saturates, default is 0.5')
+	ap.add_argument('--saturate-for', type=float, default=1.0,
+			help='seconds the network stays saturated, default is 1')
+	ap.add_argument('--saturation', type=float, default=4,
+			help='capacity is divided by this while saturated, default is 4')
+	ap.add_argument('--dead', type=float, default=0,
+			help='part of the BMCs which are down, default is 0')
+	ap.add_argument('--fixed', type=int, nargs='*', default=[32, 256],
+			help='fixed polls in flight to compare with, default is 32 256')
+	ap.add_argument('--initial', type=int, default=32,
+			help='initial limit of the AdaptiveLimit, default is 32')
+	ap.add_argument('--adaptive', type=int, default=512, metavar='MAX',
+			help='maximum limit of the AdaptiveLimit, default is 512')
+	args = ap.parse_args()
+
+	def network():
+		return SimNetwork(args.capacity, args.latency, args.timeout,
+				args.saturate_at, args.saturate_for, args.saturation, args.buffer, args.dead)
+
+	fmt = '{:<16}{:>10}{:>10}{:>8}{:>12}{:>12}'
+	print(fmt.format('Concurrency', 'Seconds', 'Polls/s', 'Failed', 'p50(ms)', 'p95(ms)'))
+
+	def report(name, result):
+		seconds, latencies, failed = result
+		print(fmt.format(name, '{:.2f}'.format(seconds), '{:.0f}'.format(args.hosts / seconds),
+				failed, '{:.1f}'.format(percentile(latencies, 50) * 1000),
+				'{:.1f}'.format(percentile(latencies, 95) * 1000)))
+
+	for n in args.fixed:
+		report('fixed {}'.format(n), run(network(), args.hosts, workers=n))
+	limit = AdaptiveLimit(args.initial, maximum=args.adaptive)
+	report('adaptive', run(network(), args.hosts, limit=limit))
+
+	print('\nConcurrency of the adaptive run, saturated from {:.2f}s to {:.2f}s'.format(
+			args.saturate_at, args.saturate_at + args.saturate_for))
+	begin = limit.history[0][0]
+	step = 0.1
+	i = 0
+	t = 0
+	end = limit.history[-1][0] - begin
+	while t <= end + step:
+		while i + 1 < len(limit.history) and limit.history[i + 1][0] - begin <= t:
+			i += 1
+		value = limit.history[i][1]
+		print('{:6.1f}s {:>5} {}'.format(t, value, '#' * max(1, value * 60 // args.adaptive)))
+		t += step
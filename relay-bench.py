@@ -0,0 +1,502 @@
+#!/usr/bin/python3
+'''Benchmark ll.py and cc.py on loopback.
+
+The relay under test runs as a subprocess, the benchmark drives it with
+plain sockets and reads the CPU time of the relay from /proc.
+
+e.g.
+	./relay-bench.py throughput --relay copy splice --mbytes 1024
+	./relay-bench.py throughput --relay-args '--edge-triggered --adaptive'
+	./relay-bench.py load --engine epoll asyncio --concurrency 200
+	./relay-bench.py firstbyte --pool-size 0 4
+	./relay-bench.py suite --sizes 64 4096 --output bench.json
+	./relay-bench.py suite --baseline bench.json --tolerance 10
+'''
+
+import os
+import sys
+import time
+import json
+import shlex
+import socket
+import platform
+import asyncio
+import argparse
+import threading
+import subprocess
+from benchutil import percentile
+
+basedir = os.path.dirname(os.path.abspath(sys.argv[0]))
+LOOPBACK = '127.0.0.1'
+BLOCK = 1 << 20
+
+
+def free_port():
+	s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	s.bind((LOOPBACK, 0))
+	port = s.getsockname()[1]
+	s.close()
+	return port
+
+
+def listen(port = 0):
+	s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	s.bind((LOOPBACK, port))
+	s.listen(128)
+	return s
+
+
+def connect(port, retry = 50):
+	'''Connect to a relay that may still be starting up'''
+	for i in range(retry):
+		try:
+			return socket.create_connection((LOOPBACK, port))
+		except ConnectionRefusedError:
+			time.sleep(0.1)
+	raise RuntimeError(f'Cannot connect to port {port}')
+
+
+def wait_pair(p1, p2):
+	'''Wait until ll.py relays, without leaving an unpaired client'''
+	s2 = connect(p2)
+	s1 = connect(p1)
+	s1.sendall(b'x')
+	s2.recv(1)
+	s1.close()
+	s2.close()
+
+
+def cpu_seconds(pid):
+	'''user + system CPU time of a process'''
+	with open(f'/proc/{pid}/stat') as f:
+		fields = f.read().rsplit(')', 1)[1].split()
+	# utime and stime are the 14th and 15th fields of the whole line
+	return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def start_ll(args):
+	p1 = free_port()
+	p2 = free_port()
+	cmd = [sys.executable, os.path.join(basedir, 'll.py'),
+			'--host1', LOOPBACK, '--port1', str(p1),
+			'--host2', LOOPBACK, '--port2', str(p2)] + args
+	return subprocess.Popen(cmd), p1, p2
+
+
+def start_cc(server_port, target_port, args):
+	cmd = [sys.executable, os.path.join(basedir, 'cc.py'),
+			'--server-host', LOOPBACK, '--server-port', str(server_port),
+			'--target-host', LOOPBACK, '--target-port', str(target_port)] + args
+	return subprocess.Popen(cmd)
+
+
+def drain(sock, total, done):
+	'''Read and discard total bytes, then set done'''
+	buf = bytearray(BLOCK)
+	got = 0
+	while got < total:
+		n = sock.recv_into(buf)
+		if n == 0:
+			break
+		got += n
+	done.append(got)
+
+
+def pump(src, dst_accept, total):
+	'''Send total bytes into src, return (seconds, bytes received)'''
+	done = []
+	def _sink():
+		dst = dst_accept()
+		drain(dst, total, done)
+		dst.close()
+	t = threading.Thread(target = _sink)
+	t.start()
+	block = b'x' * BLOCK
+	start = time.perf_counter()
+	sent = 0
+	while sent < total:
+		src.sendall(block)
+		sent += BLOCK
+	t.join()
+	return time.perf_counter() - start, done[0]
+
+
+def throughput_ll(extra, total):
+	proc, p1, p2 = start_ll(extra)
+	try:
+		sink = connect(p2)
+		src = connect(p1)
+		cpu0 = cpu_seconds(proc.pid)
+		secs, got = pump(src, lambda: sink, total)
+		cpu = cpu_seconds(proc.pid) - cpu0
+		src.close()
+	finally:
+		proc.kill()
+		proc.wait()
+	return secs, got, cpu
+
+
+def throughput_cc(extra, total):
+	server = listen()
+	target = listen()
+	proc = start_cc(server.getsockname()[1], target.getsockname()[1], extra)
+	try:
+		src = server.accept()[0]
+		cpu0 = cpu_seconds(proc.pid)
+		secs, got = pump(src, lambda: target.accept()[0], total)
+		cpu = cpu_seconds(proc.pid) - cpu0
+		src.close()
+	finally:
+		proc.kill()
+		proc.wait()
+		server.close()
+		target.close()
+	return secs, got, cpu
+
+
+def cmd_throughput(args):
+	total = args.mbytes * BLOCK
+	run = throughput_ll if args.script == 'll' else throughput_cc
+	fmt = '{:>8}{:>8}{:>12}{:>12}{:>12}'
+	print(fmt.format('Script', 'Relay', 'MB/s', 'CPU(s)', 'CPU(s)/GB'))
+	for engine in args.relay:
+		secs, got, cpu = run(['--relay', engine] + shlex.split(args.relay_args), total)
+		if got < total:
+			print(f'{engine}: short transfer {got}/{total}', file=sys.stderr)
+		print(fmt.format(args.script, engine,
+				'{:.1f}'.format(got / BLOCK / secs),
+				'{:.2f}'.format(cpu),
+				'{:.3f}'.format(cpu / (got / (1 << 30)))))
+
+
+async def echo(reader, writer):
+	try:
+		while True:
+			data = await reader.read(65536)
+			if not data:
+				break
+			writer.write(data)
+			await writer.drain()
+	except ConnectionError:
+		pass
+	finally:
+		writer.close()
+
+
+async def load_ll(p1, p2, concurrency, duration, size):
+	"""Each request is a new client pair: an echo client on port2 and a
+	client on port1 which sends size bytes and waits for them back.
+	LL pairs in accept order, so any echo client serves any request."""
+	loop = asyncio.get_running_loop()
+	payload = b'x' * size
+	stop = loop.time() + duration
+	latencies = []
+	errors = []
+	echoes = []
+
+	async def worker():
+		while loop.time() < stop:
+			start = time.perf_counter()
+			try:
+				r2, w2 = await asyncio.open_connection(LOOPBACK, p2)
+				echoes.append(asyncio.ensure_future(echo(r2, w2)))
+				r1, w1 = await asyncio.open_connection(LOOPBACK, p1)
+				w1.write(payload)
+				await r1.readexactly(size)
+				latencies.append(time.perf_counter() - start)
+				w1.close()
+			except (OSError, asyncio.IncompleteReadError) as e:
+				errors.append(e)
+	await asyncio.gather(*[worker() for i in range(concurrency)])
+	await asyncio.gather(*echoes)
+	return latencies, errors
+
+
+async def load_cc(server, target, concurrency, duration, size):
+	"""Each CC holds one server link, each request on it makes CC
+	connect to the target, which echoes size bytes and closes."""
+	loop = asyncio.get_running_loop()
+	payload = b'x' * size
+	stop = loop.time() + duration
+	latencies = []
+	errors = []
+
+	async def on_target(reader, writer):
+		try:
+			writer.write(await reader.readexactly(size))
+			await writer.drain()
+		except (OSError, asyncio.IncompleteReadError):
+			pass
+		writer.close()
+
+	async def worker(link):
+		reader, writer = await asyncio.open_connection(sock = link)
+		while loop.time() < stop:
+			start = time.perf_counter()
+			try:
+				writer.write(payload)
+				await reader.readexactly(size)
+				latencies.append(time.perf_counter() - start)
+			except (OSError, asyncio.IncompleteReadError) as e:
+				errors.append(e)
+				break
+		writer.close()
+
+	tsrv = await asyncio.start_server(on_target, sock = target)
+	links = []
+	for i in range(concurrency):
+		links.append((await loop.sock_accept(server))[0])
+	await asyncio.gather(*[worker(link) for link in links])
+	tsrv.close()
+	return latencies, errors
+
+
+def run_load(script, engine, args, relay = None):
+	extra = ['--engine', engine]
+	if relay != None:
+		extra += ['--relay', relay] + shlex.split(args.relay_args)
+	if script == 'll':
+		proc, p1, p2 = start_ll(extra)
+		procs = [proc]
+		wait_pair(p1, p2)
+		run = load_ll(p1, p2, args.concurrency, args.duration, args.size)
+	else:
+		server = listen()
+		target = listen()
+		server.setblocking(False)
+		procs = [start_cc(server.getsockname()[1], target.getsockname()[1], extra)
+				for i in range(args.concurrency)]
+		run = load_cc(server, target, args.concurrency, args.duration, args.size)
+	try:
+		cpu0 = sum([cpu_seconds(p.pid) for p in procs])
+		start = time.perf_counter()
+		latencies, errors = asyncio.run(run)
+		secs = time.perf_counter() - start
+		cpu = sum([cpu_seconds(p.pid) for p in procs]) - cpu0
+	finally:
+		for p in procs:
+			p.kill()
+			p.wait()
+	return latencies, errors, secs, cpu
+
+
+def cmd_load(args):
+	fmt = '{:>8}{:>9}{:>10}{:>10}{:>10}{:>8}{:>8}'
+	print(fmt.format('Script', 'Engine', 'Conn/s', 'p50(ms)', 'p99(ms)',
+			'CPU(s)', 'Errors'))
+	for engine in args.engine:
+		latencies, errors, secs, cpu = run_load(args.script, engine, args)
+		print(fmt.format(args.script, engine,
+				'{:.0f}'.format(len(latencies) / secs),
+				'{:.2f}'.format(percentile(latencies, 50) * 1000),
+				'{:.2f}'.format(percentile(latencies, 99) * 1000),
+				'{:.2f}'.format(cpu), len(errors)))
+		if errors:
+			print(f'{engine}: first error: {errors[0]!r}', file=sys.stderr)
+
+
+async def first_byte(server, target, requests, size, gap):
+	"""Send requests one by one over the server link of cc.py, return the
+	seconds until each reaches the target and until its echo is back."""
+	loop = asyncio.get_running_loop()
+	arrivals = {}
+
+	async def on_target(reader, writer):
+		try:
+			data = await reader.readexactly(size)
+			arrivals[data[:8]] = time.perf_counter()
+			writer.write(data)
+			await writer.drain()
+		except (OSError, asyncio.IncompleteReadError, asyncio.CancelledError):
+			# pooled connections are still idle at the end
+			pass
+		writer.close()
+
+	tsrv = await asyncio.start_server(on_target, sock = target)
+	link = (await loop.sock_accept(server))[0]
+	reader, writer = await asyncio.open_connection(sock = link)
+	first = []
+	rtt = []
+	for i in range(requests):
+		# give the pool time to connect again, like sessions spread in time
+		await asyncio.sleep(gap)
+		req = b'%08d' % i + b'x' * (size - 8)
+		start = time.perf_counter()
+		writer.write(req)
+		await reader.readexactly(size)
+		rtt.append(time.perf_counter() - start)
+		first.append(arrivals[req[:8]] - start)
+	writer.close()
+	tsrv.close()
+	return first, rtt
+
+
+def cmd_firstbyte(args):
+	fmt = '{:>10}{:>9}{:>14}{:>14}{:>12}{:>12}'
+	print(fmt.format('Pool-size', 'Engine', 'First-p50(us)', 'First-p99(us)',
+			'RTT-p50(us)', 'RTT-p99(us)'))
+	for engine in args.engine:
+		for pool in args.pool_size:
+			server = listen()
+			target = listen()
+			server.setblocking(False)
+			proc = start_cc(server.getsockname()[1], target.getsockname()[1],
+					['--engine', engine, '--pool-size', str(pool)])
+			try:
+				first, rtt = asyncio.run(first_byte(server, target,
+						args.requests, args.size, args.gap / 1000))
+			finally:
+				proc.kill()
+				proc.wait()
+				server.close()
+				target.close()
+			print(fmt.format(pool, engine,
+					*['{:.0f}'.format(percentile(v, p) * 1e6)
+						for v in (first, rtt) for p in (50, 99)]))
+
+
+def suite_runs(args):
+	"""(script, engine, relay) to run, the relay only matters for epoll"""
+	for script in args.script:
+		for engine in args.engine:
+			for relay in (args.relay if engine == 'epoll' else [None]):
+				yield script, engine, relay
+
+
+def run_suite(args):
+	results = []
+	for script, engine, relay in suite_runs(args):
+		name = '/'.join(filter(None, [script, engine, relay]))
+		print(f'{name}: throughput', file=sys.stderr)
+		extra = ['--engine', engine] + (['--relay', relay] if relay else [])
+		if engine == 'epoll':
+			extra += shlex.split(args.relay_args)
+		run = throughput_ll if script == 'll' else throughput_cc
+		secs, got, cpu = run(extra, args.mbytes * BLOCK)
+		results.append({'script': script, 'engine': engine, 'relay': relay,
+				'test': 'throughput', 'bytes': got, 'seconds': secs,
+				'mbytes_per_second': got / BLOCK / secs, 'cpu_seconds': cpu,
+				'cpu_seconds_per_gb': cpu / (got / (1 << 30)) if got else None})
+		for size in args.sizes:
+			print(f'{name}: latency, {size} bytes', file=sys.stderr)
+			args.size = size
+			latencies, errors, secs, cpu = run_load(script, engine, args, relay)
+			results.append({'script': script, 'engine': engine, 'relay': relay,
+					'test': 'latency', 'size': size, 'sessions': args.concurrency,
+					'requests': len(latencies), 'seconds': secs,
+					'requests_per_second': len(latencies) / secs,
+					'mbytes_per_second': 2 * size * len(latencies) / BLOCK / secs,
+					'p50_ms': percentile(latencies, 50) * 1000,
+					'p99_ms': percentile(latencies, 99) * 1000,
+					'cpu_seconds': cpu, 'errors': len(errors)})
+	return results
+
+
+def result_key(r):
+	return (r['script'], r['engine'], r['relay'], r['test'], r.get('size'))
+
+
+def regressions(baseline, results, tolerance):
+	"""Compare results with a baseline, return a list of regressions.
+
+	Throughput may not drop and p99 latency may not rise by more than
+	tolerance percent."""
+	old = {result_key(r): r for r in baseline['results']}
+	found = []
+	for r in results:
+		b = old.get(result_key(r))
+		if b == None:
+			continue
+		name = '/'.join(str(k) for k in result_key(r) if k != None)
+		if r['mbytes_per_second'] < b['mbytes_per_second'] * (1 - tolerance / 100):
+			found.append('{}: {:.1f} MB/s, was {:.1f}'.format(name,
+					r['mbytes_per_second'], b['mbytes_per_second']))
+		if r['test'] == 'latency' and r['p99_ms'] > b['p99_ms'] * (1 + tolerance / 100):
+			found.append('{}: p99 {:.2f} ms, was {:.2f}'.format(name,
+					r['p99_ms'], b['p99_ms']))
+	return found
+
+
+def cmd_suite(args):
+	started = time.time()
+	results = run_suite(args)
+	report = {'started': started, 'python': platform.python_version(),
+			'platform': platform.platform(), 'cpus': os.cpu_count(),
+			'mbytes': args.mbytes, 'duration': args.duration,
+			'relay_args': args.relay_args,
+			'results': results}
+	text = json.dumps(report, indent = '\t')
+	if args.output:
+		with open(args.output, 'w') as f:
+			f.write(text + '\n')
+	else:
+		print(text)
+	if args.baseline:
+		with open(args.baseline) as f:
+			found = regressions(json.load(f), results, args.tolerance)
+		for line in found:
+			print(f'regression: {line}', file=sys.stderr)
+		if found:
+			sys.exit(1)
+
+
+if __name__ == '__main__':
+	ap = argparse.ArgumentParser(description='Benchmark ll.py and cc.py on loopback')
+	sp = ap.add_subparsers(dest='command', required=True)
+	p = sp.add_parser('throughput', help='bulk transfer rate and CPU per GB')
+	p.add_argument('--script', choices=['ll', 'cc'], default='ll')
+	p.add_argument('--relay', nargs='+', default=['copy', 'splice'],
+			help='relay engines to compare')
+	p.add_argument('--mbytes', type=int, default=1024,
+			help='MB to transfer per engine, default is 1024')
+	p.add_argument('--relay-args', default='',
+			help='more options of ll.py/cc.py, e.g. "--bufsize 65536"')
+	p.set_defaults(func=cmd_throughput)
+	p = sp.add_parser('load', help='connections per second and latency')
+	p.add_argument('--script', choices=['ll', 'cc'], default='ll')
+	p.add_argument('--engine', nargs='+', default=['epoll', 'asyncio'],
+			help='event loops to compare')
+	p.add_argument('--concurrency', type=int, default=100,
+			help='concurrent sessions, one cc.py each for cc, default is 100')
+	p.add_argument('--duration', type=float, default=10,
+			help='seconds per engine, default is 10')
+	p.add_argument('--size', type=int, default=64,
+			help='request size in bytes, default is 64')
+	p.set_defaults(func=cmd_load)
+	p = sp.add_parser('firstbyte', help='cc.py first-byte latency with and without a target pool')
+	p.add_argument('--engine', nargs='+', default=['epoll'],
+			help='event loops to compare')
+	p.add_argument('--pool-size', nargs='+', type=int, default=[0, 4],
+			help='cc.py --pool-size values to compare')
+	p.add_argument('--requests', type=int, default=500,
+			help='sessions per pool size, default is 500')
+	p.add_argument('--size', type=int, default=64,
+			help='request size in bytes, at least 8, default is 64')
+	p.add_argument('--gap', type=float, default=5,
+			help='milliseconds between sessions, default is 5')
+	p.set_defaults(func=cmd_firstbyte)
+	p = sp.add_parser('suite', help='throughput and latency of every engine as JSON')
+	p.add_argument('--script', nargs='+', choices=['ll', 'cc'], default=['ll', 'cc'])
+	p.add_argument('--engine', nargs='+', default=['epoll', 'asyncio'],
+			help='event loops to compare')
+	p.add_argument('--relay', nargs='+', default=['copy', 'splice'],
+			help='relay engines to compare with the epoll loop')
+	p.add_argument('--mbytes', type=int, default=256,
+			help='MB to transfer per engine, default is 256')
+	p.add_argument('--relay-args', default='',
+			help='more options of ll.py/cc.py with epoll, e.g. "--edge-triggered"')
+	p.add_argument('--sizes', nargs='+', type=int, default=[64, 16384],
+			help='request sizes in bytes for latency, default is 64 16384')
+	p.add_argument('--concurrency', type=int, default=20,
+			help='concurrent sessions, one cc.py each for cc, default is 20')
+	p.add_argument('--duration', type=float, default=3,
+			help='seconds per latency run, default is 3')
+	p.add_argument('--output', help='write the JSON report to a file')
+	p.add_argument('--baseline', help='JSON report to compare with, '
+			'exit 1 on a regression')
+	p.add_argument('--tolerance', type=float, default=10,
+			help='allowed regression in percent, default is 10')
+	p.set_defaults(func=cmd_suite)
+	args = ap.parse_args()
+	args.func(args)
@@ -0,0 +1,770 @@
+'''Relay engines shared by ll.py and cc.py.
+
+A Session relays data between two connected sockets, a Channel is one
+direction of it. Sockets are non-blocking. Bytes which the destination
+can not take right now stay in the buffer of the channel and the session
+waits for EPOLLOUT on the destination. When the buffer reaches the high
+watermark the session stops reading the source (no EPOLLIN) until the
+buffer drains below the low watermark, so a slow consumer only throttles
+its own producer and memory per session stays bounded.
+
+An engine holds the buffer of one channel and moves the bytes.
+The size of a single receive is bufsize. With adaptive sizing a channel
+doubles it while receives fill it (bulk flows) and halves it after a run
+of small receives (interactive flows), between MIN_BUFSIZE and
+MAX_BUFSIZE.
+"copy" receives into a reused bytearray with recv_into() and sends from a
+memoryview of it, unsent bytes are kept in a bytearray.
+"splice" moves the bytes kernel-side through a pipe with os.splice(), the
+payload is never copied into user space and the pipe is the buffer. It
+falls back to "copy" when os.splice() is not available (non-Linux or
+python < 3.10). The pipe may get less than asked for, e.g. past
+pipe-user-pages-soft or pipe-max-size, the high watermark of the channel
+is clamped to the size it got. A full pipe raises PipeFull, the channel
+stops reading until the pipe drains.
+
+By default a readable socket gets one receive per epoll event. With
+edge_triggered the session registers its sockets with EPOLLET and drains
+a socket until EAGAIN, at most DRAIN_LIMIT bytes per event so one bulk
+flow can not starve the others; a socket left readable is re-armed with
+epoll.modify() and is reported again by the next poll. So is a socket
+which was left readable because the pipe of a splice engine was full,
+once the pipe drains.
+
+RelayStats counts what an epoll relay loop does and Metrics serves the
+counters in the Prometheus text format, see MetricsServer.
+
+RelayProtocol is the same relay on asyncio transports, it runs on uvloop
+as well, see new_event_loop().
+
+e.g.
+	s = Session(sock1, sock2, 'splice')
+	s.register(epoll)
+	...
+	# for each (fd, event) of s returned by epoll.poll()
+	if not s.handle(fd, event) :
+		s.close()
+'''
+
+import os
+import fcntl
+import asyncio
+import select
+import time
+import socket
+import logging
+import itertools
+import threading
+import http.server
+import socketserver
+
+ENGINES = ('copy', 'splice')
+COPY_BUFSIZE = 8192
+SPLICE_BUFSIZE = 65536
+HIGH_WATER = 262144
+LOW_WATER = 65536
+MIN_BUFSIZE = 4096
+MAX_BUFSIZE = 1048576
+DRAIN_LIMIT = 1048576
+# small receives in a row before an adaptive buffer shrinks
+SHRINK_AFTER = 8
+
+
+def splice_available():
+	return hasattr(os, 'splice')
+
+
+def set_buffers(sock, rcvbuf = 0, sndbuf = 0) :
+	'''Set SO_RCVBUF and SO_SNDBUF of sock, 0 keeps the kernel default.
+
+	Set them on a listening socket before accept() as well, the receive
+	window scale of a connection is chosen by its handshake.
+	'''
+	if rcvbuf > 0 :
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+	if sndbuf > 0 :
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+
+
+class PipeFull(Exception):
+	'''The buffer of an engine can not take more until it is flushed'''
+
+
+class CopyEngine:
+	name = 'copy'
+
+	def __init__(self, bufsize = COPY_BUFSIZE, capacity = HIGH_WATER) :
+		self.bufsize = bufsize
+		# most bytes the buffer can hold
+		self.capacity = capacity
+		self.buf = bytearray(bufsize)
+		self.view = memoryview(self.buf)
+		self.queue = bytearray()
+		self.pending = 0
+		# counters, see RelayStats
+		self.bytes = 0
+		self.recvs = 0
+		self.sends = 0
+
+
+	def relay(self, s1, s2, limit) :
+		'''Receive at most limit bytes from s1 and send them to s2.
+
+		Return the bytes received, 0 means s1 is closed. Raise
+		BlockingIOError if s1 has nothing to read, PipeFull if the buffer
+		can not take any.
+		'''
+		self.recvs += 1
+		n = s1.recv_into(self.buf, min(limit, self.bufsize))
+		if n == 0 :
+			return 0
+		self.bytes += n
+		sent = 0
+		if self.pending == 0 :
+			self.sends += 1
+			try :
+				sent = s2.send(self.view[:n])
+			except BlockingIOError :
+				pass
+		if sent < n :
+			self.queue += self.view[sent:n]
+			self.pending = len(self.queue)
+			self.flush(s2)
+		return n
+
+
+	def resize(self, bufsize) :
+		self.view.release()
+		self.bufsize = bufsize
+		self.buf = bytearray(bufsize)
+		self.view = memoryview(self.buf)
+
+
+	def flush(self, s2) :
+		'''Send buffered bytes to s2 until it would block'''
+		while self.pending > 0 :
+			self.sends += 1
+			try :
+				n = s2.send(self.queue)
+			except BlockingIOError :
+				break
+			del self.queue[:n]
+			self.pending = len(self.queue)
+
+
+	def close(self) :
+		self.view.release()
+
+
+class SpliceEngine:
+	name = 'splice'
+	flags = 0
+
+	def __init__(self, bufsize = SPLICE_BUFSIZE, capacity = HIGH_WATER) :
+		self.bufsize = bufsize
+		self.pending = 0
+		self.bytes = 0
+		self.recvs = 0
+		self.sends = 0
+		self.pipe_r, self.pipe_w = os.pipe()
+		os.set_blocking(self.pipe_r, False)
+		os.set_blocking(self.pipe_w, False)
+		# the pipe must be able to hold a full buffer, read back what it got
+		try :
+			fcntl.fcntl(self.pipe_w, fcntl.F_SETPIPE_SZ, capacity)
+		except (AttributeError, OSError) as e :
+			logging.debug('Cannot resize pipe: {0}'.format(e))
+		try :
+			self.capacity = fcntl.fcntl(self.pipe_w, fcntl.F_GETPIPE_SZ)
+		except (AttributeError, OSError) :
+			self.capacity = SPLICE_BUFSIZE
+		self.capacity = min(self.capacity, capacity)
+		self.full = select.poll()
+		self.full.register(self.pipe_w, select.POLLOUT)
+		if SpliceEngine.flags == 0 :
+			SpliceEngine.flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+
+
+	def relay(self, s1, s2, limit) :
+		'''See CopyEngine.relay()'''
+		limit = min(limit, self.bufsize, self.capacity - self.pending)
+		if limit <= 0 :
+			raise PipeFull()
+		self.recvs += 1
+		try :
+			n = os.splice(s1.fileno(), self.pipe_w, limit, flags = self.flags)
+		except BlockingIOError :
+			# small segments can take all the slots of the pipe before its
+			# size in bytes, it is not writable then
+			if self.pending > 0 and not self.full.poll(0) :
+				raise PipeFull()
+			raise
+		if n > 0 :
+			self.bytes += n
+			self.pending += n
+			self.flush(s2)
+		return n
+
+
+	def resize(self, bufsize) :
+		self.bufsize = bufsize
+
+
+	def flush(self, s2) :
+		while self.pending > 0 :
+			self.sends += 1
+			try :
+				n = os.splice(self.pipe_r, s2.fileno(), self.pending,
+						flags = self.flags)
+			except BlockingIOError :
+				break
+			self.pending -= n
+
+
+	def close(self) :
+		if self.pipe_r >= 0 :
+			os.close(self.pipe_r)
+			os.close(self.pipe_w)
+			self.pipe_r = self.pipe_w = -1
+
+
+def make_engine(name, bufsize = None, capacity = HIGH_WATER) :
+	'''Create an engine by name, see ENGINES.
+
+	capacity is the most bytes the engine has to buffer.
+	'''
+	if name == 'splice' :
+		if splice_available() :
+			return SpliceEngine(bufsize or SPLICE_BUFSIZE, capacity)
+		logging.warning('os.splice() is not available, fall back to copy')
+	elif name != 'copy' :
+		raise ValueError('Unknown relay engine: {0}'.format(name))
+	return CopyEngine(bufsize or COPY_BUFSIZE, capacity)
+
+
+class Channel:
+	'''One direction of a session, from src to dst.
+
+	When src is closed and the buffer is sent, the channel is finished.
+	If shutdown is True, a finished channel shuts down the writing side
+	of dst, so the peer of dst sees the end of data too.
+	drain: receive until src would block, see DRAIN_LIMIT
+	adaptive: resize the engine buffer to the flow, see MIN_BUFSIZE
+	'''
+
+	def __init__(self, src, dst, engine, high_water, low_water, shutdown = True,
+			drain = False, adaptive = False) :
+		self.src = src
+		self.dst = dst
+		self.engine = engine
+		# the engine may hold less, e.g. a pipe smaller than asked for
+		self.high_water = min(high_water, engine.capacity)
+		self.low_water = min(low_water, self.high_water // 2)
+		self.shutdown = shutdown
+		self.drain = drain
+		self.adaptive = adaptive
+		self.max_bufsize = min(MAX_BUFSIZE, self.high_water)
+		self.small = 0
+		self.reading = True
+		# the engine raised PipeFull, do not read until it flushes some
+		self.full = False
+		self.eof = False
+		self.finished = False
+		# src may still be readable, see Session.handle()
+		self.rearm = False
+
+
+	def on_readable(self) :
+		got = 0
+		while True :
+			try :
+				n = self.engine.relay(self.src, self.dst,
+						self.high_water - self.engine.pending)
+			except BlockingIOError :
+				return
+			except PipeFull :
+				# src is still readable, see on_writable()
+				self.full = True
+				self.reading = False
+				return
+			if self.adaptive :
+				self.__adapt(n)
+			if n == 0 :
+				self.eof = True
+				self.reading = False
+			self.__check()
+			if not (self.drain and self.reading) :
+				return
+			got += n
+			if got >= DRAIN_LIMIT :
+				self.rearm = True
+				return
+
+
+	def __adapt(self, n) :
+		bufsize = self.engine.bufsize
+		if n >= bufsize :
+			self.small = 0
+			if bufsize < self.max_bufsize :
+				self.engine.resize(min(bufsize * 2, self.max_bufsize))
+		elif n < bufsize // 8 :
+			self.small += 1
+			if self.small >= SHRINK_AFTER and bufsize > MIN_BUFSIZE :
+				self.small = 0
+				self.engine.resize(max(bufsize // 2, MIN_BUFSIZE))
+		else :
+			self.small = 0
+
+
+	def on_writable(self) :
+		pending = self.engine.pending
+		self.engine.flush(self.dst)
+		if self.full and self.engine.pending < pending :
+			# src was left readable, its edge is gone
+			self.full = False
+			self.rearm = self.drain
+		self.__check()
+
+
+	def __check(self) :
+		pending = self.engine.pending
+		if self.eof :
+			if pending == 0 and not self.finished :
+				self.finished = True
+				if self.shutdown :
+					self.dst.shutdown(socket.SHUT_WR)
+		elif pending >= self.high_water or self.full :
+			self.reading = False
+		elif pending <= self.low_water :
+			self.reading = True
+
+
+class Session:
+	'''A pair of connected sockets and the channels between them.
+
+	shutdown12/shutdown21: see Channel. When a channel without shutdown
+	finishes, the whole session is done.
+	bufsize: bytes per receive, None is the default of the engine
+	adaptive: resize bufsize to the flow
+	edge_triggered: register with EPOLLET and drain sockets until EAGAIN
+	rcvbuf/sndbuf: SO_RCVBUF/SO_SNDBUF of both sockets, see set_buffers()
+	'''
+
+	_ids = itertools.count(1)
+
+	def __init__(self, s1, s2, engine = 'copy',
+			high_water = HIGH_WATER, low_water = LOW_WATER,
+			shutdown12 = True, shutdown21 = True,
+			bufsize = None, adaptive = False, edge_triggered = False,
+			rcvbuf = 0, sndbuf = 0) :
+		if low_water >= high_water :
+			raise ValueError('low watermark must be less than high watermark')
+		self.id = next(Session._ids)
+		self.started = time.monotonic()
+		self.s1 = s1
+		self.s2 = s2
+		self.fd1 = s1.fileno()
+		self.fd2 = s2.fileno()
+		s1.setblocking(False)
+		s2.setblocking(False)
+		for s in (s1, s2) :
+			set_buffers(s, rcvbuf, sndbuf)
+		self.edge_triggered = edge_triggered
+		self.c12 = Channel(s1, s2, make_engine(engine, bufsize, high_water),
+				high_water, low_water, shutdown12, edge_triggered, adaptive)
+		self.c21 = Channel(s2, s1, make_engine(engine, bufsize, high_water),
+				high_water, low_water, shutdown21, edge_triggered, adaptive)
+		# fd -> (channel reading it, channel writing it)
+		self.channels = {
+			self.fd1: (self.c12, self.c21),
+			self.fd2: (self.c21, self.c12),
+		}
+		# fd -> registered epoll mask, None once the fd is unregistered
+		self.masks = {self.fd1: 0, self.fd2: 0}
+		self.epoll = None
+		self.failed = False
+
+
+	def register(self, epoll) :
+		self.epoll = epoll
+		for fd in self.masks :
+			self.masks[fd] = self.__mask(fd)
+			epoll.register(fd, self.masks[fd])
+
+
+	def __mask(self, fd) :
+		cin, cout = self.channels[fd]
+		if cin.eof and cout.finished :
+			# nothing more to do with fd, stop level-triggered EPOLLHUP
+			return None
+		mask = select.EPOLLET if self.edge_triggered else 0
+		if cin.reading :
+			mask |= select.EPOLLIN
+		if cout.engine.pending > 0 :
+			mask |= select.EPOLLOUT
+		return mask
+
+
+	def handle(self, fd, event) :
+		'''Handle the epoll event of fd, return False if the session is done'''
+		cin, cout = self.channels[fd]
+		try :
+			if event & select.EPOLLERR :
+				raise ConnectionError('socket {0} error'.format(fd))
+			if event & select.EPOLLOUT :
+				cout.on_writable()
+			if event & (select.EPOLLIN | select.EPOLLHUP) :
+				if cin.reading :
+					cin.on_readable()
+				elif event & select.EPOLLHUP and not cin.eof :
+					raise ConnectionError('socket {0} hang up'.format(fd))
+		except OSError as e :
+			logging.error(e)
+			self.failed = True
+			return False
+		if self.done() :
+			return False
+		# the peer fd is affected too, its buffer may have changed
+		for fd, mask in self.masks.items() :
+			if mask == None :
+				continue
+			m = self.__mask(fd)
+			cin = self.channels[fd][0]
+			if m == None :
+				self.epoll.unregister(fd)
+			elif m != mask or cin.rearm :
+				# modify() re-arms EPOLLET, a readable fd is reported again
+				cin.rearm = False
+				self.epoll.modify(fd, m)
+			self.masks[fd] = m
+		return True
+
+
+	def done(self) :
+		if self.c12.finished and self.c21.finished :
+			return True
+		for c in (self.c12, self.c21) :
+			if c.finished and not c.shutdown :
+				return True
+		return False
+
+
+	def close(self, keep = None) :
+		'''Unregister and close both sockets except keep'''
+		for s, fd in ((self.s1, self.fd1), (self.s2, self.fd2)) :
+			if self.epoll != None and self.masks[fd] != None :
+				try :
+					self.epoll.unregister(fd)
+				except OSError :
+					pass
+			if s is not keep :
+				s.close()
+		self.c12.engine.close()
+		self.c21.engine.close()
+
+
+def add_arguments(ap) :
+	'''Add the buffer options of Session to an ArgumentParser'''
+	ap.add_argument('--bufsize', type=int,
+			help='Bytes per receive, default is {0} for copy and {1} for splice'.format(
+				COPY_BUFSIZE, SPLICE_BUFSIZE))
+	ap.add_argument('--adaptive', action='store_true',
+			help='Grow the receive size for bulk flows, shrink it for interactive ones')
+	ap.add_argument('--edge-triggered', action='store_true',
+			help='Use EPOLLET and read each socket until it would block')
+	ap.add_argument('--rcvbuf', type=int, default=0,
+			help='SO_RCVBUF of client sockets, default is the kernel default')
+	ap.add_argument('--sndbuf', type=int, default=0,
+			help='SO_SNDBUF of client sockets, default is the kernel default')
+
+
+def session_options(arguments) :
+	'''Keyword arguments of Session from the options of add_arguments(),
+	only those which are not the default'''
+	options = {}
+	if arguments.bufsize != None :
+		options['bufsize'] = arguments.bufsize
+	for name in ('adaptive', 'edge_triggered', 'rcvbuf', 'sndbuf') :
+		if getattr(arguments, name) :
+			options[name] = getattr(arguments, name)
+	return options
+
+
+class RelayStats:
+	'''Counters of an epoll relay loop.
+
+	The loop only bumps plain ints, in the engines and in wakeups, the
+	metric families are built from them when they are scraped.
+	'''
+	# labels of Session.c12 and Session.c21
+	DIRECTIONS = ('up', 'down')
+
+	def __init__(self) :
+		self.wakeups = 0
+		# Session.id -> live Session
+		self.sessions = {}
+		self.closed = 0
+		# [bytes, recv calls, send calls] of closed sessions per direction
+		self.closed_counts = ([0, 0, 0], [0, 0, 0])
+		self.last_scrape = (time.monotonic(), 0)
+
+
+	def opened(self, session) :
+		self.sessions[session.id] = session
+
+
+	def closing(self, session) :
+		self.sessions.pop(session.id, None)
+		self.closed += 1
+		for counts, c in zip(self.closed_counts, (session.c12, session.c21)) :
+			counts[0] += c.engine.bytes
+			counts[1] += c.engine.recvs
+			counts[2] += c.engine.sends
+
+
+	def collect(self) :
+		'''Return the metric families, see Metrics'''
+		now = time.monotonic()
+		wakeups = self.wakeups
+		since, last = self.last_scrape
+		self.last_scrape = (now, wakeups)
+		# a copy, the relay loop keeps changing the dict
+		sessions = list(self.sessions.values())
+		totals = [list(c) for c in self.closed_counts]
+		per_session = ([], [], [], [])
+		age = []
+		buffered = 0
+		for s in sessions :
+			sid = str(s.id)
+			age.append(({'session': sid}, now - s.started))
+			for d, c, total in zip(RelayStats.DIRECTIONS, (s.c12, s.c21), totals) :
+				e = c.engine
+				labels = {'session': sid, 'direction': d}
+				for values, v in zip(per_session, (e.bytes, e.recvs, e.sends, e.pending)) :
+					values.append((labels, v))
+				total[0] += e.bytes
+				total[1] += e.recvs
+				total[2] += e.sends
+				buffered += e.pending
+		direction = lambda i: [({'direction': d}, t[i])
+				for d, t in zip(RelayStats.DIRECTIONS, totals)]
+		return [
+			('relay_epoll_wakeups_total', 'counter', 'epoll.poll() returns', [(None, wakeups)]),
+			('relay_epoll_wakeups_per_second', 'gauge', 'epoll.poll() returns per second since the last scrape',
+				[(None, (wakeups - last) / max(now - since, 1e-9))]),
+			('relay_sessions', 'gauge', 'live sessions', [(None, len(sessions))]),
+			('relay_sessions_closed_total', 'counter', 'closed sessions', [(None, self.closed)]),
+			('relay_bytes_total', 'counter', 'bytes received', direction(0)),
+			('relay_recv_calls_total', 'counter', 'receive calls', direction(1)),
+			('relay_send_calls_total', 'counter', 'send calls', direction(2)),
+			('relay_buffered_bytes', 'gauge', 'bytes waiting for a slow peer', [(None, buffered)]),
+			('relay_session_bytes_total', 'counter', 'bytes received by a session', per_session[0]),
+			('relay_session_recv_calls_total', 'counter', 'receive calls of a session', per_session[1]),
+			('relay_session_send_calls_total', 'counter', 'send calls of a session', per_session[2]),
+			('relay_session_buffered_bytes', 'gauge', 'bytes waiting for a slow peer', per_session[3]),
+			('relay_session_age_seconds', 'gauge', 'seconds since the session started', age),
+		]
+
+
+class Metrics:
+	'''Metric families in the Prometheus text format.
+
+	A collector is a function returning a list of families:
+		(name, type, help, [(labels or None, value), ...])
+	'''
+
+	def __init__(self) :
+		self.collectors = []
+
+
+	def add(self, collector) :
+		self.collectors.append(collector)
+
+
+	def render(self) :
+		lines = []
+		for collector in self.collectors :
+			for name, kind, text, samples in collector() :
+				lines.append('# HELP {0} {1}'.format(name, text))
+				lines.append('# TYPE {0} {1}'.format(name, kind))
+				for labels, value in samples :
+					if labels :
+						name_labels = '{0}{{{1}}}'.format(name, ','.join(
+								['{0}="{1}"'.format(k, v) for k, v in labels.items()]))
+					else :
+						name_labels = name
+					lines.append('{0} {1}'.format(name_labels, value))
+		return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+	def do_GET(self) :
+		try :
+			body = self.server.metrics.render().encode()
+		except Exception as e :
+			logging.error(e)
+			self.send_error(500)
+			return
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/plain; version=0.0.4')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+
+	def address_string(self) :
+		# client_address of a unix socket is not a tuple
+		return str(self.client_address)
+
+
+	def log_message(self, format, *args) :
+		logging.debug(format % args)
+
+
+class _UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+	daemon_threads = True
+
+
+class MetricsServer:
+	'''Serve Metrics over HTTP in a daemon thread.
+
+	address: "host:port" or "unix:/path/to/socket"
+	'''
+
+	def __init__(self, metrics, address) :
+		if address.startswith('unix:') :
+			path = address[5:]
+			if os.path.exists(path) :
+				os.unlink(path)
+			self.httpd = _UnixHTTPServer(path, _MetricsHandler)
+		else :
+			host, port = address.rsplit(':', 1)
+			self.httpd = http.server.ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+			self.httpd.daemon_threads = True
+		self.httpd.metrics = metrics
+		self.thread = threading.Thread(target = self.httpd.serve_forever, daemon = True)
+
+
+	def start(self) :
+		logging.info('serve metrics on {0}'.format(self.httpd.server_address))
+		self.thread.start()
+		return self
+
+
+	def stop(self) :
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+
+def new_event_loop() :
+	'''An uvloop event loop if uvloop is installed, else the asyncio one'''
+	try :
+		import uvloop
+	except ImportError :
+		return asyncio.new_event_loop()
+	return uvloop.new_event_loop()
+
+
+class RelayProtocol(asyncio.Protocol):
+	'''One socket of an asyncio session.
+
+	Data received is written to the transport of the peer. Data received
+	before pair() is called is kept and reading is paused. When the write
+	buffer of a transport is above high_water, the peer stops reading
+	until it drains to low_water. If shutdown is True, EOF from this
+	socket is passed on to the peer as a half-close, else the transport
+	is closed. Subclasses override waiting() and lost().
+	'''
+
+	def __init__(self, high_water = HIGH_WATER, low_water = LOW_WATER, shutdown = True) :
+		self.high_water = high_water
+		self.low_water = low_water
+		self.shutdown = shutdown
+		self.transport = None
+		self.peer = None
+		self.early = []
+		self.eof = False
+
+
+	def connection_made(self, transport) :
+		self.transport = transport
+		transport.set_write_buffer_limits(self.high_water, self.low_water)
+
+
+	def pair(self, peer) :
+		self.peer = peer
+		if self.early :
+			peer.transport.writelines(self.early)
+			self.early = []
+		if self.eof :
+			self.eof_received()
+		else :
+			self.transport.resume_reading()
+
+
+	def unpair(self) :
+		self.peer = None
+
+
+	def data_received(self, data) :
+		if self.peer != None :
+			self.peer.transport.write(data)
+			return
+		self.early.append(data)
+		self.transport.pause_reading()
+		self.waiting()
+
+
+	def eof_received(self) :
+		self.eof = True
+		if self.peer == None :
+			return True
+		if not self.shutdown :
+			# detach first, the peer must not write to a closing transport
+			self.__detach()
+			self.transport.close()
+		elif self.peer.eof :
+			self.transport.close()
+			self.peer.transport.close()
+		elif self.peer.transport.can_write_eof() :
+			self.peer.transport.write_eof()
+		# keep the transport open for the data from the peer
+		return True
+
+
+	def pause_writing(self) :
+		if self.peer != None :
+			self.peer.transport.pause_reading()
+
+
+	def resume_writing(self) :
+		if self.peer != None :
+			self.peer.transport.resume_reading()
+
+
+	def connection_lost(self, exc) :
+		if exc != None :
+			logging.error(exc)
+		self.__detach()
+		self.lost()
+
+
+	def __detach(self) :
+		peer = self.peer
+		self.peer = None
+		if peer != None :
+			peer.unpair()
+			peer.peer_lost(self)
+
+
+	def peer_lost(self, peer) :
+		'''Called when the transport of peer is closed'''
+		self.transport.close()
+
+
+	def waiting(self) :
+		'''Called when data arrives before pair()'''
+
+
+	def lost(self) :
+		'''Called when the transport is closed'''
@@ -4,51 +4,335 @@
 The program reads settings in 'servers.cfg' under current directory and
 fetch server rollup status via iLO restful API.
 
+Each server has --timeout seconds from the start of its poll, a server
+which takes longer is reported as timed out without holding up the
+others. By default the table is printed sorted when all servers are
+done, --stream prints each row as soon as its server is done and --ndjson
+prints each row as a line of JSON instead. The servers which failed or
+timed out are listed on stderr at the end.
+
+--workers polls are in flight at a time, with --adaptive MAX that number
+follows the iLO latency and errors between 1 and MAX: it grows while
+polls are fast and shrinks when they slow down, time out or get 5xx
+answers, e.g. on a congested management network. The changes are logged on stderr,
+monitor-bench.py shows how it behaves on a saturated network.
+
 Format of servers.cfg
 [iLO]
 username=
 password=
+# optional, keep iLO sessions in this file between runs
+session_store=sessions.db
 
 [servers]
 ip1
 ip2
+# seconds between polls in daemon mode, default is --interval
+ip3 = 30
 ...
+
+With --daemon it keeps running: each server is polled on its own
+interval, the first polls are spread over the interval and each next poll
+is moved by up to 10% so they do not bunch up. iLO sessions stay logged
+in between polls. The latest status of all servers is served over HTTP
+on --listen, a host:port or unix:/path:
+	GET /        the table as text
+	GET /status  the table as JSON
+The daemon needs aiohttp.
 '''
 
 import os
 import sys
+import time
+import json
+import heapq
+import random
 import signal
+import asyncio
+import argparse
 import configparser
 from concurrent.futures import ThreadPoolExecutor
-from concurrent.futures import as_completed
+from concurrent.futures import wait
+from concurrent.futures import FIRST_COMPLETED
 from ilo import iLO
+from ilo import AsyncILO
+from ilo import SessionStore
+from ilo import AdaptiveLimit
+try:
+	from aiohttp import web
+except ImportError:
+	web = None
 
 
 fmt_str = '{:>15}{:>10}{:>7}{:>11}'
+header = fmt_str.format('Server_IP', 'Health', 'Power', 'AutoOn')
+
+
+def new_row(iloip, error = None):
+	return {'ip': iloip, 'health': None, 'power': None, 'auto_on': None,
+			'error': error, 'seconds': None}
+
 
-def fetch_status(iloip, username, password):
+def format_row(row):
+	return fmt_str.format(row['ip'], *[row[k] or 'N/A' for k in ('health', 'power', 'auto_on')])
+
+
+def fetch_status(iloip, username, password, store = None, timeout = 10, started = None):
+	'''Return the row of a server.
+
+	started: a dict to put the start time of the poll into, by iloip
+	'''
+	start = time.monotonic()
+	if started is not None:
+		started[iloip] = start
 	ilo_host = 'https://' + iloip
-	i = iLO(ilo_host, username, password)
+	i = iLO(ilo_host, username, password, timeout = timeout, session_store = store)
 	try:
 		i.login()
-		my_status = i.get_system(iLO.SYSTEM_HEALTH)
-		my_power = i.get_system(iLO.POWER_STATE)
-		my_auto_on = i.get_system(iLO.POWER_AUTO_ON)
-		r = fmt_str.format(iloip, my_status[0], my_power[0], my_auto_on[0])
-	except Exception as e:
-		raise e
+		# all three are in /Systems/1, fetch it once
+		values = i.get_many([iLO.SYSTEM_HEALTH, iLO.POWER_STATE, iLO.POWER_AUTO_ON])
+		r = new_row(iloip)
+		r['health'] = values[iLO.SYSTEM_HEALTH][0]
+		r['power'] = values[iLO.POWER_STATE][0]
+		r['auto_on'] = values[iLO.POWER_AUTO_ON][0]
+		r['seconds'] = time.monotonic() - start
 	finally:
 		i.logout()
 	return r
 
 
+def fetch_limited(limit, *args):
+	'''fetch_status() in a slot of the AdaptiveLimit limit'''
+	start = limit.acquire()
+	# a poll which failed without congestion, e.g. refused by an iLO which
+	# is down or with a wrong password, tells nothing about the limit
+	ok = None
+	try:
+		r = fetch_status(*args)
+		ok = True
+		return r
+	except Exception as e:
+		if AdaptiveLimit.congested(e):
+			ok = False
+		raise
+	finally:
+		limit.release(start, ok)
+
+
+def poll_all(servers, username, password, store = None, timeout = 15, workers = 32,
+		limit = None):
+	'''Poll servers with a pool of threads, yield the row of each server as
+	soon as it is done, failed or has taken more than timeout seconds.
+
+	A timed out poll is left to run into the timeout of its requests, its
+	row is not yielded again. With an AdaptiveLimit limit, the polls in
+	flight follow limit instead of workers.
+	'''
+	started = {}
+	if limit is not None:
+		pe = ThreadPoolExecutor(max_workers=limit.maximum)
+		submit = lambda *args: pe.submit(fetch_limited, limit, *args)
+	else:
+		pe = ThreadPoolExecutor(max_workers=workers)
+		submit = lambda *args: pe.submit(fetch_status, *args)
+	try:
+		futures = {submit(ip, username, password, store, timeout, started): ip
+				for ip in servers}
+		pending = set(futures)
+		while pending:
+			deadlines = [started[futures[f]] + timeout for f in pending if futures[f] in started]
+			left = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+			done, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+			for f in done:
+				try:
+					yield f.result()
+				except Exception as e:
+					yield new_row(futures[f], repr(e))
+			now = time.monotonic()
+			for f in list(pending):
+				ip = futures[f]
+				if ip in started and now - started[ip] >= timeout:
+					pending.discard(f)
+					r = new_row(ip, 'timed out')
+					r['seconds'] = now - started[ip]
+					yield r
+	finally:
+		pe.shutdown(wait=False, cancel_futures=True)
+
+
+class Monitor:
+	'''Poll servers in the background and keep the latest status.
+
+	servers: dict of iLO ip -> seconds between polls
+	concurrency: polls in flight at most
+	timeout: seconds a poll may take
+	'''
+
+	RESOURCES = [iLO.SYSTEM_HEALTH, iLO.POWER_STATE, iLO.POWER_AUTO_ON]
+	# a next poll is moved by up to this part of the interval
+	JITTER = 0.1
+	# seconds the logout of a failed client may take
+	LOGOUT_TIMEOUT = 5
+
+	def __init__(self, servers, username, password, store = None,
+			concurrency = 64, timeout = 15):
+		self.servers = servers
+		self.username = username
+		self.password = password
+		self.store = store
+		self.concurrency = concurrency
+		self.timeout = timeout
+		# ip -> latest result, see poll()
+		self.table = {}
+		# ip -> logged in AsyncILO
+		self.ilos = {}
+		# heap of (due time, ip)
+		self.queue = []
+		self.http = None
+
+	def _schedule(self, ip, delay):
+		heapq.heappush(self.queue, (self.loop.time() + delay, ip))
+		self.wakeup.set()
+
+	async def run(self):
+		self.loop = asyncio.get_running_loop()
+		self.wakeup = asyncio.Event()
+		self.limit = asyncio.Semaphore(self.concurrency)
+		polls = set()
+		async with AsyncILO.client_session() as self.http:
+			# spread the first polls over the interval
+			for ip, interval in self.servers.items():
+				self._schedule(ip, random.uniform(0, interval))
+			try:
+				while True:
+					self.wakeup.clear()
+					if not self.queue:
+						# every server is being polled
+						await self.wakeup.wait()
+						continue
+					due, ip = self.queue[0]
+					delay = due - self.loop.time()
+					if delay > 0:
+						try:
+							await asyncio.wait_for(self.wakeup.wait(), delay)
+						except asyncio.TimeoutError:
+							pass
+						continue
+					heapq.heappop(self.queue)
+					task = asyncio.ensure_future(self.poll(ip))
+					polls.add(task)
+					task.add_done_callback(polls.discard)
+			finally:
+				for task in list(polls):
+					task.cancel()
+				await asyncio.gather(*[i.logout() for i in self.ilos.values()],
+						return_exceptions = True)
+
+	async def _login(self, ip):
+		i = self.ilos.get(ip)
+		if i is None:
+			i = AsyncILO('https://' + ip, self.username, self.password, self.http,
+					timeout = self.timeout, session_store = self.store)
+			await i.login()
+			self.ilos[ip] = i
+		return i
+
+	async def poll(self, ip):
+		'''Poll ip once, update the table and schedule the next poll'''
+		row = new_row(ip)
+		start = self.loop.time()
+		try:
+			async with self.limit:
+				values = await asyncio.wait_for(self._poll(ip), self.timeout)
+			row['health'] = values[iLO.SYSTEM_HEALTH][0]
+			row['power'] = values[iLO.POWER_STATE][0]
+			row['auto_on'] = values[iLO.POWER_AUTO_ON][0]
+			row['error'] = None
+		except asyncio.CancelledError:
+			raise
+		except Exception as e:
+			row['error'] = repr(e)
+			# log in again next time, do not leave the session behind
+			i = self.ilos.pop(ip, None)
+			if i is not None:
+				try:
+					await asyncio.wait_for(i.logout(), Monitor.LOGOUT_TIMEOUT)
+				except asyncio.CancelledError:
+					raise
+				except Exception:
+					pass
+		row['seconds'] = self.loop.time() - start
+		row['updated'] = time.time()
+		self.table[ip] = row
+		interval = self.servers[ip]
+		self._schedule(ip, interval * random.uniform(1 - Monitor.JITTER, 1 + Monitor.JITTER))
+
+	async def _poll(self, ip):
+		i = await self._login(ip)
+		return await i.get_many(Monitor.RESOURCES, use_cache = False)
+
+	def format_table(self):
+		lines = [header] + [format_row(self.table[ip]) for ip in sorted(self.table)]
+		return '\n'.join(lines) + '\n'
+
+	async def _get_table(self, request):
+		return web.Response(text = self.format_table())
+
+	async def _get_status(self, request):
+		rows = [self.table[ip] for ip in sorted(self.table)]
+		return web.json_response(rows)
+
+	async def serve(self, address):
+		'''Run and serve the table on address, "host:port" or "unix:/path"'''
+		app = web.Application()
+		app.router.add_get('/', self._get_table)
+		app.router.add_get('/status', self._get_status)
+		runner = web.AppRunner(app, access_log = None)
+		await runner.setup()
+		if address.startswith('unix:'):
+			site = web.UnixSite(runner, address[5:])
+		else:
+			host, port = address.rsplit(':', 1)
+			site = web.TCPSite(runner, host, int(port))
+		await site.start()
+		try:
+			await self.run()
+		finally:
+			await runner.cleanup()
+
+
 if __name__ == '__main__':
+	ap = argparse.ArgumentParser(description = 'Monitor servers via iLO, see servers.cfg')
+	ap.add_argument('--daemon', action='store_true',
+			help='Keep polling and serve the latest status, needs aiohttp')
+	ap.add_argument('--listen', default='127.0.0.1:8088',
+			help='host:port or unix:/path to serve the status on, default is 127.0.0.1:8088')
+	ap.add_argument('--interval', type=float, default=60,
+			help='Default seconds between polls of a server, default is 60')
+	ap.add_argument('--concurrency', type=int, default=64,
+			help='Polls in flight at most in daemon mode, default is 64')
+	ap.add_argument('--timeout', type=float, default=15,
+			help='Seconds a poll of one server may take, default is 15')
+	ap.add_argument('--workers', type=int, default=32,
+			help='Threads polling servers in one-shot mode, default is 32')
+	ap.add_argument('--adaptive', type=int, metavar='MAX',
+			help='Adapt the polls in flight to the iLO latency and errors, '
+			'from --workers up to MAX, and log the changes on stderr')
+	output = ap.add_mutually_exclusive_group()
+	output.add_argument('--stream', action='store_true',
+			help='Print each row as soon as its server is done')
+	output.add_argument('--ndjson', action='store_true',
+			help='Print each row as soon as its server is done, as a JSON line')
+	arguments = ap.parse_args()
+	if arguments.daemon and web is None:
+		ap.error('--daemon needs aiohttp')
+
 	def ki_handler(signum, stack_frame):
 		exit(0)
 	signal.signal(signal.SIGINT, ki_handler)
 
 	rootdir = os.path.dirname(sys.argv[0])
-	config = configparser.ConfigParser()
+	config = configparser.ConfigParser(allow_no_value=True)
 	try:
 		config.read_file(open(os.path.join(rootdir, 'servers.cfg')))
 	except Exception:
@@ -57,27 +341,50 @@ if __name__ == '__main__':
 
 	ilo_user = config.get('iLO', 'username')
 	ilo_pass = config.get('iLO', 'password')
+	store = None
+	if config.has_option('iLO', 'session_store'):
+		store = SessionStore(os.path.join(rootdir, config.get('iLO', 'session_store')))
 	results = []
 
-	with ThreadPoolExecutor(max_workers=32) as pe:
-		# create a dict to hold all futures by list comprehension
-		# then wait for all futures to finish and return result
-		task_futures = {pe.submit(fetch_status, my_ip, ilo_user, ilo_pass): my_ip \
-				for my_ip in config.options('servers')}
-		try:
-			for tf in as_completed(task_futures, timeout=15):
-				iloip = task_futures[tf]
-				try:
-					results.append(tf.result())
-				except Exception as e:
-					print('Exception on', iloipe, e, file=sys.stderr)
-					results.append(fmt_str.format(iloip, 'N/A', 'N/A', 'N/A'))
-		except Exception as e:
-			print(e, file=sys.stderr)
+	if arguments.daemon:
+		servers = {ip: float(interval or arguments.interval)
+				for ip, interval in config.items('servers')}
+		monitor = Monitor(servers, ilo_user, ilo_pass, store, arguments.concurrency,
+				arguments.timeout)
+		asyncio.run(monitor.serve(arguments.listen))
+		exit(0)
+
+	limit = None
+	if arguments.adaptive:
+		begin = time.monotonic()
+		def log_limit(before, after, latency):
+			print('{:8.2f}s concurrency {} -> {}, latency {:.3f}s'.format(
+					time.monotonic() - begin, before, after, latency), file=sys.stderr)
+		limit = AdaptiveLimit(arguments.workers, maximum=arguments.adaptive, log=log_limit)
 
-	results.sort()
-	print(fmt_str.format('Server_IP', 'Health', 'Power', 'AutoOn'))
-	for i in results:
-		print(i)
-	exit(0)
+	failed = []
+	if arguments.stream:
+		print(header, flush=True)
+	for row in poll_all(config.options('servers'), ilo_user, ilo_pass, store,
+			arguments.timeout, arguments.workers, limit):
+		if row['error'] is not None:
+			failed.append(row)
+		if arguments.ndjson:
+			print(json.dumps(row), flush=True)
+		elif arguments.stream:
+			print(format_row(row), flush=True)
+		else:
+			results.append(row)
 
+	if results:
+		print(header)
+		for row in sorted(results, key=lambda r: r['ip']):
+			print(format_row(row))
+	if failed:
+		print('{} of {} servers failed:'.format(len(failed), len(config.options('servers'))),
+				file=sys.stderr)
+		for row in sorted(failed, key=lambda r: r['ip']):
+			print('{:>15}  {}'.format(row['ip'], row['error']), file=sys.stderr)
+	sys.stdout.flush()
+	# do not wait for polls which timed out
+	os._exit(0)